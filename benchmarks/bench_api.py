@@ -0,0 +1,176 @@
+"""
+Бенчмарк анализатора против локального заменителя GitHub API.
+
+Запускает benchmarks/fake_github.py в отдельном процессе и прогоняет через
+него select_active_commiters, count_pull_requests, count_issues и main()
+целиком. Для каждого случая выводятся время, пропускная способность
+(элементов в секунду), количество запросов по кодам ответа и пик памяти
+анализатора (tracemalloc, отдельным прогоном, т.к. он замедляет работу).
+Результаты можно сохранить в JSON, чтобы сравнивать между версиями.
+
+Использование:
+python benchmarks/bench_api.py [опции]
+
+Опции:
+    --size          Количество коммитов, PR и issue. По умолчанию - 10000.
+    --latency       Задержка каждого ответа в миллисекундах.
+    --errors        Доля ответов 502 (от 0 до 1).
+    --rate-limit    Лимит запросов на окно в 2 секунды.
+    --no-memory     Не измерять пик памяти.
+    --json          Сохранить результаты в файл в формате JSON.
+"""
+import contextlib
+import getopt
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime, timedelta
+from functools import partial
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import github_analyzer as ga  # noqa: E402
+
+# Интервал анализа - вся синтетическая история (см. fake_github.NOW)
+FROM_DATE = datetime(1970, 1, 1)
+TO_DATE = datetime(2020, 6, 2)
+
+
+def start_server(size, latency, errors, rate_limit):
+    """Запускает заменитель GitHub API и возвращает (процесс, адрес)."""
+    args = [sys.executable, os.path.join(HERE, 'fake_github.py'),
+            '--size', str(size), '--latency', str(latency),
+            '--errors', str(errors)]
+    if rate_limit:
+        args += ['--rate-limit', str(rate_limit)]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def server_stats(root):
+    """Количество обработанных сервером запросов по кодам ответа."""
+    with urllib.request.urlopen(root + '/_stats') as r:
+        return {int(k): v for k, v in json.load(r).items()}
+
+
+def reset_state():
+    """Сбрасывает состояние анализатора между случаями."""
+    ga._cache = None
+    ga._checkpoints = None
+    ga._governor = ga.RateLimitGovernor()
+
+
+def run_main(*args):
+    """Запускает main() с аргументами командной строки, подавляя вывод."""
+    argv = sys.argv
+    sys.argv = ['github_analyzer.py'] + list(args)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rc = ga.main()
+    finally:
+        sys.argv = argv
+    if rc != 0:
+        raise RuntimeError('main() вернул {}'.format(rc))
+
+
+def measure(root, func, memory, prepare=None):
+    """
+    Прогоняет func и возвращает время, запросы по кодам и пик памяти.
+
+    prepare - функция, выполняемая перед замером (например, заполняющая
+    кэш).
+    """
+    if prepare is not None:
+        reset_state()
+        prepare()
+    reset_state()
+    before = server_stats(root)
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    after = server_stats(root)
+    requests = {code: after.get(code, 0) - before.get(code, 0)
+                for code in sorted(after)
+                if after.get(code, 0) != before.get(code, 0)}
+
+    peak = None
+    if memory:
+        reset_state()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return elapsed, requests, peak
+
+
+def main():
+    opts, _ = getopt.getopt(sys.argv[1:], '', [
+        'size=', 'latency=', 'errors=', 'rate-limit=', 'no-memory', 'json='])
+    options = dict(opts)
+    size = int(options.get('--size', 10000))
+    memory = '--no-memory' not in options
+
+    process, root = start_server(
+        size, float(options.get('--latency', 0)),
+        float(options.get('--errors', 0)),
+        int(options.get('--rate-limit', 0)))
+    ga.GITHUB_API_ROOT = root
+    # Повторы после ответов 5xx не должны занимать большую часть времени
+    ga.BACKOFF_BASE = 0.01
+    cache_dir = tempfile.mkdtemp(prefix='bench_api_')
+    # Вся история для main(): дата начала совпадает с созданием репозитория
+    since = (datetime(2020, 6, 1) - timedelta(minutes=53) * size
+             - timedelta(days=1)).strftime(ga.DATE_FORMAT)
+    args = ['--no-graphql', '--cache-dir', cache_dir, '-f', since,
+            '-t', '2020-06-02', 'https://github.com/o/r']
+
+    cached_main = partial(run_main, *args)
+    cases = [
+        ('select_active_commiters', size, partial(
+            ga.select_active_commiters, 'o', 'r', 'master', FROM_DATE,
+            TO_DATE), None),
+        ('count_pull_requests', size, partial(
+            ga.count_pull_requests, 'o', 'r', 'master', FROM_DATE, TO_DATE),
+         None),
+        ('count_issues', size, partial(
+            ga.count_issues, 'o', 'r', FROM_DATE, TO_DATE), None),
+        ('main', 3 * size, partial(run_main, '--no-cache', *args), None),
+        # Кэш заполняется заранее, и неизменившиеся страницы приходят
+        # ответами 304
+        ('main с кэшем', 3 * size, cached_main, cached_main),
+    ]
+
+    results = []
+    try:
+        print('{:<24} {:>9} {:>12} {:>10} {:>24}'.format(
+            'Случай', 'Время, с', 'Элем./с', 'Пик, МБ', 'Запросы'))
+        for name, items, func, prepare in cases:
+            elapsed, requests, peak = measure(root, func, memory, prepare)
+            results.append({'case': name, 'items': items,
+                            'seconds': round(elapsed, 3),
+                            'items_per_second': round(items / elapsed),
+                            'requests': requests,
+                            'peak_bytes': peak})
+            print('{:<24} {:>9.2f} {:>12.0f} {:>10} {:>24}'.format(
+                name, elapsed, items / elapsed,
+                '{:.2f}'.format(peak / 2 ** 20) if peak is not None else '-',
+                ' '.join('{}:{}'.format(*item) for item in requests.items())))
+    finally:
+        process.terminate()
+        process.wait()
+
+    if '--json' in options:
+        with open(options['--json'], 'w', encoding='utf-8') as f:
+            json.dump({'size': size, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Микробенчмарк подсчёта открытых, закрытых и "старых" PR/issue.
+
+Сравнивает прежний подсчёт тремя отдельными проходами по странице с
+разбором даты в каждом из них и однопроходный classify() по записям Item,
+созданным один раз. Данные - синтетические страницы по 100 элементов.
+
+Использование:
+python benchmarks/bench_classify.py [количество элементов]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import github_analyzer as ga  # noqa: E402
+
+
+def make_pages(count, page_size=100, seed=1):
+    """Синтетические страницы ответа GitHub в порядке убывания даты
+    создания."""
+    rnd = random.Random(seed)
+    now = datetime(2020, 6, 1)
+    pages, page = [], []
+    for i in range(count):
+        created = now - timedelta(minutes=10 * i)
+        closed = None
+        if rnd.random() < 0.7:
+            closed = created + timedelta(days=rnd.randint(0, 60))
+        page.append({
+            'created_at': created.isoformat() + 'Z',
+            'closed_at': closed.isoformat() + 'Z' if closed else None,
+            'state': 'closed' if closed else 'open',
+        })
+        if len(page) == page_size:
+            pages.append(page)
+            page = []
+    if page:
+        pages.append(page)
+    return pages
+
+
+def count_before(pages, from_date, to_date, t, age):
+    """Прежний подсчёт: три прохода по странице, дата разбирается в каждом
+    условии заново."""
+    str2datetime = ga.str2datetime
+
+    def count_open(response):
+        return sum(1 for pr in response
+                   if str2datetime(pr['created_at']) < to_date
+                   and str2datetime(pr['created_at']) >= from_date
+                   and (pr['state'] == 'open'
+                        or str2datetime(pr['closed_at']) >= to_date))
+
+    def count_closed(response):
+        return sum(1 for pr in response
+                   if str2datetime(pr['created_at']) < to_date
+                   and str2datetime(pr['created_at']) >= from_date
+                   and pr['state'] == 'closed'
+                   and str2datetime(pr['closed_at']) < to_date)
+
+    def count_stale(response):
+        return sum(1 for pr in response
+                   if str2datetime(pr['created_at']) < to_date
+                   and str2datetime(pr['created_at']) >= from_date
+                   and pr['state'] == 'open'
+                   and (t - str2datetime(pr['created_at'])).days > age)
+
+    total = [0, 0, 0]
+    for page in pages:
+        total[0] += count_open(page)
+        total[1] += count_closed(page)
+        total[2] += count_stale(page)
+    return tuple(total)
+
+
+def count_after(pages, from_date, to_date, t, age):
+    """Новый подсчёт: записи создаются один раз, время сравнивается без
+    разбора, один проход."""
+    from_time, to_time = ga.isotime(from_date), ga.isotime(to_date)
+    stale_time = ga.isotime(t - timedelta(days=age + 1))
+    total = [0, 0, 0]
+    for page in pages:
+        items = [ga.Item.from_json(item) for item in page]
+        o, c, s = ga.classify(items, from_time, to_time, stale_time)
+        total[0] += o
+        total[1] += c
+        total[2] += s
+    return tuple(total)
+
+
+def measure(func, pages, count, *args):
+    """Возвращает результат функции и скорость в записях в секунду."""
+    start = time.perf_counter()
+    result = func(pages, *args)
+    return result, count / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    pages = make_pages(count)
+    # Окно захватывает большую часть данных
+    from_date, to_date = datetime(2018, 8, 1), datetime(2020, 5, 1)
+    t = datetime(2020, 6, 1)
+
+    before, before_rate = measure(
+        count_before, pages, count, from_date, to_date, t, 30)
+    after, after_rate = measure(
+        count_after, pages, count, from_date, to_date, t, 30)
+    assert before == after, (before, after)
+
+    print('Записей: {}, результат: {}'.format(count, after))
+    print('Три прохода:     {:12,.0f} записей/с'.format(before_rate))
+    print('Один проход:     {:12,.0f} записей/с'.format(after_rate))
+    print('Ускорение:       {:12.1f}x'.format(after_rate / before_rate))
+
+
+if __name__ == '__main__':
+    main()
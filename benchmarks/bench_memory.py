@@ -0,0 +1,176 @@
+"""
+Бенчмарк памяти, занимаемой обходом длинной истории.
+
+Подсчитывает самых активных участников и issue по синтетической истории
+разной длины и измеряет tracemalloc пик выделенной памяти. Ответы GitHub
+подменяются в процессе: страницы из PER_PAGE элементов с полным набором
+полей, как у настоящего API, генерируются заранее. Страницы запрашиваются
+по одной (WINDOW), чтобы пик не зависел от порядка работы потоков. Пик
+памяти не должен расти с длиной истории - иначе бенчмарк завершается
+ошибкой. Та же проверка на коротких историях - tests/test_memory.py.
+
+Использование:
+python benchmarks/bench_memory.py [наибольшее количество страниц]
+"""
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import github_analyzer as ga  # noqa: E402
+
+NOW = datetime(2020, 6, 1)
+# Логины интернированы и живут весь процесс, как в обходе (sys.intern):
+# иначе после каждого замера они освобождаются, следующий замер снова
+# добавляет их в таблицу интернированных строк, и её однократное
+# расширение попадает в пик случайного замера
+LOGINS = [sys.intern('user{}'.format(i)) for i in range(200)]
+# Допустимый рост пика памяти между самой короткой и самой длинной историей
+MAX_GROWTH = 1.5
+# Сколько страниц paginate запрашивает одновременно. С окном больше одной
+# страницы пик зависит от того, сколько страниц успели получить потоки
+# окна, а не от длины истории, и меняется от запуска к запуску
+WINDOW = 1
+
+
+class FakeResponse:
+    """Ответ со страницей списка и заголовком Link."""
+
+    status_code = 200
+
+    def __init__(self, content, links):
+        self.content = content
+        self.links = links
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def make_commit(i, rnd):
+    date = (NOW - timedelta(minutes=i)).strftime(ga.GITHUB_TIME_FORMAT)
+    login = rnd.choice(LOGINS)
+    person = {'name': login, 'email': login + '@example.com', 'date': date}
+    return {
+        'sha': '{:040x}'.format(i),
+        'url': 'https://api.github.com/repos/o/r/commits/{:040x}'.format(i),
+        'commit': {'author': person, 'committer': person,
+                   'message': 'Commit message ' * 10, 'comment_count': 0},
+        'author': {'login': login, 'id': i, 'type': 'User',
+                   'avatar_url': 'https://avatars.example.com/' + login},
+        'committer': {'login': login, 'id': i, 'type': 'User'},
+        'parents': [{'sha': '{:040x}'.format(i + 1)}],
+    }
+
+
+def make_issue(i, rnd):
+    created = NOW - timedelta(hours=i)
+    closed = None
+    if rnd.random() < 0.7:
+        closed = created + timedelta(days=rnd.randint(0, 60))
+    return {
+        'number': i,
+        'title': 'Issue title ' * 5,
+        'body': 'Issue body ' * 50,
+        'user': {'login': rnd.choice(LOGINS), 'id': i},
+        'labels': [{'name': 'bug', 'color': 'ff0000'}],
+        'state': 'closed' if closed else 'open',
+        'created_at': created.strftime(ga.GITHUB_TIME_FORMAT),
+        'closed_at': closed.strftime(ga.GITHUB_TIME_FORMAT)
+        if closed else None,
+    }
+
+
+def make_pages(make, count=16):
+    """Тела count разных страниц, которые отдаются по кругу: генерировать
+    каждую страницу заново слишком долго под tracemalloc."""
+    pages = []
+    for page in range(count):
+        rnd = random.Random(page)
+        first = page * ga.PER_PAGE
+        pages.append(json.dumps([make(first + i, rnd)
+                                 for i in range(ga.PER_PAGE)]).encode('utf-8'))
+    return pages
+
+
+COMMIT_PAGES = make_pages(make_commit)
+ISSUE_PAGES = make_pages(make_issue)
+
+
+def fake_http_get(pages):
+    """Подмена http_get, отдающая pages страниц коммитов или issue."""
+    def http_get(url, params=None, **kwargs):
+        query = dict(parse_qsl(urlsplit(url).query))
+        query.update(params or {})
+        page = int(query.get('page', 1))
+        base = url.split('?')[0]
+        bodies = COMMIT_PAGES if base.endswith('/commits') else ISSUE_PAGES
+        links = {'last': {'url': '{}?page={}'.format(base, pages)}}
+        if page < pages:
+            links['next'] = {'url': '{}?page={}'.format(base, page + 1)}
+        return FakeResponse(bodies[page % len(bodies)], links)
+
+    return http_get
+
+
+def measure(func, pages):
+    """Возвращает пик памяти в байтах и время выполнения func."""
+    http_get, window = ga.http_get, ga.PAGE_WINDOW
+    ga.http_get, ga.PAGE_WINDOW = fake_http_get(pages), WINDOW
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        ga.http_get, ga.PAGE_WINDOW = http_get, window
+    return peak, elapsed
+
+
+def cases():
+    """Список пар (название, функция) измеряемых обходов: участники
+    основной ветки и issue (список /issues REST API) за всю историю."""
+    from_date, to_date = datetime(1970, 1, 1), NOW + timedelta(days=1)
+    return [
+        ('участники', lambda: ga.select_active_commiters(
+            'o', 'r', 'master', from_date, to_date)),
+        ('issue', lambda: ga.count_issues('o', 'r', from_date, to_date)),
+    ]
+
+
+def sizes(max_pages):
+    """Длины историй в страницах. Самая короткая - все разные тела
+    страниц, которые отдаются по кругу (см. make_pages)."""
+    return [len(COMMIT_PAGES), max_pages // 4, max_pages]
+
+
+def main():
+    max_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    failed = False
+    for name, func in cases():
+        peaks = []
+        for pages in sizes(max_pages):
+            peak, elapsed = measure(func, pages)
+            peaks.append(peak)
+            print('{:<10} страниц: {:6d}  пик памяти: {:8.2f} МБ  '
+                  '{:6.2f} с'.format(name, pages, peak / 2 ** 20, elapsed))
+        growth = peaks[-1] / peaks[0]
+        print('{:<10} рост пика памяти: {:.2f}x'.format(name, growth))
+        failed = failed or growth > MAX_GROWTH
+
+    if failed:
+        print('Пик памяти растёт с длиной истории')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Бенчмарк запуска анализатора.
+
+Измеряет время импорта модуля (python -X importtime) и время запуска
+скрипта в новом процессе: вывод справки, ошибка разбора опций и отчёт за
+короткий интервал против локального заменителя GitHub API
+(benchmarks/fake_github.py) без кэша, с пустым каталогом кэша и с кэшем,
+заполненным предыдущим запуском. Для каждого случая выводятся медиана
+времени и количество запросов к серверу за один запуск, а также
+импортируется ли requests. Перед замером модуль компилируется в байт-код,
+чтобы не учитывать компиляцию.
+
+Использование:
+python benchmarks/bench_startup.py [опции]
+
+Опции:
+    --runs          Количество запусков каждого случая. По умолчанию - 10.
+    --latency       Задержка каждого ответа сервера в миллисекундах.
+                    По умолчанию - 50.
+    --json          Сохранить результаты в файл в формате JSON.
+"""
+import compileall
+import getopt
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_api import server_stats, start_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SCRIPT = os.path.join(ROOT, 'github_analyzer.py')
+
+# Запуск main() в новом процессе с адресом заменителя GitHub API
+RUNNER = """\
+import sys
+import github_analyzer as ga
+ga.GITHUB_API_ROOT = sys.argv[1]
+sys.argv = ['github_analyzer.py'] + sys.argv[2:]
+try:
+    sys.exit(ga.main())
+finally:
+    print('requests' in sys.modules, file=sys.stderr)
+"""
+# Короткий интервал в конце синтетической истории (см. fake_github.NOW)
+WINDOW = ['-f', '2020-05-25', '-t', '2020-06-02']
+
+
+def import_time():
+    """Время импорта модуля в микросекундах, самые долгие импорты
+    верхнего уровня и признак импорта requests."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         "import sys, github_analyzer; print('requests' in sys.modules)"],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    total, top, children = None, [], []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)', line)
+        if not match:
+            continue
+        # Вложенные импорты выводятся перед импортом, который их вызвал
+        if len(match[2]) == 3:
+            children.append((int(match[1]), match[3]))
+        elif len(match[2]) == 1:
+            if match[3] == 'github_analyzer':
+                total, top = int(match[1]), children
+            children = []
+    return total, sorted(top, reverse=True)[:5], \
+        result.stdout.strip() == 'True'
+
+
+def timed(args):
+    """Запускает процесс и возвращает время в секундах и stderr."""
+    start = time.perf_counter()
+    result = subprocess.run(args, cwd=ROOT, capture_output=True, text=True)
+    return time.perf_counter() - start, result.stderr
+
+
+def run_case(runs, args, root=None, prepare=None):
+    """
+    Запускает случай runs раз и возвращает медиану времени, среднее
+    количество запросов к серверу и признак импорта requests.
+
+    prepare - функция, выполняемая перед каждым запуском.
+    """
+    times, count, imported = [], 0, None
+    for _ in range(runs):
+        if prepare is not None:
+            prepare()
+        before = server_stats(root) if root else {}
+        elapsed, stderr = timed(args)
+        times.append(elapsed)
+        if root:
+            after = server_stats(root)
+            count += sum(after.values()) - sum(before.values())
+        lines = stderr.split()
+        if lines and lines[-1] in ('True', 'False'):
+            imported = lines[-1] == 'True'
+    return statistics.median(times), count / runs if root else None, \
+        imported
+
+
+def main():
+    opts, _ = getopt.getopt(sys.argv[1:], '', ['runs=', 'latency=',
+                                               'json='])
+    options = dict(opts)
+    runs = int(options.get('--runs', 10))
+
+    compileall.compile_file(SCRIPT, quiet=1)
+    imports = [import_time() for _ in range(runs)]
+    total = statistics.median(item[0] for item in imports)
+    print('Импорт модуля: {:.1f} мс, requests {}'.format(
+        total / 1000, 'импортируется' if imports[0][2] else
+        'не импортируется'))
+    for cumulative, name in imports[0][1]:
+        print('    {:<24} {:>7.1f} мс'.format(name, cumulative / 1000))
+
+    process, root = start_server(1000, float(options.get('--latency', 50)),
+                                 0, 0)
+    cache_dir = tempfile.mkdtemp(prefix='bench_startup_')
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    runner = [sys.executable, '-c', RUNNER, root]
+    network = WINDOW + ['--no-graphql', '--cache-dir', cache_dir,
+                        'https://github.com/o/r']
+    cases = [
+        ('--help', runner + ['--help'], None, None),
+        ('ошибка опции', runner + ['-f', '2020-13-01', 'x'], None, None),
+        ('отчёт без кэша', runner + ['--no-cache'] + network, root, None),
+        ('отчёт, пустой кэш', runner + network, root, clear_cache),
+        ('отчёт, кэш заполнен', runner + network, root, None),
+    ]
+
+    results = [{'case': 'import', 'milliseconds': round(total / 1000, 1),
+                'requests_imported': imports[0][2]}]
+    try:
+        print('{:<22} {:>9} {:>9} {:>10}'.format(
+            'Случай', 'Время, мс', 'Запросы', 'requests'))
+        for name, args, server, prepare in cases:
+            elapsed, count, imported = run_case(runs, args, server, prepare)
+            results.append({'case': name,
+                            'milliseconds': round(elapsed * 1000, 1),
+                            'requests': count,
+                            'requests_imported': imported})
+            print('{:<22} {:>9.1f} {:>9} {:>10}'.format(
+                name, elapsed * 1000,
+                '{:.1f}'.format(count) if count is not None else '-',
+                {True: 'да', False: 'нет', None: '-'}[imported]))
+    finally:
+        process.terminate()
+        process.wait()
+        clear_cache()
+
+    if '--json' in options:
+        with open(options['--json'], 'w', encoding='utf-8') as f:
+            json.dump({'runs': runs, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
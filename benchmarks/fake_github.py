@@ -0,0 +1,304 @@
+"""
+Локальный заменитель GitHub API для бенчмарков.
+
+Отдаёт синтетические ответы /rate_limit, /repos/{owner}/{repo} и списки
+/commits, /pulls и /issues любого размера. Элементы списков вычисляются по
+номеру при каждом запросе, поэтому даже список из миллиона элементов не
+занимает памяти. Поддерживаются постраничная выдача с заголовками Link,
+фильтр коммитов по since/until, ETag и ответ 304, искусственная задержка,
+ответы 5xx и исчерпание лимита запросов (403 с X-RateLimit-Remaining: 0).
+
+Служебный запрос GET /_stats возвращает количество обработанных запросов
+по кодам ответа и не учитывается в нём.
+
+Использование:
+python benchmarks/fake_github.py [опции]
+
+Опции:
+    --port          Порт, 0 - любой свободный (по умолчанию). Выбранный
+                    адрес печатается первой строкой.
+    --size          Количество коммитов, PR и issue. По умолчанию - 10000.
+    --latency       Задержка каждого ответа в миллисекундах.
+    --errors        Доля ответов 502 (от 0 до 1).
+    --rate-limit    Лимит запросов на окно --rate-reset секунд, после
+                    исчерпания отвечать 403. По умолчанию - без лимита.
+    --rate-reset    Длительность окна лимита в секундах. По умолчанию - 2.
+"""
+import getopt
+import hashlib
+import json
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Время самого нового элемента списков
+NOW = datetime(2020, 6, 1)
+# Интервалы между соседними коммитами и между соседними PR и issue
+COMMIT_STEP = timedelta(minutes=7)
+ITEM_STEP = timedelta(minutes=53)
+LOGINS = ['user{}'.format(i) for i in range(300)]
+MAX_PER_PAGE = 100
+
+
+def commit(i):
+    """Коммит номер i (0 - самый новый)."""
+    date = (NOW - COMMIT_STEP * i).strftime(TIME_FORMAT)
+    # Распределение коммитов по участникам неравномерное, как в настоящих
+    # репозиториях: у первых участников их больше всего
+    share = (i * 7919 % 1000) / 1000
+    login = LOGINS[int(len(LOGINS) * share ** 3)]
+    sha = '{:040x}'.format(i)
+    person = {'name': login, 'email': login + '@example.com', 'date': date}
+    return {
+        'sha': sha,
+        'url': 'https://api.github.com/repos/o/r/commits/' + sha,
+        'commit': {'author': person, 'committer': person,
+                   'message': 'Change number {}'.format(i),
+                   'comment_count': 0},
+        'author': {'login': login, 'id': i % 1000, 'type': 'User'},
+        'committer': {'login': login, 'id': i % 1000, 'type': 'User'},
+        'parents': [{'sha': '{:040x}'.format(i + 1)}],
+    }
+
+
+def item(i, pull):
+    """PR (pull) или issue номер i (0 - самый новый)."""
+    created = NOW - ITEM_STEP * i
+    closed = None
+    # Примерно 70% элементов закрыты через 0-59 дней после создания
+    if i % 10 < 7:
+        closed = created + timedelta(days=(i * 31) % 60)
+        if closed > NOW:
+            closed = None
+    data = {
+        'number': i + 1,
+        'title': 'Item number {}'.format(i),
+        'body': 'Description ' * 20,
+        'user': {'login': LOGINS[i % len(LOGINS)], 'id': i % 1000},
+        'labels': [{'name': 'bug', 'color': 'ff0000'}] if i % 5 == 0 else [],
+        'state': 'closed' if closed else 'open',
+        'created_at': created.strftime(TIME_FORMAT),
+        'updated_at': (closed or created).strftime(TIME_FORMAT),
+        'closed_at': closed.strftime(TIME_FORMAT) if closed else None,
+    }
+    if pull:
+        data['base'] = {'ref': 'master'}
+    elif i % 4 == 3:
+        # Список issue GitHub содержит и PR
+        data['pull_request'] = {'url': 'https://api.github.com/pulls/{}'
+                                       .format(i + 1)}
+    return data
+
+
+def parse_time(value):
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def index_range(since, until, step, size):
+    """
+    Номера [first, last) элементов, время которых попадает в [since,
+    until). Время элемента i - NOW - step * i.
+    """
+    first, last = 0, size
+    if until:
+        ahead = NOW - parse_time(until)
+        first = 0 if ahead < timedelta(0) else ahead // step + 1
+    if since:
+        behind = NOW - parse_time(since)
+        last = 0 if behind < timedelta(0) else behind // step + 1
+    first, last = min(first, size), min(last, size)
+    return first, max(first, last)
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    """Сервер с параметрами синтетического репозитория."""
+
+    daemon_threads = True
+
+    def __init__(self, address, size=10000, latency=0, errors=0,
+                 rate_limit=None, rate_reset=2):
+        super().__init__(address, Handler)
+        self.size = size
+        self.latency = latency
+        self.errors = errors
+        self.rate_limit = rate_limit
+        self.rate_reset = rate_reset
+        self.random = random.Random(1)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.window_start = time.time()
+        self.window_used = 0
+
+    def take(self):
+        """Расходует запрос из лимита. Возвращает (остаток, время
+        восстановления) или None, если лимит исчерпан."""
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.rate_reset:
+                self.window_start, self.window_used = now, 0
+            reset = int(self.window_start + self.rate_reset) + 1
+            if self.rate_limit is None:
+                return 5000, reset
+            if self.window_used >= self.rate_limit:
+                return None
+            self.window_used += 1
+            return self.rate_limit - self.window_used, reset
+
+    def refund(self):
+        """Возвращает запрос в лимит: ответ 304 лимит не расходует."""
+        with self.lock:
+            self.window_used = max(self.window_used - 1, 0)
+
+    def count(self, status):
+        with self.lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def fail(self):
+        with self.lock:
+            return self.random.random() < self.errors
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Обработчик запросов к заменителю GitHub API."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Без этого каждый ответ задерживается алгоритмом Нейгла
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b'', headers=None):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        path = parts.path
+
+        if path == '/_stats':
+            body = json.dumps(self.server.stats).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.fail():
+            return self.send(502, b'{"message": "Bad Gateway"}')
+
+        limit = self.server.take()
+        if limit is None:
+            reset = int(self.server.window_start + self.server.rate_reset) + 1
+            return self.send(403, b'{"message": "API rate limit exceeded"}', {
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset': str(reset),
+                'X-RateLimit-Resource': 'core'})
+        remaining, reset = limit
+        headers = {'X-RateLimit-Limit': str(self.server.rate_limit or 5000),
+                   'X-RateLimit-Remaining': str(remaining),
+                   'X-RateLimit-Reset': str(reset),
+                   'X-RateLimit-Resource': 'core'}
+
+        if path == '/rate_limit':
+            rate = {'limit': self.server.rate_limit or 5000,
+                    'remaining': remaining, 'reset': reset}
+            return self.send(200, json.dumps(
+                {'resources': {'core': rate}, 'rate': rate}).encode('utf-8'),
+                headers)
+
+        match = re.fullmatch(r'/repos/([^/]+)/([^/]+)(?:/(\w+))?', path)
+        if not match:
+            return self.send(404, b'{"message": "Not Found"}', headers)
+        kind = match[3]
+
+        if kind is None:
+            created = NOW - ITEM_STEP * self.server.size - timedelta(days=1)
+            data = {'full_name': '{}/{}'.format(match[1], match[2]),
+                    'default_branch': 'master',
+                    'created_at': created.strftime(TIME_FORMAT)}
+            return self.send(200, json.dumps(data).encode('utf-8'), headers)
+
+        if kind == 'commits':
+            first, last = index_range(query.get('since'), query.get('until'),
+                                      COMMIT_STEP, self.server.size)
+            make = commit
+        elif kind in ('pulls', 'issues'):
+            first, last = 0, self.server.size
+            make = partial(item, pull=kind == 'pulls')
+        else:
+            return self.send(404, b'{"message": "Not Found"}', headers)
+
+        per_page = min(int(query.get('per_page', 30)), MAX_PER_PAGE)
+        page = int(query.get('page', 1))
+        pages = max(1, -(-(last - first) // per_page))
+        start = first + (page - 1) * per_page
+        stop = min(last, start + per_page)
+
+        # Содержимое страницы определяется запросом, поэтому ETag можно
+        # вычислить, не формируя её
+        etag = '"{}"'.format(hashlib.md5('{}:{}:{}:{}'.format(
+            self.server.size, kind, start, stop).encode()).hexdigest())
+        headers['ETag'] = etag
+
+        links = []
+        base = 'http://{}:{}{}'.format(*self.server.server_address[:2], path)
+        if page < pages:
+            links.append('<{}?{}>; rel="next"'.format(
+                base, urlencode(dict(query, page=page + 1))))
+            links.append('<{}?{}>; rel="last"'.format(
+                base, urlencode(dict(query, page=pages))))
+        if links:
+            headers['Link'] = ', '.join(links)
+
+        if self.headers.get('If-None-Match') == etag:
+            self.server.refund()
+            return self.send(304, b'', headers)
+
+        body = json.dumps([make(i) for i in range(start, stop)])
+        self.send(200, body.encode('utf-8'), headers)
+
+
+def main():
+    opts, _ = getopt.getopt(sys.argv[1:], '', [
+        'port=', 'size=', 'latency=', 'errors=', 'rate-limit=',
+        'rate-reset='])
+    options = dict(opts)
+    server = FakeGitHub(
+        ('127.0.0.1', int(options.get('--port', 0))),
+        size=int(options.get('--size', 10000)),
+        latency=float(options.get('--latency', 0)) / 1000,
+        errors=float(options.get('--errors', 0)),
+        rate_limit=int(options['--rate-limit'])
+        if '--rate-limit' in options else None,
+        rate_reset=float(options.get('--rate-reset', 2)))
+    print('http://{}:{}'.format(*server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,83 @@
 ﻿import sys
-from datetime import datetime, date
+import os
+from array import array
+import bisect
+import calendar
+import contextvars
+from datetime import datetime, date, timedelta, timezone
 import getopt
+import hashlib
+import heapq
+import hmac
+import json
+import random
 import re
-from collections import defaultdict
-import requests
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import (ThreadPoolExecutor, as_completed, wait,
+                                FIRST_EXCEPTION)
+from contextlib import closing, contextmanager
+from functools import partial
+from operator import attrgetter
+from urllib.parse import (urlsplit, urlunsplit, parse_qs, parse_qsl,
+                          urlencode)
 
 
 DATE_FORMAT = '%Y-%m-%d'
+GITHUB_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Формат времени в квалификаторах Search API
+SEARCH_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S+00:00'
 GITHUB_API_ROOT = 'https://api.github.com'
+# Таймаут одного HTTP-запроса в секундах
+HTTP_TIMEOUT = 30
+# Максимальное количество соединений, удерживаемых в пуле HTTP-сессии
+HTTP_POOL_SIZE = 32
+# Количество элементов на одной странице списка (максимум для GitHub API)
+PER_PAGE = 100
+# Количество страниц списка, запрашиваемых одновременно
+PAGE_WINDOW = 8
+# Каталог дискового кэша HTTP-ответов по умолчанию
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'github_analyzer')
+# Сколько дней хранится неиспользуемая запись кэша по умолчанию
+DEFAULT_CACHE_TTL = 7
+# Максимальный размер дискового кэша в байтах
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+# Сколько секунд описание репозитория из кэша используется без запроса к
+# GitHub: дата создания репозитория не меняется, основная ветка - редко
+REPOSITORY_MAX_AGE = 3600
+# Файл в каталоге кэша, в котором между запусками хранятся остатки лимитов
+# запросов
+RATE_STATE_FILE = 'rate_limit.json'
+# Сколько секунд сохранённый остаток лимита считается достоверным: если он
+# моложе, /rate_limit перед запуском не запрашивается
+RATE_STATE_MAX_AGE = 300
+# Файл локальной базы синхронизированных данных по умолчанию
+DEFAULT_DB_PATH = os.path.join(DEFAULT_CACHE_DIR, 'github.db')
+# Насколько раньше времени прошлой синхронизации запрашиваются коммиты:
+# коммит может попасть в ветку позже даты, которой он помечен
+SYNC_OVERLAP = timedelta(days=3)
+# Сколько раз повторять запрос после ответа 5xx, вторичного ограничения
+# частоты запросов или ошибки соединения
+MAX_RETRIES = 5
+# Пауза перед первым повтором и наибольшая пауза между повторами в секундах
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+# Сколько секунд можно ждать восстановления лимита Search API, прежде чем
+# перейти к постраничному подсчёту
+SEARCH_MAX_WAIT = 60
+# Сколько раз запрашивать статистику участников, пока GitHub её вычисляет,
+# и пауза перед первым повтором в секундах (удваивается с каждым повтором)
+STATS_POLL_ATTEMPTS = 5
+STATS_POLL_DELAY = 2
+# Количество участников, которых возвращает /stats/contributors
+STATS_MAX_CONTRIBUTORS = 100
+# Через сколько страниц длинного обхода сохраняется контрольная точка
+CHECKPOINT_EVERY = 10
+# Количество отчётов, формируемых одновременно, по умолчанию
+DEFAULT_JOBS = 3
 URL_PATTERN = re.compile(r'https://github.com/(?P<owner>\w+)/(?P<repo>\w+)')
 
 ACTIVE_COMMITERS_TEMPLATE = \
@@ -25,6 +95,10 @@ ISSUES_TEMPLATE = \
 Issues
 Открытых: {}     Закрытых: {}     Старых: {}"""
 
+BRANCH_TEMPLATE = \
+    """
+Ветка {}"""
+
 
 def usage():
     """Справка по вызову скрипта."""
@@ -33,6 +107,8 @@ def usage():
 
 Использование:
 python github_analyzer.py [опции] URL
+python github_analyzer.py [опции] --batch ФАЙЛ
+python github_analyzer.py [опции] --snapshot-in ФАЙЛ
 
 Аргументы:
     URL    Ссылка на репозиторий GitHub.
@@ -43,7 +119,78 @@ python github_analyzer.py [опции] URL
                     По умолчанию - без ограничения.
     -t, --to        Дата окончания анализа в формате "ГГГГ-ММ-ДД"
                     (не включительно). По умолчанию - без ограничения.
-    -b, --branch    Ветка репозитория. По умолчанию - master.
+    -b, --branch    Ветка репозитория. По умолчанию - master. Можно указать
+                    несколько веток через запятую: тогда отчёты по
+                    участникам и PR выводятся для каждой ветки, а общие
+                    коммиты веток и список PR запрашиваются один раз.
+    -j, --jobs      Количество отчётов, формируемых одновременно.
+                    По умолчанию - 3, значение 1 отключает параллельность.
+    --cache-dir     Каталог кэша ответов GitHub.
+                    По умолчанию - ~/.cache/github_analyzer.
+    --cache-ttl     Сколько дней хранить неиспользуемые ответы в кэше.
+                    По умолчанию - 7.
+    --no-cache      Не использовать кэш ответов.
+    --sync          Синхронизировать коммиты, PR и issue с локальной базой
+                    и строить отчёты по ней. Повторная синхронизация
+                    запрашивает только изменения с прошлого запуска.
+    --db            Файл локальной базы.
+                    По умолчанию - ~/.cache/github_analyzer/github.db.
+    -s, --search    Считать PR и issue запросами к Search API, не загружая
+                    их списки. Если период нельзя точно выразить запросом,
+                    используется постраничный подсчёт.
+    --token         Токен доступа к GitHub. Опцию можно указать несколько
+                    раз, запросы распределяются между токенами. По
+                    умолчанию - токены из переменных окружения GITHUB_TOKEN
+                    и GITHUB_TOKENS (через запятую). С токеном коммиты,
+                    PR и issue запрашиваются через GraphQL API.
+    --no-graphql    Не использовать GraphQL API даже при наличии токена.
+    --no-stats      Если дата начала не указана, всё равно подсчитывать
+                    коммиты по одному, а не по недельной статистике GitHub.
+    --batch         Файл со ссылками на репозитории, по одной в строке.
+                    Репозитории анализируются одновременно (см. --jobs),
+                    отчёт по каждому выводится, как только он готов.
+                    Не используется вместе с --series и --snapshot-out.
+    --series        Вместо отчётов вывести таблицу по окнам daily (сутки),
+                    weekly (недели) или monthly (месяцы) интервала анализа:
+                    количество коммитов, самые активные участники, открытые
+                    (+), закрытые (-) и "старые" (!) PR и issue. Данные
+                    загружаются один раз для всего интервала.
+    --serve         Запустить HTTP-сервис отчётов по адресу [ХОСТ:]ПОРТ
+                    (по умолчанию хост - 127.0.0.1). Отчёты /commiters,
+                    /pulls и /issues возвращаются в формате JSON, параметры
+                    repo (владелец/репозиторий), branch, from, to и age
+                    передаются в строке запроса. Готовые отчёты хранятся в
+                    памяти 10 минут, одновременно формируется не больше
+                    --jobs отчётов.
+    --webhook       Принимать веб-хуки GitHub (события push, pull_request и
+                    issues) по адресу [ХОСТ:]ПОРТ и вести по ним счётчики
+                    коммитов участников, открытых и закрытых PR и issue в
+                    локальной базе (см. --db). Текущие значения возвращает
+                    GET /counters?repo=владелец/репозиторий.
+    --webhook-secret
+                    Секрет веб-хуков для проверки подписи. По умолчанию -
+                    переменная окружения GITHUB_WEBHOOK_SECRET.
+    --profile       Вывести в stderr профиль запуска: количество запросов,
+                    байт, перцентили длительности и расход лимита по каждой
+                    конечной точке API, полученные и пропущенные страницы,
+                    время разбора JSON, подсчёта и отдельных вызовов API.
+    --profile-json  Сохранить профиль запуска в файл в формате JSON.
+    --plan          Перед запуском оценить, сколько запросов израсходует
+                    каждый отчёт, выбрать самый дешёвый способ его
+                    формирования (обход списка, поиск, недельная
+                    статистика) и вывести план. Если остатка лимита не
+                    хватит на весь запуск, отчёты не формируются.
+    --dry-run       Только вывести план запуска (см. --plan).
+    --snapshot-out  Сохранить данные для отчётов (коммиты веток, PR и issue
+                    за интервал анализа, только нужные поля) в сжатый
+                    файл-снимок и построить отчёты по нему.
+    --snapshot-in   Построить отчёты по файлу-снимку, не обращаясь к
+                    GitHub. По умолчанию - за интервал и по веткам
+                    снимка; заданные интервал и ветки должны
+                    укладываться в данные снимка. URL можно не указывать.
+    --resume        Продолжить прерванный запуск с теми же параметрами с
+                    последней контрольной точки, не запрашивая уже
+                    полученные страницы заново.
     -h, --help      Вывести это сообщение и вернуться.\
 """)
 
@@ -63,6 +210,18 @@ def str2datetime(time_str):
     return datetime.fromisoformat(time_str.replace('Z', ''))
 
 
+def isotime(dt):
+    """
+    Переводит объект datetime в строку того же вида, в котором GitHub
+    возвращает время ("ГГГГ-ММ-ДДTЧЧ:ММ:ССZ").
+
+    Строки такого вида сравниваются лексикографически в том же порядке, что
+    и соответствующие моменты времени, поэтому время из ответов GitHub можно
+    сравнивать с границами интервала, не разбирая его.
+    """
+    return dt.strftime(GITHUB_TIME_FORMAT)
+
+
 def parse_url(url):
     """Выделяет владельца и имя репоизитория из URL."""
     match = URL_PATTERN.search(url)
@@ -72,487 +231,4316 @@ def parse_url(url):
     return owner, repo
 
 
+class Options:
+    """Параметры запуска скрипта."""
+
+    def __init__(self):
+        self.url = None
+        self.from_date = None
+        self.to_date = today()
+        # Дата окончания задана явно опцией -t
+        self.to_date_set = False
+        self.verbose = False
+        self.branch = 'master'
+        self.branches = ['master']
+        # Ветки заданы явно опцией -b
+        self.branch_set = False
+        self.jobs = DEFAULT_JOBS
+        self.use_cache = True
+        self.cache_dir = DEFAULT_CACHE_DIR
+        self.cache_ttl = DEFAULT_CACHE_TTL
+        self.sync = False
+        self.db_path = DEFAULT_DB_PATH
+        self.search = False
+        self.tokens = [token for token in
+                       [os.environ.get('GITHUB_TOKEN', '')] +
+                       os.environ.get('GITHUB_TOKENS', '').split(',')
+                       if token.strip()]
+        self.graphql = True
+        self.stats = True
+        self.batch = None
+        self.resume = False
+        self.series = None
+        self.serve = None
+        self.webhook = None
+        self.webhook_secret = os.environ.get('GITHUB_WEBHOOK_SECRET')
+        self.profile = False
+        self.profile_json = None
+        self.plan = False
+        self.dry_run = False
+        self.snapshot_out = None
+        self.snapshot_in = None
+
+
 def parse_args(input):
     """Разбор аргументов и опций командной строки."""
-    opts, args = getopt.getopt(input, 'hf:t:b:v', [
-        'help', 'url=', 'from=', 'to=', 'branch=', 'verbose'])
-    url = None
-    from_date = None
-    to_date = today()
-    verbose = False
-    branch = 'master'
+    opts, args = getopt.getopt(input, 'hf:t:b:vj:s', [
+        'help', 'url=', 'from=', 'to=', 'branch=', 'verbose', 'jobs=',
+        'cache-dir=', 'cache-ttl=', 'no-cache', 'sync', 'db=',
+        'search', 'token=', 'no-graphql', 'no-stats',
+        'batch=', 'resume', 'series=', 'serve=',
+        'webhook=', 'webhook-secret=', 'profile', 'profile-json=',
+        'plan', 'dry-run', 'snapshot-out=', 'snapshot-in='])
+    options = Options()
+    tokens = []
 
     if args:
-        url = args[0]
+        options.url = args[0]
 
     for o, a in opts:
-        if o == '-v':
-            verbose = True
+        if o in ('-v', '--verbose'):
+            options.verbose = True
         elif o in ('-h', '--help'):
             usage()
             sys.exit(0)
         elif o in ('-f', '--from'):
-            from_date = datetime.strptime(a, DATE_FORMAT)
+            options.from_date = datetime.strptime(a, DATE_FORMAT)
         elif o in ('-t', '--to'):
-            to_date = datetime.strptime(a, DATE_FORMAT)
+            options.to_date = datetime.strptime(a, DATE_FORMAT)
+            options.to_date_set = True
         elif o in ('-b', '--branch'):
-            branch = a
+            branches = []
+            for branch in a.split(','):
+                branch = branch.strip()
+                if branch and branch not in branches:
+                    branches.append(branch)
+            if not branches:
+                raise ValueError('не задана ветка')
+            options.branch, options.branches = branches[0], branches
+            options.branch_set = True
+        elif o in ('-j', '--jobs'):
+            options.jobs = int(a)
+            if options.jobs < 1:
+                raise ValueError(
+                    'количество заданий должно быть не меньше 1')
+        elif o == '--cache-dir':
+            options.cache_dir = a
+        elif o == '--cache-ttl':
+            options.cache_ttl = int(a)
+            if options.cache_ttl < 0:
+                raise ValueError(
+                    'срок хранения кэша не может быть отрицательным')
+        elif o == '--no-cache':
+            options.use_cache = False
+        elif o == '--sync':
+            options.sync = True
+        elif o == '--db':
+            options.db_path = a
+        elif o in ('-s', '--search'):
+            options.search = True
+        elif o == '--token':
+            tokens.append(a)
+        elif o == '--no-graphql':
+            options.graphql = False
+        elif o == '--no-stats':
+            options.stats = False
+        elif o == '--batch':
+            options.batch = a
+        elif o == '--resume':
+            options.resume = True
+        elif o == '--series':
+            if a not in SERIES_PERIODS:
+                raise ValueError('окно временного ряда должно быть одним из: '
+                                 '{}'.format(', '.join(SERIES_PERIODS)))
+            options.series = a
+        elif o in ('--serve', '--webhook'):
+            port = int(a.rpartition(':')[2])
+            if not 0 < port < 65536:
+                raise ValueError('неправильный номер порта {}'.format(port))
+            setattr(options, o[2:], a)
+        elif o == '--webhook-secret':
+            options.webhook_secret = a
+        elif o == '--profile':
+            options.profile = True
+        elif o == '--profile-json':
+            options.profile_json = a
+        elif o == '--plan':
+            options.plan = True
+        elif o == '--dry-run':
+            options.dry_run = True
+        elif o == '--snapshot-out':
+            options.snapshot_out = a
+        elif o == '--snapshot-in':
+            options.snapshot_in = a
         else:
             assert False, 'Как я сюда попал?'
 
-    return url, from_date, to_date, verbose, branch
+    if tokens:
+        options.tokens = tokens
 
+    # Пакетный режим выводит только отчёты: временных рядов и снимков по
+    # нескольким репозиториям нет
+    if options.batch is not None:
+        for option in ('series', 'snapshot_out'):
+            if getattr(options, option) is not None:
+                raise ValueError('--{} не используется вместе с --batch'
+                                 .format(option.replace('_', '-')))
 
-def rate_limit():
-    """Возвращает количество оставшихся запросов в час."""
-    url = f'{GITHUB_API_ROOT}/rate_limit'
-    r = requests.get(url)
+    return options
+
+
+# Профилирование
+
+class Profiler:
+    """
+    Телеметрия запуска.
+
+    Для каждой конечной точки API накапливает количество запросов,
+    загруженные байты, длительности запросов, коды ответов и израсходованные
+    единицы лимита (ответ 304 лимит не расходует), количество полученных и
+    пропущенных страниц списков, а также суммарное время этапов обработки
+    (разбор JSON, подсчёт, отдельные вызовы API).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoints = {}
+        self.pages = {}
+        self.timings = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {
+                'requests': 0, 'bytes': 0, 'units': 0, 'latency': [],
+                'statuses': defaultdict(int)}
+        return stats
+
+    def request(self, url, status, size, seconds):
+        """Учитывает один HTTP-запрос."""
+        with self._lock:
+            stats = self._endpoint(endpoint_name(url))
+            stats['requests'] += 1
+            stats['bytes'] += size
+            stats['latency'].append(seconds)
+            stats['statuses'][status] += 1
+            if status != 304:
+                stats['units'] += 1
+
+    def page(self, url, fetched=1, skipped=0):
+        """Учитывает полученные и пропущенные страницы списка."""
+        with self._lock:
+            pages = self.pages.setdefault(
+                endpoint_name(url), {'fetched': 0, 'skipped': 0})
+            pages['fetched'] += fetched
+            pages['skipped'] += skipped
+
+    def timing(self, name, seconds):
+        """Добавляет seconds ко времени этапа name."""
+        with self._lock:
+            self.timings[name] += seconds
+
+    def as_dict(self):
+        """Телеметрия в виде словаря для сохранения в JSON."""
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in sorted(self.endpoints.items()):
+                latency = sorted(stats['latency'])
+                endpoints[endpoint] = {
+                    'requests': stats['requests'],
+                    'bytes': stats['bytes'],
+                    'units': stats['units'],
+                    'statuses': {str(code): count for code, count
+                                 in sorted(stats['statuses'].items())},
+                    'latency_ms': {
+                        name: round(percentile(latency, q) * 1000, 1)
+                        for name, q in (('p50', 50), ('p90', 90),
+                                        ('p99', 99), ('max', 100))}
+                }
+            return {
+                'wall_seconds': round(time.perf_counter() - self.started, 3),
+                'endpoints': endpoints,
+                'pages': dict(sorted(self.pages.items())),
+                'timings': {name: round(seconds, 3) for name, seconds
+                            in sorted(self.timings.items())}
+            }
+
+    def format(self):
+        """Телеметрия в виде текстового отчёта."""
+        data = self.as_dict()
+        lines = ['Профиль запуска ({:.2f} с)'.format(data['wall_seconds']),
+                 '{:<40} {:>6} {:>10} {:>7} {:>7} {:>7} {:>7} {:>6}'.format(
+                     'Запрос', 'Кол-во', 'Байт', 'p50 мс', 'p90 мс',
+                     'p99 мс', 'max мс', 'Лимит')]
+        for endpoint, stats in data['endpoints'].items():
+            latency = stats['latency_ms']
+            lines.append(
+                '{:<40.40} {:>6} {:>10} {:>7} {:>7} {:>7} {:>7} {:>6}'.format(
+                    endpoint, stats['requests'], stats['bytes'],
+                    latency['p50'], latency['p90'], latency['p99'],
+                    latency['max'], stats['units']))
+        for endpoint, pages in data['pages'].items():
+            lines.append('Страниц {}: получено {}, пропущено {}'.format(
+                endpoint, pages['fetched'], pages['skipped']))
+        for name, seconds in data['timings'].items():
+            lines.append('Время {}: {:.3f} с'.format(name, seconds))
+        return '\n'.join(lines)
+
+
+# Телеметрия запуска или None, если профилирование выключено. Все точки
+# измерения проверяют её перед тем, как что-либо замерять
+_profiler = None
+
+
+def configure_profiler():
+    """Включает профилирование запуска."""
+    global _profiler
+    _profiler = Profiler()
+
+
+def endpoint_name(url):
+    """Конечная точка API без корня API, параметров и имени репозитория."""
+    path = urlsplit(url).path
+    root = urlsplit(GITHUB_API_ROOT).path.rstrip('/')
+    if root and path.startswith(root):
+        path = path[len(root):]
+    return re.sub(r'^/repos/[^/]+/[^/]+', '/repos/{owner}/{repo}', path)
+
+
+def percentile(values, q):
+    """Перцентиль q отсортированного списка values (0, если он пуст)."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, -(-len(values) * q // 100) - 1))]
+
+
+@contextmanager
+def profiled(name):
+    """Контекст, время выполнения которого добавляется к этапу name."""
+    if _profiler is None:
+        yield
+        return
+    start = time.perf_counter()
     try:
-        return r.json()['rate']['remaining']
-    except Exception:
-        print('Неправильный ответ сервера: {}'.format(r.text))
-        sys.exit(-1)
+        yield
+    finally:
+        _profiler.timing(name, time.perf_counter() - start)
 
 
-def get_repository_start_date(owner, repo):
-    """Получить дату создания репозитория."""
-    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}'
-    r = requests.get(url)
-    response = r.json()
-    return str2datetime(response['created_at'])
+# Работа с HTTP
 
+_session = None
+_session_lock = threading.Lock()
 
-# Функции анализа репозитория
 
-def select_active_commiters(owner, repo, branch, from_date, to_date, limit=30):
+def get_session():
     """
-    Делает выборку самых активных участников разработки.
+    Возвращает общую для всех запросов HTTP-сессию.
+
+    Сессия держит пул постоянных (keep-alive) соединений с сервером и
+    запрашивает сжатые ответы, поэтому её можно безопасно использовать
+    из нескольких потоков одновременно.
     """
-    # Подготовить строку запроса а API
-    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/commits'
-    # Получить список коммитов в заданной ветке за заданный промежуток времени
-    params = {
-        'sha': branch,
-        'since': from_date.isoformat(),
-        'until': to_date.isoformat()
-    }
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests импортируется только при первом обращении к сети:
+            # справка, разбор опций и отчёты по снимку обходятся без него
+            import requests
+            from requests.adapters import HTTPAdapter
 
-    # Словарь участников в формате {login: count}
-    commiters = defaultdict(int)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                  pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({
+                'Accept': 'application/vnd.github.v3+json',
+                'Accept-Encoding': 'gzip'
+            })
+            _session = session
+    return _session
 
-    # Githib возвращает список коммитов постранично
-    # Закончить, когда в ответе не будет ссылки на следующую страницу
-    while True:
-        # Отправить запрос GitHub и получить ответ
-        r = requests.get(url, params=params)
 
-        # Бросить исключение, если код ответа не 200
-        if r.status_code != 200:
-            raise RuntimeError(
-                'Сервер вернул код ошибки {}'.format(r.status_code))
+class HttpCache:
+    """
+    Дисковый кэш ответов GitHub для условных запросов.
 
-        # Попробовать создать JSON-объект из ответа
+    Для каждого ответа, содержащего ETag или Last-Modified, на диске
+    сохраняются тело и нужные заголовки. При повторном запросе того же URL
+    серверу отправляются If-None-Match/If-Modified-Since, и если сервер
+    ответил 304 (такие ответы не расходуют лимит запросов), тело берётся
+    с диска.
+
+    Запись, которая не использовалась ttl дней, удаляется. Общий размер
+    кэша ограничен max_size байтами: при превышении удаляются давно не
+    использованные записи.
+    """
+
+    # Заголовки ответа, которые сохраняются вместе с телом
+    STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Link')
+
+    def __init__(self, directory, ttl=DEFAULT_CACHE_TTL,
+                 max_size=CACHE_MAX_SIZE):
+        self.directory = directory
+        self.ttl = ttl * 24 * 3600
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size
+                         for entry in os.scandir(directory)
+                         if entry.name.endswith('.cache'))
+
+    def _path(self, url):
+        """Путь к файлу записи кэша для URL."""
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.cache')
+
+    def lookup(self, url):
+        """
+        Возвращает пару (метаданные, тело) записи для URL или None,
+        если записи нет или её срок хранения истёк.
+        """
+        path = self._path(url)
         try:
-            response = r.json()
-        except Exception as e:
-            message = 'Не удалось получить все коммиты '
-            if rate_limit() == 0:
-                message += 'т.к. исчерпан лимит запросов.'
-            else:
-                message += 'по причине "{}".'.format(
-                    str(e))
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self._remove(path)
+                return None
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
 
-            raise RuntimeError(message)
+        return meta, body
 
-        # Некоторое количество коммитов должно быть, иначе прекратить
-        # получать данные
-        if not response or not isinstance(response, list):
-            raise RuntimeError(
-                'Неожиданный формат ответа: {}'.format(response))
+    def conditional_headers(self, meta):
+        """Заголовки условного запроса для записи кэша."""
+        headers = {}
+        if 'ETag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if 'Last-Modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        return headers
+
+    def response(self, url, meta, body, not_modified):
+        """
+        Восстанавливает ответ сервера из записи кэша.
+
+        Заголовки лимита запросов берутся из свежего ответа not_modified,
+        если запись проверялась на сервере.
+        """
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        headers = CaseInsensitiveDict(meta['headers'])
+        if not_modified is not None:
+            for name, value in not_modified.headers.items():
+                if name.lower().startswith('x-ratelimit'):
+                    headers[name] = value
 
-        # Подсчитать количество коммитов от каждого участника
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        r.headers = headers
+        r.encoding = 'utf-8'
+        r._content = body
+
+        # Отметить использование записи для вытеснения давно не
+        # использованных
         try:
-            for commit in response:
-                commiters[commit['author']['login']] += 1
-        except Exception as e:
-            raise RuntimeError(
-                'Не удалось получить логин участника: {}'.format(str(e)))
+            os.utime(self._path(url))
+        except OSError:
+            pass
 
-        # Это была последняя страница, больше нечего запрашивать
-        if 'next' not in r.links:
-            break
+        with self._lock:
+            self.hits += 1
+        return r
 
-        url = r.links['next']['url']
+    def store(self, url, r):
+        """Сохраняет ответ сервера, если его можно проверять условно."""
+        with self._lock:
+            self.misses += 1
 
-    # Вернуть самых активных в виде списка кортежей [(login, count)],
-    # ограничив количество TOP-участников
-    return sorted(commiters.items(), key=lambda x: x[1], reverse=True)[:limit]
+        if r.status_code != 200 or not (
+                'ETag' in r.headers or 'Last-Modified' in r.headers):
+            return
+
+        meta = {
+            'url': url,
+            'time': time.time(),
+            'headers': {name: r.headers[name]
+                        for name in self.STORED_HEADERS if name in r.headers}
+        }
+        data = json.dumps(meta).encode('utf-8') + b'\n' + r.content
+        path = self._path(url)
+
+        # Записать во временный файл и атомарно заменить им запись, чтобы
+        # параллельные запросы никогда не читали недописанный файл
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _remove(self, path):
+        """Удаляет запись кэша."""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def _evict(self):
+        """Удаляет давно не использованные записи, пока кэш не уменьшится
+        до 90% от максимального размера."""
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory)
+             if entry.name.endswith('.cache')),
+            key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+_cache = None
+
+
+def configure_cache(directory, ttl=DEFAULT_CACHE_TTL):
+    """Включает дисковый кэш ответов для всех запросов к API."""
+    global _cache
+    _cache = HttpCache(directory, ttl)
+    return _cache
+
+
+class RateLimitExceeded(RuntimeError):
+    """Лимит запросов исчерпан, а ждать его восстановления нельзя."""
 
 
-def count_pull_requests(owner, repo, branch, from_date, to_date, age=30):
+# Резерв лимитов задания, за счёт которого идут запросы текущего контекста:
+# {лимит: неизрасходованный остаток} (см. RateLimitGovernor.reserve)
+_reservation = contextvars.ContextVar('reservation', default=None)
+
+
+class RateLimitGovernor:
     """
-    Подсчитывает количества открытых, закрытых и "старых" PR.
+    Учёт лимитов запросов к API по заголовкам ответов.
+
+    Каждый ответ GitHub содержит остаток лимита (X-RateLimit-Remaining),
+    время его восстановления (X-RateLimit-Reset) и название лимита
+    (X-RateLimit-Resource: core, search, graphql). Остаток отслеживается
+    для каждого токена из пула и каждого лимита отдельно. Перед запросом
+    выбирается токен с наибольшим остатком; если лимит исчерпан для всех
+    токенов, запрос ждёт ближайшего восстановления, а не завершается
+    ошибкой.
+
+    Известные остатки можно сохранить в файл (save) и прочитать при
+    следующем запуске (load), чтобы не запрашивать /rate_limit заново.
+
+    Задания пакетного режима резервируют оценку своих запросов (reserve):
+    новое задание начинается, только если остатка за вычетом
+    неизрасходованных резервов уже начатых заданий хватит и на него.
     """
-    def count_open(response):
-        """Подсчитывает количество открытых PR на заданном интервале времени,
-        фильтруя по дате создания."""
-        return sum(1 for pr in response
-                   # Окно даты создания
-                   if str2datetime(pr['created_at']) < to_date
-                   and str2datetime(pr['created_at']) >= from_date
-                   # Открыт до сих пор или закрыт за пределами интревала
-                   # анализа
-                   and (pr['state'] == 'open'
-                        or str2datetime(pr['closed_at']) >= to_date)
-                   )
-
-    def count_closed(response):
-        """Подсчитывает количество закрытых PR на заданном интевале времени,
-        фильтруя по дате создания."""
-        return sum(1 for pr in response
-                   # Окно даты создания
-                   if str2datetime(pr['created_at']) < to_date
-                   and str2datetime(pr['created_at']) >= from_date
-                   # Закрыт до конца интервала анализа
-                   and pr['state'] == 'closed'
-                   and str2datetime(pr['closed_at']) < to_date)
-
-    def count_stale(response):
-        """Подсчитывает количество "старых" PR на заданном интевале времени,
-        фильтруя по дате создания."""
-        t = today()
-        return sum(1 for pr in response
-                   # Окно даты создания
-                   if str2datetime(pr['created_at']) < to_date
-                   and str2datetime(pr['created_at']) >= from_date
-                   # Вариант, если "старость PR" понимается как "открыт до сих
-                   # пор и более 30 дней"
-                   and pr['state'] == 'open'
-                   and (t - str2datetime(pr['created_at'])).days > age
-                   # Вариант, если "старость PR" понимается именно на
-                   # интервале анализа
-                   #    and ((pr['state'] == 'open'
-                   #          and to_date -
-                   #          str2datetime(pr['created_at']).days > age)
-                   #         or
-                   #         (pr['state'] == 'closed'
-                   #          and str2datetime(pr['closed_at']) -
-                   #          str2datetime(pr['created_at']).days > age))
-                   )
 
-    # Подготовить строку запроса а API
-    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/pulls'
-    # Получить PRs всех состояний из нужной ветки
-    # Выборка будет происходить постранично в порядке уменьшения
-    # даты создания PR, начиная от сегодняшней даты
-    params = {
-        'base': branch,
-        'state': 'all',
-        'sort': 'created',
-        'direction': 'desc'
-    }
+    def __init__(self, tokens=(), verbose=False):
+        self.verbose = verbose
+        # Без токенов запросы отправляются анонимно
+        self.tokens = list(tokens) or [None]
+        self._cond = threading.Condition()
+        # {(токен, лимит): [остаток, время восстановления]}
+        self._limits = {}
+        # {(токен, лимит): время, когда остаток стал известен}
+        self._seen = {}
+        # {лимит: неизрасходованный остаток резервов всех заданий}
+        self._reserved = defaultdict(int)
 
-    # Инициализация счётчиков
-    total_open, total_closed, total_state = 0, 0, 0
+    def acquire(self, resource='core', max_wait=None):
+        """
+        Выбирает токен для запроса и учитывает запрос в лимите resource.
 
-    # Githib возвращает список PR постранично
-    # Закончить, когда в ответе не будет ссылки на следующую страницу
-    while True:
-        # Отправить запрос GitHub и получить ответ
-        r = requests.get(url, params=params)
+        Если лимит исчерпан для всех токенов, ждёт его восстановления, а если
+        ждать пришлось бы дольше max_wait секунд, бросает RateLimitExceeded.
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                best, best_remaining, reset = None, -1, None
+                for token in self.tokens:
+                    limit = self._limits.get((token, resource))
+                    if limit is not None and limit[1] <= now:
+                        # Лимит уже восстановился
+                        del self._limits[(token, resource)]
+                        limit = None
+                    remaining = limit[0] if limit else float('inf')
+                    if remaining > best_remaining:
+                        best, best_remaining = token, remaining
+                    if limit and (reset is None or limit[1] < reset):
+                        reset = limit[1]
 
-        # Бросить исключение, если код ответа не 200
-        if r.status_code != 200:
-            raise RuntimeError(
-                'Сервер вернул код ошибки {}'.format(r.status_code))
+                if best_remaining > 0:
+                    limit = self._limits.get((best, resource))
+                    if limit:
+                        limit[0] -= 1
+                    # Запрос задания расходует его резерв
+                    reservation = _reservation.get()
+                    if reservation and reservation.get(resource, 0) > 0:
+                        reservation[resource] -= 1
+                        self._reserved[resource] -= 1
+                    return best
 
-        # Попробовать создать JSON-объект из ответа
+                wait = reset - now
+                if max_wait is not None and wait > max_wait:
+                    raise RateLimitExceeded(
+                        'Лимит запросов {} исчерпан'.format(resource))
+                if self.verbose:
+                    print('Лимит запросов исчерпан, ожидание до {}.'.format(
+                        datetime.fromtimestamp(reset).strftime('%H:%M:%S')))
+                self._cond.wait(wait + 1)
+
+    def update(self, token, resource, headers):
+        """Уточняет остаток лимита токена по заголовкам ответа."""
         try:
-            response = r.json()
-        except Exception as e:
-            message = 'Не удалось получить все PR '
-            if rate_limit() == 0:
-                message += 'т.к. исчерпан лимит запросов.'
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = int(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        self.set_limit(token, headers.get('X-RateLimit-Resource', resource),
+                       remaining, reset)
+
+    def set_limit(self, token, resource, remaining, reset):
+        """Запоминает остаток лимита токена."""
+        with self._cond:
+            limit = self._limits.get((token, resource))
+            if limit is None or reset > limit[1]:
+                # Начался новый час, лимит восстановлен
+                self._limits[(token, resource)] = [remaining, reset]
             else:
-                message += 'по причине "{}".'.format(
-                    str(e))
+                # Часть запросов, учтённых в остатке сервера, ещё не
+                # завершилась, поэтому остаток сервера может быть больше
+                limit[0] = min(limit[0], remaining)
+            self._seen[(token, resource)] = time.time()
+            self._cond.notify_all()
 
-            raise RuntimeError(message)
+    @staticmethod
+    def _token_key(token):
+        """Ключ токена в файле остатков: сами токены на диск не пишутся."""
+        if token is None:
+            return 'anonymous'
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
-        # Некоторое количество PR должно быть, иначе прекратить
-        # получать данные
-        if not response or not isinstance(response, list):
-            raise RuntimeError(
-                'Неожиданный формат ответа: {}'.format(response))
+    def load(self, path, max_age=RATE_STATE_MAX_AGE):
+        """
+        Читает остатки лимитов токенов пула, сохранённые не раньше чем
+        max_age секунд назад (см. save). Остаток лимита, время
+        восстановления которого прошло, не читается.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        keys = {self._token_key(token): token for token in self.tokens}
+        with self._cond:
+            for entry in state:
+                try:
+                    key, resource, remaining, reset, seen = entry
+                except (TypeError, ValueError):
+                    continue
+                if (key not in keys or reset <= now
+                        or now - seen > max_age):
+                    continue
+                limit = (keys[key], resource)
+                if limit not in self._limits:
+                    self._limits[limit] = [remaining, reset]
+                    self._seen[limit] = seen
 
-        # Подсчитать количество открытых, закрытых и старых PR
+    def save(self, path):
+        """
+        Сохраняет известные остатки лимитов в файл path. Записи других
+        токенов, уже сохранённые в файле, остаются, если они новее.
+        """
+        now = time.time()
+        with self._cond:
+            known = [[self._token_key(token), resource] + limit
+                     + [self._seen.get((token, resource), 0)]
+                     for (token, resource), limit in self._limits.items()
+                     if limit[1] > now]
+        if not known:
+            return
+
+        entries = {}
         try:
-            o, c, s = count_open(response), count_closed(
-                response), count_stale(response)
-        except Exception as e:
-            raise RuntimeError(
-                'Не удалось подсчитать все PR: {}'.format(str(e)))
-
-        # Аккумулируем полученные счётчики в итоговых счётчиках
-        total_open += o
-        total_closed += c
-        total_state += s
-
-        # PR выдаются отсортированными в порядке убывания
-        # даты их создания. Чтобы не делать лишних запросов, прекратить
-        # получать страницы, когда дата создания последнего на странице
-        # PR станет меньше даты начала анализа.
-        if str2datetime(response[-1]['created_at']) < from_date:
-            break
+            with open(path, encoding='utf-8') as f:
+                for entry in json.load(f):
+                    if len(entry) == 5 and entry[3] > now:
+                        entries[tuple(entry[:2])] = entry
+        except (OSError, ValueError, TypeError):
+            pass
+        for entry in known:
+            key = tuple(entry[:2])
+            if key not in entries or entries[key][4] < entry[4]:
+                entries[key] = entry
 
-        # Это была последняя страница, больше нечего запрашивать
-        if 'next' not in r.links:
-            break
+        # Файл записывается атомарно: его одновременно читают и пишут
+        # другие запуски
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(list(entries.values()), f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
 
-        url = r.links['next']['url']
+    def unknown_tokens(self, resource='core'):
+        """Токены, остаток лимита которых ещё неизвестен."""
+        with self._cond:
+            return [token for token in self.tokens
+                    if (token, resource) not in self._limits]
 
-    return total_open, total_closed, total_state
+    def remaining(self, resource='core'):
+        """Суммарный известный остаток лимита всех токенов."""
+        now = time.time()
+        with self._cond:
+            return sum(self._limits[(token, resource)][0]
+                       if self._limits[(token, resource)][1] > now else 0
+                       for token in self.tokens
+                       if (token, resource) in self._limits)
 
+    def wait_for(self, amount, resource='core'):
+        """Дожидается, пока суммарный остаток лимита будет не меньше
+        amount, не учитывая запросы."""
+        with self._cond:
+            while True:
+                now = time.time()
+                total, reset = 0, None
+                for token in self.tokens:
+                    limit = self._limits.get((token, resource))
+                    if limit is None or limit[1] <= now:
+                        return
+                    total += limit[0]
+                    if reset is None or limit[1] < reset:
+                        reset = limit[1]
+                if total >= amount:
+                    return
+                self._cond.wait(reset - now + 1)
 
-def count_issues(owner, repo, from_date, to_date, age=14):
-    """Посчитывает количество issue."""
-
-    def count_open(response,):
-        """Подсчитывает количество открытых issue и не закрытых до конца
-        интервала анализа, фильтруя по дате начала окончания анализа."""
-        return sum(1 for issue in response
-                   # Окно даты создания
-                   if str2datetime(issue['created_at']) < to_date
-                   and str2datetime(issue['created_at']) >= from_date
-                   # Открыта до сих пор или не закрыта до конца интервала
-                   # анализа
-                   and (issue['state'] == 'open'
-                        or str2datetime(issue['closed_at']) >= to_date)
-                   )
-
-    def count_closed(response):
-        """Подсчитывает количество закрытых issue до конца интервала
-        анализа, фильтруя по дате начала и окончания анализа."""
-        return sum(1 for issue in response
-                   # Окно даты создания
-                   if str2datetime(issue['created_at']) < to_date
-                   and str2datetime(issue['created_at']) >= from_date
-                   # Закрыта до конца интервала анализа
-                   and issue['state'] == 'closed'
-                   and str2datetime(issue['closed_at']) < to_date)
-
-    def count_stale(response):
-        """Подсчитывает количество открытых issue возрастом более age дней,
-        фильтруя по дате начала и окончания анализа."""
-        t = today()
-        return sum(1 for issue in response
-                   # Окно даты создания
-                   if str2datetime(issue['created_at']) < to_date
-                   and str2datetime(issue['created_at']) >= from_date
-                   # "Старость issue" понимается как "открыта до сих пор
-                   # и более 14 дней"
-                   and issue['state'] == 'open'
-                   and (t - str2datetime(issue['created_at'])).days > age)
+    def reserve(self, amounts):
+        """
+        Резервирует запросы для задания: amounts - словарь {лимит:
+        количество}.
 
-    # Подготовить строку запроса а API
-    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/issues'
-    # Получить список issue всех состояний с даты начала анализа,
-    # отосортированный по убыванию даты создания issue
-    params = {
-        'state': 'all',
-        'sort': 'created',
-        'direction': 'desc'
-    }
+        Ждёт, пока известного остатка каждого лимита за вычетом
+        неизрасходованных резервов других заданий хватит на задание. Если
+        других резервов лимита нет, резервирует сразу: задание, которому не
+        хватает всего остатка, всё равно дождётся восстановления лимита по
+        ходу работы. Возвращает резерв - словарь {лимит: неизрасходованный
+        остаток}, который уменьшают запросы в контексте с этим резервом
+        (см. _reservation) и который снимает release.
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                ready, reset = True, None
+                for resource, amount in amounts.items():
+                    reserved = self._reserved[resource]
+                    if not amount or not reserved:
+                        continue
+                    total = 0
+                    for token in self.tokens:
+                        limit = self._limits.get((token, resource))
+                        if limit is None or limit[1] <= now:
+                            # Остаток неизвестен или лимит восстановился
+                            total = float('inf')
+                            break
+                        total += limit[0]
+                        if reset is None or limit[1] < reset:
+                            reset = limit[1]
+                    if total - reserved < amount:
+                        ready = False
+                if ready:
+                    for resource, amount in amounts.items():
+                        self._reserved[resource] += amount
+                    return dict(amounts)
+                # Резерв освобождается, когда задание завершается
+                # (release) или лимит восстанавливается
+                self._cond.wait(reset - now + 1)
 
-    # Инициализация счётчиков
-    total_open, total_closed, total_state = 0, 0, 0
+    def release(self, reservation):
+        """Снимает неизрасходованный остаток резерва reservation."""
+        with self._cond:
+            for resource, amount in reservation.items():
+                self._reserved[resource] -= amount
+                reservation[resource] = 0
+            self._cond.notify_all()
 
-    # Githib возвращает список issue постранично
-    # Закончить, когда в ответе не будет ссылки на следующую страницу
-    while True:
-        # Отправить запрос GitHub и получить ответ
-        r = requests.get(url, params=params)
 
-        # Бросить исключение, если код ответа не 200
-        if r.status_code != 200:
-            raise RuntimeError(
-                'Сервер вернул код ошибки {}'.format(r.status_code))
+_governor = RateLimitGovernor()
 
-        # Попробовать создать JSON-объект из ответа
-        try:
-            response = r.json()
-        except Exception as e:
-            message = 'Не удалось получить все issue '
-            if rate_limit() == 0:
-                message += 'т.к. исчерпан лимит запросов.'
-            else:
-                message += 'по причине "{}".'.format(
-                    str(e))
 
-            raise RuntimeError(message)
+def configure_tokens(tokens, graphql=True, verbose=False):
+    """
+    Задаёт пул токенов доступа, между которыми распределяются запросы к API.
+
+    Если задан graphql, списки коммитов, PR и issue запрашиваются через
+    GraphQL API, который доступен только с токеном.
+    """
+    global _governor, _graphql
+    _governor = RateLimitGovernor(tokens, verbose)
+    _graphql = graphql and bool(tokens)
+    return _governor
+
+
+class Cancelled(RuntimeError):
+    """Запрос не отправлен: формирование отчётов прервано ошибкой."""
+
+
+# Событие отмены отчётов, формируемых run_reports: после ошибки одного из
+# них запросы остальных не отправляются
+_cancel = None
+
+
+def backoff(attempt):
+    """Пауза перед повтором запроса: экспоненциальная, со случайной
+    составляющей, чтобы параллельные запросы не повторялись
+    одновременно."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
 
-        # Некоторое количество issue должно быть, иначе прекратить
-        # получать данные
-        if not response or not isinstance(response, list):
-            raise RuntimeError(
-                'Неожиданный формат ответа: {}'.format(response))
 
-        # Подсчитать количество открытых, закрытых и старых issue
+def api_request(method, url, resource='core', max_wait=None, token=False,
+                **kwargs):
+    """
+    Отправляет запрос к API через общую HTTP-сессию.
+
+    Токен выбирается из пула с учётом лимита resource (None - запрос не
+    расходует лимит); token позволяет задать его явно. Ответы 5xx, ошибки
+    соединения и вторичные ограничения частоты запросов (403 или 429 с
+    Retry-After или сообщением о secondary rate limit) повторяются до
+    MAX_RETRIES раз с паузой. Ответ 403 при исчерпанном основном лимите
+    повторяется после его восстановления. Если отчёты отменены (см.
+    run_reports), бросает Cancelled.
+    """
+    import requests
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    for attempt in range(MAX_RETRIES + 1):
+        if _cancel is not None and _cancel.is_set():
+            raise Cancelled('Формирование отчётов прервано')
+        if token is False:
+            request_token = _governor.acquire(resource, max_wait) \
+                if resource else _governor.tokens[0]
+        else:
+            request_token = token
+        if request_token:
+            headers['Authorization'] = f'token {request_token}'
+
+        profiler = _profiler
+        if profiler is not None:
+            start = time.perf_counter()
         try:
-            o, c, s = count_open(response), count_closed(
-                response), count_stale(response)
-        except Exception as e:
-            raise RuntimeError(
-                'Не удалось подсчитать все issue: {}'.format(str(e)))
-
-        # Аккумулируем полученные счётчики в итоговых счётчиках
-        total_open += o
-        total_closed += c
-        total_state += s
-
-        # Issue выдаются отсортированными в порядке убывания
-        # даты их создания. Чтобы не делать лишних запросов, прекратить
-        # получать страницы, когда дата создания последней на странице
-        # issue станет меньше даты начала анализа.
-        if str2datetime(response[-1]['created_at']) < from_date:
-            break
+            r = get_session().request(method, url, headers=headers,
+                                      timeout=HTTP_TIMEOUT, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(backoff(attempt))
+            continue
+        if profiler is not None:
+            profiler.request(url, r.status_code, len(r.content),
+                             time.perf_counter() - start)
 
-        # Это была последняя страница, больше нечего запрашивать
-        if 'next' not in r.links:
+        _governor.update(request_token, resource or 'core', r.headers)
+        if attempt == MAX_RETRIES:
             break
 
-        url = r.links['next']['url']
+        if r.status_code in (403, 429):
+            if 'Retry-After' in r.headers:
+                try:
+                    time.sleep(int(r.headers['Retry-After']))
+                    continue
+                except ValueError:
+                    pass
+            if r.headers.get('X-RateLimit-Remaining') == '0' and resource:
+                # Основной лимит исчерпан: при повторе будет выбран другой
+                # токен или дождёмся восстановления лимита
+                continue
+            if 'secondary rate limit' in r.text.lower():
+                time.sleep(backoff(attempt))
+                continue
+        elif r.status_code >= 500:
+            time.sleep(backoff(attempt))
+            continue
 
-    return total_open, total_closed, total_state
+        break
 
+    return r
 
-# Функции печати отчётов
 
+def http_get(url, params=None, max_age=None, **kwargs):
+    """
+    Отправляет GET-запрос к API (см. api_request).
 
-def print_active_commiters(
-        owner, repo, branch, from_date, to_date, max_commiters=30):
+    Если включён дисковый кэш, запрос делается условным, а ответ 304
+    подменяется сохранённым на диске ответом. Ответ, сохранённый не раньше
+    чем max_age секунд назад, берётся из кэша без запроса.
     """
-    Самые активные участники.
+    if _cache is None:
+        return api_request('GET', url, params=params, **kwargs)
 
-    Таблица из 2 столбцов: login автора, количество его
-    коммитов. Таблица отсортирована по количеству коммитов по убыванию. Не
-    более 30 строк. Анализ производится на заданном периоде времени и заданной
-    ветке.
+    import requests
+
+    url = requests.Request('GET', url, params=params).prepare().url
+    cached = _cache.lookup(url)
+    if (cached and max_age is not None
+            and time.time() - cached[0].get('time', 0) <= max_age):
+        return _cache.response(url, *cached, None)
+
+    headers = _cache.conditional_headers(cached[0]) if cached else None
+    r = api_request('GET', url, headers=headers, **kwargs)
+
+    if r.status_code == 304 and cached:
+        return _cache.response(url, *cached, r)
+
+    _cache.store(url, r)
+    return r
+
+
+_graphql = False
+
+
+def graphql_enabled():
+    """Запрашиваются ли списки через GraphQL API."""
+    return _graphql
+
+
+def graphql(query, variables):
+    """Выполняет запрос к GraphQL API и возвращает поле data ответа."""
+    url = f'{GITHUB_API_ROOT}/graphql'
+    r = api_request('POST', url, resource='graphql',
+                    json={'query': query, 'variables': variables})
+
+    # Бросить исключение, если код ответа не 200
+    if r.status_code != 200:
+        raise RuntimeError(
+            'Сервер вернул код ошибки {}'.format(r.status_code))
+
+    profiler = _profiler
+    if profiler is not None:
+        start = time.perf_counter()
+    try:
+        response = r.json()
+    except Exception as e:
+        raise RuntimeError(
+            'Неожиданный ответ GraphQL API: {}'.format(str(e)))
+    if profiler is not None:
+        profiler.timing('json', time.perf_counter() - start)
+
+    if response.get('errors'):
+        raise RuntimeError('Ошибка GraphQL API: {}'.format('; '.join(
+            error.get('message', '') for error in response['errors'])))
+
+    return response['data']
+
+
+def graphql_pages(query, variables, connection, position=None):
     """
-    commiters = select_active_commiters(
-        owner, repo, branch, from_date, to_date, limit=max_commiters)
-    report = ACTIVE_COMMITERS_TEMPLATE.format(
-        '\n'.join('{:<20.20} {:6d}'.format(*item) for item in commiters)
-    )
-    print(report)
+    Генератор страниц узлов связи (connection) GraphQL.
 
+    connection - функция, выделяющая связь из поля data ответа. Связь
+    должна запрашиваться с полями pageInfo { hasNextPage endCursor } и
+    nodes, а запрос - принимать курсор в переменной $after. Страницы
+    следуют друг за другом по курсору, поэтому запрашиваются
+    последовательно.
 
-def print_pull_requests(owner, repo, branch, from_date, to_date, age=30):
+    Словарь position используется так же, как в paginate, но хранит курсор
+    следующей страницы под ключом 'after'.
     """
-    Отчёт по PR.
+    if position is None:
+        position = {}
+    while True:
+        page = connection(graphql(
+            query, dict(variables, after=position.get('after'))))
+        position['after'] = page['pageInfo']['endCursor']
+        if _profiler is not None:
+            _profiler.page(f'{GITHUB_API_ROOT}/graphql')
+        yield page['nodes']
 
-    Количество открытых и закрытых pull requests на заданном периоде времени по
-    дате создания PR и заданной ветке, являющейся базовой для этого PR.
+        if not page['pageInfo']['hasNextPage']:
+            return
 
-    Количество "старых" pull requests на заданном периоде времени по дате
-    создания PR и заданной ветке, являющейся базовой для этого PR.
 
-    Pull request считается старым, если он не закрывается в течение 30 дней
-    и до сих пор открыт.
+def submit(executor, fn, *args, **kwargs):
+    """
+    Отправляет задачу в пул executor так, что она выполняется в копии
+    контекста вызывающего потока: запросы задачи расходуют резерв лимитов
+    того задания, которое её отправило (см. RateLimitGovernor.reserve).
     """
-    report = PR_TEMPLATE.format(
-        *count_pull_requests(owner, repo, branch, from_date, to_date, age=age))
-    print(report)
+    return executor.submit(contextvars.copy_context().run, fn, *args,
+                           **kwargs)
 
 
-def print_issues(owner, repo, from_date, to_date, age=14):
+def fetch_page(url, params, what, allow_empty=False, parse=None):
     """
-    Отчёт по issues.
+    Получает одну страницу списка.
 
-    Количество открытых и закрытых issues на заданном периоде времени.
-    Количество "старых" issues на заданном периоде времени по дате создания
-    issue. Issue считается старым, если он не закрывается в течение 14 дней.
+    Возвращает пару (ссылки заголовка Link, список элементов страницы).
+    what - название элементов списка для сообщений об ошибках. Пустая
+    страница считается ошибкой, если не задан allow_empty.
+
+    Если передана функция parse, возвращается не разобранный JSON, а
+    результат parse(список элементов): так от страницы сразу остаются
+    только нужные поля, а тело ответа и словари элементов освобождаются.
     """
-    report = ISSUES_TEMPLATE.format(
-        *count_issues(owner, repo, from_date, to_date, age=age))
-    print(report)
+    # Отправить запрос GitHub и получить ответ
+    r = http_get(url, params=params)
 
+    # Бросить исключение, если код ответа не 200
+    if r.status_code != 200:
+        raise RuntimeError(
+            'Сервер вернул код ошибки {}'.format(r.status_code))
 
-def main():
-    """Точка входа."""
+    profiler = _profiler
+    if profiler is not None:
+        profiler.page(url)
+        start = time.perf_counter()
+
+    # Попробовать создать JSON-объект из ответа
     try:
-        url, from_date, to_date, verbose, branch = parse_args(sys.argv[1:])
-    except getopt.GetoptError as err:
-        print('Неизвестная опция: {}'.format(str(err)))
-        usage()
-        return 2
+        response = r.json()
+    except Exception as e:
+        message = 'Не удалось получить все {} '.format(what)
+        if rate_limit() == 0:
+            message += 'т.к. исчерпан лимит запросов.'
+        else:
+            message += 'по причине "{}".'.format(
+                str(e))
 
-    if url is None:
-        print('Не задан URL репозитория.')
-        usage()
-        return 2
+        raise RuntimeError(message)
 
-    # Попытаться разобрать переданный URL
-    try:
-        owner, repo = parse_url(url)
-    except Exception:
-        print('Неправильный формат строки URL ({}).'.format(url))
-        return 2
+    # Некоторое количество элементов должно быть, иначе прекратить
+    # получать данные
+    if not isinstance(response, list) or not (response or allow_empty):
+        raise RuntimeError(
+            'Неожиданный формат ответа: {}'.format(response))
 
-    # Если дата начала анализа не указана, получить дату создания репозитория
-    if from_date is None:
-        try:
-            from_date = get_repository_start_date(owner, repo)
-        except Exception:
-            print('Неожиданный ответ сервера')
-            return -1
+    if parse is not None:
+        if profiler is not None:
+            profiler.timing('json', time.perf_counter() - start)
+            start = time.perf_counter()
+        response = parse(response)
+        if profiler is not None:
+            profiler.timing('parse', time.perf_counter() - start)
+    elif profiler is not None:
+        profiler.timing('json', time.perf_counter() - start)
 
-    if verbose:
-        print('Анализ ветки {} репозитория {} с {} до {}'.format(
-            branch, url, from_date.date(), to_date.date()))
+    return r.links, response
 
-    # Проверка исчерпания лимита запросов в GitHub
-    limit = rate_limit()
 
-    if limit == 0:
-        print('Лимит запросов в час исчерпан.')
-        sys.exit(-1)
-    elif verbose:
-        print('Оставший запас запросов: {}'.format(limit))
+def page_url(url, page):
+    """Возвращает ссылку на страницу с номером page того же списка."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
-    # Отчёт по участникам
-    if verbose:
-        print('Получение данных для отчёта по самым активным участника.')
 
-    try:
-        print_active_commiters(owner, repo, branch, from_date, to_date)
-    except Exception as e:
-        print('Не удалось сформировать отчёт по участникам: {}'.format(str(e)))
-        return -1
+def page_number(url):
+    """Возвращает номер страницы из ссылки или None."""
+    page = dict(parse_qsl(urlsplit(url).query)).get('page')
+    return int(page) if page and page.isdigit() else None
 
-    # Отчёт по PR
-    if verbose:
-        print('Получение данных для отчёта по PR.')
 
+def paginate(url, params, what, window=None, allow_empty=False,
+             position=None, parse=None):
+    """
+    Генератор страниц списка.
+
+    Страницы запрашиваются по PER_PAGE элементов и выдаются строго по
+    порядку. Первая страница запрашивается отдельно: по ссылке rel="last"
+    из её заголовка Link становится известно количество страниц, после
+    чего остальные запрашиваются одновременно. Число одновременно
+    запрошенных страниц растёт вдвое с каждой выданной страницей (1, 2,
+    4, ...) до window (по умолчанию - PAGE_WINDOW): обход, который
+    вызывающий код прекращает через несколько страниц, не тратит запросов
+    на window страниц вперёд. Если
+    сервер не сообщил номер последней страницы, страницы запрашиваются
+    последовательно по ссылке rel="next".
+
+    Вызывающий код может прекратить получение страниц в любой момент,
+    закрыв генератор (например, выйдя из цикла внутри
+    contextlib.closing), - ещё не полученные страницы при этом
+    отменяются.
+
+    Если передан словарь position, обход начинается со страницы
+    position['page'], а перед выдачей каждой страницы в position
+    записывается номер следующей - так вызывающий код может сохранить
+    место, с которого обход можно продолжить (см. Checkpoint).
+
+    parse - функция, которой страница разбирается сразу после получения
+    (см. fetch_page). В очереди одновременно запрошенных страниц тогда
+    хранятся только её результаты, и память, занимаемая обходом, не
+    зависит от размера ответов GitHub.
+    """
+    if window is None:
+        window = PAGE_WINDOW
+    if position is None:
+        position = {}
+    first = position.get('page', 1)
+    first_params = dict(params, per_page=PER_PAGE)
+    if first > 1:
+        first_params['page'] = first
+
+    links, response = fetch_page(url, first_params, what, allow_empty, parse)
+    position['page'] = first + 1
+    yield response
+
+    # Это была последняя страница, больше нечего запрашивать
+    if 'next' not in links:
+        return
+
+    last_url = links.get('last', {}).get('url')
+    last = page_number(last_url) if last_url else None
+
+    if last is None:
+        while 'next' in links:
+            next_url = links['next']['url']
+            links, response = fetch_page(next_url, None, what, parse=parse)
+            position['page'] = (page_number(next_url) or position['page']) + 1
+            yield response
+        return
+
+    executor = ThreadPoolExecutor(max_workers=window)
+    # Очередь запрошенных страниц в порядке их номеров
+    pending = deque()
+    next_page = page_number(links['next']['url']) or 2
+    size = 1
     try:
-        print_pull_requests(owner, repo, branch, from_date, to_date)
-    except Exception as e:
-        print('Не удалось сформировать отчёт по PR: {}'.format(str(e)))
-        return -1
+        while next_page <= last or pending:
+            # Поддерживать не более size одновременных запросов
+            while next_page <= last and len(pending) < size:
+                pending.append(submit(
+                    executor, fetch_page, page_url(last_url, next_page),
+                    None, what, parse=parse))
+                next_page += 1
+
+            _, response = pending.popleft().result()
+            position['page'] += 1
+            yield response
+            size = min(size * 2, window)
+    finally:
+        # Отменить запросы страниц, которые больше не нужны. Уже
+        # отправленные запросы не отменяются и учитываются fetch_page как
+        # полученные страницы, поэтому пропущенными считаются только
+        # страницы, запросы которых так и не были отправлены
+        cancelled = sum(future.cancel() for future in pending)
+        executor.shutdown(wait=False)
+        if _profiler is not None:
+            _profiler.page(last_url, fetched=0,
+                           skipped=cancelled + max(last - next_page + 1, 0))
 
-    # Отчёт по issue
-    if verbose:
-        print('Получение данных для отчёта по issue.')
 
+def rate_limit_status(token=None, resource='core'):
+    """Возвращает количество оставшихся у токена запросов лимита resource
+    и время восстановления лимита в секундах с начала эпохи."""
+    url = f'{GITHUB_API_ROOT}/rate_limit'
+    r = http_get(url, resource=None, token=token)
     try:
-        print_issues(owner, repo, from_date, to_date)
-    except Exception as e:
-        print('Не удалось сформировать отчёт по issue: {}'.format(str(e)))
-        return -1
+        data = r.json()
+        rate = data['rate'] if resource == 'core' \
+            else data['resources'][resource]
+        return rate['remaining'], rate['reset']
+    except Exception:
+        print('Неправильный ответ сервера: {}'.format(r.text))
+        sys.exit(-1)
+
+
+def rate_limit(resource='core'):
+    """
+    Возвращает количество оставшихся запросов лимита resource для всех
+    токенов.
+
+    Остаток известен из заголовков ответов на предыдущие запросы, поэтому
+    /rate_limit запрашивается только для токенов, которые ещё не
+    использовались.
+    """
+    with profiled('rate_limit'):
+        for token in _governor.unknown_tokens(resource):
+            remaining, reset = rate_limit_status(token, resource)
+            _governor.set_limit(token, resource, remaining, reset)
+        return _governor.remaining(resource)
+
+
+def get_repository(owner, repo):
+    """
+    Получить описание репозитория.
+
+    Описание, полученное не раньше чем REPOSITORY_MAX_AGE секунд назад,
+    берётся из кэша ответов без запроса (см. http_get). Ответы с ошибкой
+    не кэшируются: если код ответа не 200, бросается RuntimeError.
+    """
+    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}'
+    r = http_get(url, max_age=REPOSITORY_MAX_AGE)
+    if r.status_code != 200:
+        raise RuntimeError(
+            'Сервер вернул код ошибки {}'.format(r.status_code))
+    return r.json()
+
+
+def get_repository_start_date(owner, repo):
+    """Получить дату создания репозитория."""
+    with profiled('repository'):
+        return str2datetime(get_repository(owner, repo)['created_at'])
+
+
+# Контрольные точки длинных обходов
+
+class Checkpoint:
+    """
+    Контрольная точка постраничного обхода.
+
+    Хранит место, с которого обход можно продолжить (position, см.
+    paginate), и накопленные к этому месту счётчики. Файл контрольной точки
+    определяется видом обхода и репозиторием, а вместе с состоянием в нём
+    записываются параметры обхода: если параметры изменились, сохранённое
+    состояние не используется. Файл записывается атомарно, поэтому прерванная
+    запись не портит предыдущую контрольную точку.
+    """
+
+    def __init__(self, path, params, resume=False):
+        self.path = path
+        self.params = params
+        # Место продолжения обхода, обновляется генератором страниц
+        self.position = {}
+        # Счётчики, накопленные к месту продолжения, или None
+        self.counters = None
+
+        if resume:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data['params'] == params:
+                    self.position = data['position']
+                    self.counters = data['counters']
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def save(self, counters):
+        """Сохраняет текущее место обхода и счётчики."""
+        data = {
+            'params': self.params,
+            'position': self.position,
+            'counters': counters
+        }
+        directory = os.path.dirname(self.path)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Удаляет контрольную точку завершённого обхода."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+_checkpoints = None
+
+
+def configure_checkpoints(directory, resume=False):
+    """
+    Включает контрольные точки длинных обходов в каталоге directory.
+
+    Если задан resume, обходы продолжаются с сохранённых контрольных точек.
+    """
+    global _checkpoints
+    os.makedirs(directory, exist_ok=True)
+    _checkpoints = (directory, resume)
+
+
+def open_checkpoint(kind, owner, repo, **params):
+    """Контрольная точка обхода kind по репозиторию или None, если
+    контрольные точки не включены."""
+    if _checkpoints is None:
+        return None
+    directory, resume = _checkpoints
+    name = hashlib.sha256(f'{kind}:{owner}/{repo}'.encode('utf-8')).hexdigest()
+    # Место продолжения зависит от способа обхода, а "старые" элементы -
+    # от текущей даты
+    params = dict(params, graphql=graphql_enabled(), per_page=PER_PAGE,
+                  today=today().isoformat())
+    return Checkpoint(os.path.join(directory, name + '.json'), params, resume)
+
+
+# Функции анализа репозитория
+
+# Запросы GraphQL запрашивают только поля, нужные для отчётов
+
+COMMIT_AUTHORS_QUERY = """
+query($owner: String!, $repo: String!, $branch: String!,
+      $since: GitTimestamp, $until: GitTimestamp, $after: String) {
+  repository(owner: $owner, name: $repo) {
+    object(expression: $branch) {
+      ... on Commit {
+        history(first: 100, after: $after, since: $since, until: $until) {
+          pageInfo { hasNextPage endCursor }
+          nodes { oid committedDate author { user { login } } }
+        }
+      }
+    }
+  }
+}
+"""
+
+PULL_REQUESTS_QUERY = """
+query($owner: String!, $repo: String!, $branch: String, $after: String) {
+  repository(owner: $owner, name: $repo) {
+    pullRequests(first: 100, after: $after, baseRefName: $branch,
+                 orderBy: {field: CREATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { createdAt closedAt state baseRefName }
+    }
+  }
+}
+"""
+
+ISSUES_QUERY = """
+query($owner: String!, $repo: String!, $after: String) {
+  repository(owner: $owner, name: $repo) {
+    issues(first: 100, after: $after,
+           orderBy: {field: CREATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { createdAt closedAt state }
+    }
+  }
+}
+"""
+
+
+def commit_author_pages(owner, repo, branch, from_date, to_date,
+                        allow_empty=False, position=None):
+    """
+    Генератор страниц авторов коммитов в заданной ветке за заданный
+    промежуток времени.
+
+    Каждая страница - список троек (SHA, время коммита, логин автора),
+    время - в формате isotime, в порядке убывания. Отсутствие коммитов
+    считается ошибкой, если не задан allow_empty.
+    position - место продолжения обхода (см. paginate).
+    """
+    if graphql_enabled():
+        pages = graphql_commit_author_pages(
+            owner, repo, branch, from_date, to_date, allow_empty, position)
+    else:
+        pages = rest_commit_author_pages(
+            owner, repo, branch, from_date, to_date, allow_empty, position)
+
+    with closing(pages):
+        yield from pages
+
+
+def rest_commit_author_pages(owner, repo, branch, from_date, to_date,
+                             allow_empty=False, position=None):
+    """Страницы авторов коммитов через REST API."""
+    # Подготовить строку запроса а API
+    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/commits'
+    # Получить список коммитов в заданной ветке за заданный промежуток времени
+    params = {
+        'sha': branch,
+        'since': from_date.isoformat(),
+        'until': to_date.isoformat()
+    }
+
+    def parse(response):
+        try:
+            return [(commit['sha'], commit['commit']['committer']['date'],
+                     sys.intern(commit['author']['login']))
+                    for commit in response]
+        except Exception as e:
+            raise RuntimeError(
+                'Не удалось получить логин участника: {}'.format(str(e)))
+
+    # Githib возвращает список коммитов постранично
+    with closing(paginate(url, params, 'коммиты', allow_empty=allow_empty,
+                          position=position, parse=parse)) as pages:
+        yield from pages
+
+
+def graphql_commit_author_pages(owner, repo, branch, from_date, to_date,
+                                allow_empty=False, position=None):
+    """Страницы авторов коммитов через GraphQL API."""
+    variables = {
+        'owner': owner,
+        'repo': repo,
+        'branch': branch,
+        'since': isotime(from_date),
+        'until': isotime(to_date)
+    }
+
+    def connection(data):
+        target = data['repository']['object']
+        if not target:
+            raise RuntimeError('Ветка {} не найдена'.format(branch))
+        return target['history']
+
+    for nodes in graphql_pages(COMMIT_AUTHORS_QUERY, variables, connection,
+                               position):
+        if not nodes and not allow_empty:
+            raise RuntimeError('Неожиданный формат ответа: []')
+        try:
+            commits = [(node['oid'], node['committedDate'],
+                        sys.intern(node['author']['user']['login']))
+                       for node in nodes]
+        except Exception as e:
+            raise RuntimeError(
+                'Не удалось получить логин участника: {}'.format(str(e)))
+        yield commits
+
+
+class CommitCounter:
+    """
+    Количества коммитов участников.
+
+    Логины хранятся в списке в порядке первого появления, количества - в
+    массиве целых чисел, а словарь сопоставляет логину его номер. Так на
+    участника приходится одна строка и одно машинное слово, а участники с
+    равным количеством коммитов в выборке идут в порядке появления, как при
+    сортировке словаря {login: count}.
+    """
+
+    __slots__ = ('index', 'logins', 'counts')
+
+    def __init__(self, counts=None):
+        self.index = {}
+        self.logins = []
+        self.counts = array('q')
+        for login, count in (counts or {}).items():
+            self.add(login, count)
+
+    def add(self, login, count=1):
+        """Добавляет участнику login count коммитов."""
+        i = self.index.get(login)
+        if i is None:
+            self.index[login] = len(self.logins)
+            self.logins.append(sys.intern(login))
+            self.counts.append(count)
+        else:
+            self.counts[i] += count
+
+    def as_dict(self):
+        """Количества в формате {login: count}."""
+        return dict(zip(self.logins, self.counts))
+
+    def most_common(self, limit):
+        """Список кортежей [(login, count)] limit самых активных
+        участников."""
+        top = heapq.nlargest(limit, range(len(self.counts)),
+                             key=self.counts.__getitem__)
+        return [(self.logins[i], self.counts[i]) for i in top]
+
+
+def select_active_commiters(owner, repo, branch, from_date, to_date, limit=30,
+                            store=None, stats=False):
+    """
+    Делает выборку самых активных участников разработки.
+
+    Если передано локальное хранилище store, выборка делается по нему без
+    обращения к GitHub. Если задан stats и ветка - основная ветка
+    репозитория, участники подсчитываются по недельной статистике GitHub
+    (см. stats_active_commiters).
+    """
+    if store is not None:
+        return store.active_commiters(
+            owner, repo, branch, from_date, to_date, limit=limit)
+
+    if stats:
+        try:
+            return stats_active_commiters(
+                owner, repo, branch, from_date, to_date, limit=limit)
+        except StatsUnavailable:
+            pass
+
+    # Продолжить прерванный обход, если он был
+    checkpoint = open_checkpoint(
+        'commits', owner, repo, branch=branch, since=from_date.isoformat(),
+        until=to_date.isoformat())
+    position = None
+    commiters = CommitCounter()
+    if checkpoint is not None:
+        position = checkpoint.position
+        commiters = CommitCounter(checkpoint.counters)
+
+    # Подсчитать количество коммитов от каждого участника
+    with closing(commit_author_pages(
+            owner, repo, branch, from_date, to_date,
+            position=position)) as pages:
+        for number, commits in enumerate(pages, 1):
+            profiler = _profiler
+            if profiler is not None:
+                start = time.perf_counter()
+
+            for _, _, login in commits:
+                commiters.add(login)
+
+            if profiler is not None:
+                profiler.timing('count', time.perf_counter() - start)
+
+            if checkpoint is not None and number % CHECKPOINT_EVERY == 0:
+                checkpoint.save(commiters.as_dict())
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    # Вернуть самых активных в виде списка кортежей [(login, count)],
+    # ограничив количество TOP-участников
+    return commiters.most_common(limit)
+
+
+class StatsUnavailable(RuntimeError):
+    """Участников нельзя подсчитать по статистике GitHub."""
+
+
+def contributor_stats(owner, repo):
+    """
+    Возвращает недельную статистику коммитов участников основной ветки.
+
+    GitHub вычисляет статистику в фоне и, пока она не готова, отвечает
+    кодом 202. Запрос повторяется STATS_POLL_ATTEMPTS раз с удваивающейся
+    паузой.
+    """
+    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/stats/contributors'
+    delay = STATS_POLL_DELAY
+    for attempt in range(STATS_POLL_ATTEMPTS):
+        r = http_get(url)
+        if r.status_code == 200:
+            try:
+                return r.json()
+            except Exception as e:
+                raise StatsUnavailable(
+                    'Неожиданный ответ статистики: {}'.format(str(e)))
+        if r.status_code != 202:
+            raise StatsUnavailable(
+                'Сервер вернул код ошибки {}'.format(r.status_code))
+        if attempt + 1 < STATS_POLL_ATTEMPTS:
+            time.sleep(delay)
+            delay *= 2
+
+    raise StatsUnavailable('Статистика участников ещё не подсчитана')
+
+
+def stats_active_commiters(owner, repo, branch, from_date, to_date, limit=30):
+    """
+    Делает выборку самых активных участников по недельной статистике.
+
+    /stats/contributors одним запросом возвращает количество коммитов
+    каждого участника основной ветки по неделям (неделя начинается в
+    воскресенье в 00:00 UTC). Недели, целиком попадающие в интервал
+    анализа, берутся из статистики, а коммиты неполных недель на краях
+    интервала запрашиваются как обычно.
+
+    GitHub относит коммит к неделе статистики по дате автора, а история
+    ветки (since, until) и обход коммитов отбирают коммиты по дате
+    коммитера. Поэтому выборка может отличаться от обхода коммитов на
+    коммиты, у которых эти даты разделены границей полных недель:
+    коммит, написанный в полную неделю, а закоммиченный (rebase,
+    cherry-pick) в неполную, учитывается дважды, а в обратном случае не
+    учитывается; коммит, написанный в полную неделю и закоммиченный после
+    конца интервала, учитывается, хотя обход его не видит.
+
+    Статистика есть только для основной ветки и только для 100 самых
+    активных за всю историю участников. Если ветка не основная или
+    участников 100, а интервал не начинается с создания репозитория (тогда
+    в выборку мог бы попасть участник не из этой сотни), бросается
+    StatsUnavailable.
+    """
+    if branch != get_repository(owner, repo).get('default_branch'):
+        raise StatsUnavailable('Статистика есть только для основной ветки')
+
+    stats = contributor_stats(owner, repo)
+    if not isinstance(stats, list) or not stats:
+        raise StatsUnavailable('Статистика участников пуста')
+    if (len(stats) >= STATS_MAX_CONTRIBUTORS
+            and from_date > get_repository_start_date(owner, repo)):
+        raise StatsUnavailable('Статистика содержит не всех участников')
+
+    # Границы первой и последней полных недель интервала анализа. Начало
+    # эпохи приходится на четверг, ближайшее воскресенье - через 3 дня
+    week, sunday = 7 * 24 * 3600, 3 * 24 * 3600
+    from_ts = calendar.timegm(from_date.timetuple())
+    to_ts = calendar.timegm(to_date.timetuple())
+    first = -((sunday - from_ts) // week) * week + sunday
+    last = (to_ts - sunday) // week * week + sunday
+
+    try:
+        # Статистика может быть подсчитана не до последней недели
+        known = max(w['w'] for author in stats for w in author['weeks'])
+        last = min(last, known + week)
+        if first >= last:
+            raise StatsUnavailable('В интервале анализа нет полных недель')
+
+        commiters = CommitCounter()
+        for author in stats:
+            if not author.get('author'):
+                continue
+            count = sum(w['c'] for w in author['weeks']
+                        if first <= w['w'] < last)
+            if count:
+                commiters.add(author['author']['login'], count)
+    except StatsUnavailable:
+        raise
+    except Exception as e:
+        raise StatsUnavailable(
+            'Неожиданный формат статистики: {}'.format(str(e)))
+
+    # Коммиты неполных недель на краях интервала
+    edges = [(from_date, utcfromtimestamp(first - 1)),
+             (utcfromtimestamp(last), to_date)]
+    for since, until in edges:
+        if since >= until:
+            continue
+        with closing(commit_author_pages(owner, repo, branch, since, until,
+                                         allow_empty=True)) as pages:
+            for commits in pages:
+                for _, _, login in commits:
+                    commiters.add(login)
+
+    return commiters.most_common(limit)
+
+
+def branch_history(owner, repo, branch, from_date, to_date):
+    """
+    Список троек (SHA, время, логин автора) коммитов ветки за заданный
+    промежуток времени в порядке убывания времени.
+    """
+    history = []
+    with closing(commit_author_pages(owner, repo, branch, from_date, to_date,
+                                     allow_empty=True)) as pages:
+        for commits in pages:
+            history.extend(commits)
+    return history
+
+
+def compare_commits(owner, repo, base, head):
+    """
+    Коммиты ветки head, которых нет в ветке base.
+
+    /compare/{base}...{head} одним запросом возвращает коммиты от общего
+    предка веток до head, но не больше 250. Возвращает список троек (SHA,
+    время, логин автора) в порядке убывания времени или None, если коммитов
+    больше, чем вернул GitHub, или ветки сравнить не удалось (например, у
+    них нет общей истории и GitHub отвечает 404).
+    """
+    url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/compare/{base}...{head}'
+    r = http_get(url)
+
+    # Сравнение недоступно - история ветки запрашивается целиком
+    if r.status_code != 200:
+        return None
+
+    try:
+        data = r.json()
+        if len(data['commits']) < data['ahead_by']:
+            return None
+        # Сравнение перечисляет коммиты от старых к новым
+        return [(commit['sha'], commit['commit']['committer']['date'],
+                 sys.intern(commit['author']['login']))
+                for commit in reversed(data['commits'])]
+    except Exception as e:
+        raise RuntimeError(
+            'Не удалось получить логин участника: {}'.format(str(e)))
+
+
+def branch_commits(owner, repo, primary, history, branch, from_date, to_date):
+    """
+    Коммиты ветки branch за заданный промежуток времени, полученные из
+    истории history основной ветки primary (см. branch_history).
+
+    Из истории убираются коммиты, которых нет в ветке, и добавляются
+    коммиты ветки, которых нет в основной ветке. Оба расхождения
+    запрашиваются сравнением веток, поэтому общие коммиты повторно не
+    загружаются. Если расхождение слишком велико для сравнения или ветки
+    сравнить не удалось, история ветки запрашивается целиком.
+    """
+    ahead = compare_commits(owner, repo, primary, branch)
+    behind = compare_commits(owner, repo, branch, primary) \
+        if ahead is not None else None
+    if behind is None:
+        return branch_history(owner, repo, branch, from_date, to_date)
+
+    # Границы интервала включаются, как при запросе истории ветки
+    from_time, to_time = isotime(from_date), isotime(to_date)
+    missing = {sha for sha, _, _ in behind}
+    commits = [commit for commit in ahead
+               if from_time <= commit[1] <= to_time]
+    commits.extend(commit for commit in history if commit[0] not in missing)
+    # Сортировка устойчива, поэтому коммиты с равным временем остаются в
+    # том порядке, в котором их вернул GitHub
+    commits.sort(key=lambda commit: commit[1], reverse=True)
+    return commits
+
+
+def select_branch_commiters(owner, repo, branches, from_date, to_date,
+                            limit=30, store=None):
+    """
+    Делает выборку самых активных участников каждой из веток branches.
+
+    История первой ветки запрашивается целиком, а остальные ветки строятся
+    из неё по расхождениям с ней (см. branch_commits), так что коммит,
+    общий для нескольких веток, загружается один раз. Если передано
+    локальное хранилище store, выборка делается по нему.
+
+    Возвращает словарь {ветка: [(login, count)]}.
+    """
+    if store is not None:
+        return {branch: store.active_commiters(
+                    owner, repo, branch, from_date, to_date, limit=limit)
+                for branch in branches}
+
+    primary = branches[0]
+    history = branch_history(owner, repo, primary, from_date, to_date)
+    with ThreadPoolExecutor(max_workers=PAGE_WINDOW) as executor:
+        futures = {branch: submit(
+                       executor, branch_commits, owner, repo, primary,
+                       history, branch, from_date, to_date)
+                   for branch in branches[1:]}
+        result = {}
+        for branch in branches:
+            commits = history if branch == primary \
+                else futures[branch].result()
+            commiters = CommitCounter()
+            for _, _, login in commits:
+                commiters.add(login)
+            result[branch] = commiters.most_common(limit)
+
+    return result
+
+
+class Item:
+    """
+    PR или issue, разобранный из ответа GitHub один раз.
+
+    Время хранится строками в том виде, в котором его возвращает GitHub (см.
+    isotime), closed равно None, если элемент ни разу не закрывался. base -
+    базовая ветка PR, у issue - None. number - номер PR или issue в
+    репозитории; известен только для списков REST API (см.
+    rest_item_pages).
+    """
+
+    __slots__ = ('created', 'closed', 'open', 'base', 'number')
+
+    def __init__(self, created, closed, open, base=None, number=None):
+        self.created = created
+        self.closed = closed
+        self.open = open
+        self.base = base
+        self.number = number
+
+    @classmethod
+    def from_json(cls, item):
+        """Создаёт запись из элемента ответа REST API."""
+        return cls(item['created_at'], item['closed_at'],
+                   item['state'] == 'open',
+                   (item.get('base') or {}).get('ref'), item['number'])
+
+    @classmethod
+    def from_node(cls, node):
+        """Создаёт запись из узла ответа GraphQL API."""
+        return cls(node['createdAt'], node['closedAt'],
+                   node['state'] == 'OPEN', node.get('baseRefName'))
+
+
+def classify(items, from_time, to_time, stale_time):
+    """
+    Подсчитывает количества открытых, закрытых и "старых" элементов,
+    созданных на интервале [from_time, to_time), за один проход.
+
+    Элемент открыт, если открыт до сих пор или закрыт за пределами
+    интервала анализа, и закрыт, если закрыт до конца интервала. "Старым"
+    считается элемент, который открыт до сих пор и создан не позже
+    stale_time.
+
+    Все границы - строки, полученные isotime.
+    """
+    opened, closed, stale = 0, 0, 0
+    for item in items:
+        created = item.created
+        # Окно даты создания
+        if created < from_time or created >= to_time:
+            continue
+        if item.open:
+            opened += 1
+            if created <= stale_time:
+                stale += 1
+        elif item.closed < to_time:
+            closed += 1
+        else:
+            opened += 1
+
+    return opened, closed, stale
+
+
+def rest_item_pages(url, params, what, position=None, skip_pulls=False):
+    """
+    Генератор страниц записей Item списка PR или issue REST API.
+
+    Если задан skip_pulls, из страниц отбрасываются PR, которые список
+    /issues содержит наравне с issue. Записи Item для них не создаются.
+
+    Номер страницы - ненадёжное место продолжения обхода: PR и issue,
+    созданные после прерывания, сдвигают остальные на следующие страницы.
+    Поэтому обход, продолжаемый с контрольной точки (position содержит
+    'last', см. scan_items), начинается с первой страницы, а из страниц
+    отбрасываются элементы, подсчитанные до прерывания: не новее
+    последнего подсчитанного (position['last'] - [дата создания, номер])
+    и существовавшие тогда (номер не больше position['top']).
+    """
+    last = top = None
+    if position is not None and position.get('last'):
+        last, top = tuple(position['last']), position['top']
+        position['page'] = 1
+
+    def parse(response):
+        try:
+            items = [Item.from_json(item) for item in response
+                     if not skip_pulls or 'pull_request' not in item]
+        except Exception as e:
+            raise RuntimeError(
+                'Не удалось подсчитать все {}: {}'.format(what, str(e)))
+        if last is not None:
+            items = [item for item in items
+                     if item.number > top
+                     or (item.created, item.number) < last]
+        return items
+
+    # Githib возвращает список постранично
+    with closing(paginate(url, params, what, position=position,
+                          parse=parse)) as pages:
+        yield from pages
+
+
+def graphql_item_pages(query, variables, field, what, position=None):
+    """Генератор страниц записей Item связи field репозитория GraphQL
+    API."""
+    def connection(data):
+        return data['repository'][field]
+
+    for nodes in graphql_pages(query, variables, connection, position):
+        try:
+            items = [Item.from_node(node) for node in nodes]
+        except Exception as e:
+            raise RuntimeError(
+                'Не удалось подсчитать все {}: {}'.format(what, str(e)))
+        yield items
+
+
+def pull_request_pages(owner, repo, branch=None, position=None):
+    """
+    Генератор страниц записей Item о PR с базовой веткой branch (если
+    branch не задан - о PR всех веток) в порядке уменьшения даты создания.
+
+    position - место продолжения обхода (см. paginate).
+    """
+    if graphql_enabled():
+        pages = graphql_item_pages(
+            PULL_REQUESTS_QUERY,
+            {'owner': owner, 'repo': repo, 'branch': branch},
+            'pullRequests', 'PR', position)
+    else:
+        # Подготовить строку запроса а API
+        url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/pulls'
+        # Получить PRs всех состояний из нужной ветки
+        # Выборка будет происходить постранично в порядке уменьшения
+        # даты создания PR, начиная от сегодняшней даты
+        params = {
+            'base': branch,
+            'state': 'all',
+            'sort': 'created',
+            'direction': 'desc'
+        }
+        if branch is None:
+            del params['base']
+        pages = rest_item_pages(url, params, 'PR', position)
+
+    with closing(pages):
+        yield from pages
+
+
+def issue_pages(owner, repo, position=None):
+    """
+    Генератор страниц записей Item об issue в порядке уменьшения даты
+    создания.
+
+    position - место продолжения обхода (см. paginate).
+
+    Связь issues GraphQL API не содержит PR, а PR из списка /issues REST API
+    отбрасываются при разборе страницы, поэтому страница может оказаться
+    пустой.
+    """
+    if graphql_enabled():
+        pages = graphql_item_pages(
+            ISSUES_QUERY, {'owner': owner, 'repo': repo}, 'issues', 'issue',
+            position)
+    else:
+        # Подготовить строку запроса а API
+        url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/issues'
+        # Получить список issue всех состояний с даты начала анализа,
+        # отосортированный по убыванию даты создания issue
+        params = {
+            'state': 'all',
+            'sort': 'created',
+            'direction': 'desc'
+        }
+        pages = rest_item_pages(url, params, 'issue', position,
+                                skip_pulls=True)
+
+    with closing(pages):
+        yield from pages
+
+
+def scan_items(pages, what, from_date, to_date, age, checkpoint=None):
+    """
+    Подсчитывает количества открытых, закрытых и "старых" PR или issue.
+
+    pages - генератор страниц записей Item. Элементы должны выдаваться в
+    порядке убывания даты создания, тогда получение страниц прекращается,
+    как только очередная страница выходит за начало интервала анализа.
+    Если передана контрольная точка checkpoint, счётчики периодически
+    сохраняются в ней, а генератор pages должен обновлять
+    checkpoint.position. Вместе со счётчиками в checkpoint.position
+    сохраняются последний подсчитанный элемент (last - [дата создания,
+    номер]) и наибольший подсчитанный номер (top): по ним обход списка
+    REST API продолжается, не полагаясь на номера страниц (см.
+    rest_item_pages).
+    """
+    from_time, to_time = isotime(from_date), isotime(to_date)
+    # Элемент старый, если (today() - created).days > age
+    stale_time = isotime(today() - timedelta(days=age + 1))
+
+    # Инициализация счётчиков
+    total_open, total_closed, total_state = 0, 0, 0
+    last, top = None, None
+    if checkpoint is not None and checkpoint.counters:
+        total_open, total_closed, total_state = checkpoint.counters
+        top = checkpoint.position.get('top')
+
+    with closing(pages):
+        for number, items in enumerate(pages, 1):
+            profiler = _profiler
+            if profiler is not None:
+                start = time.perf_counter()
+
+            # Подсчитать количество открытых, закрытых и старых элементов
+            try:
+                o, c, s = classify(items, from_time, to_time, stale_time)
+            except Exception as e:
+                raise RuntimeError(
+                    'Не удалось подсчитать все {}: {}'.format(what, str(e)))
+
+            if profiler is not None:
+                profiler.timing('count', time.perf_counter() - start)
+
+            # Аккумулируем полученные счётчики в итоговых счётчиках
+            total_open += o
+            total_closed += c
+            total_state += s
+
+            if items and items[-1].number is not None:
+                last = [items[-1].created, items[-1].number]
+                top = max(top or 0, max(item.number for item in items))
+
+            # Элементы выдаются отсортированными в порядке убывания
+            # даты их создания. Чтобы не делать лишних запросов, прекратить
+            # получать страницы, когда дата создания последнего на странице
+            # элемента станет меньше даты начала анализа. Страницы,
+            # запрошенные заранее, при этом отменяются. Пустая страница
+            # (из списка issue отброшены PR) границы не показывает.
+            if items and items[-1].created < from_time:
+                break
+
+            if checkpoint is not None and number % CHECKPOINT_EVERY == 0:
+                if last is not None:
+                    checkpoint.position.update(last=last, top=top)
+                checkpoint.save([total_open, total_closed, total_state])
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return total_open, total_closed, total_state
+
+
+def scan_branch_items(pages, what, branches, from_date, to_date, age):
+    """
+    Подсчитывает количества открытых, закрытых и "старых" PR отдельно для
+    каждой из базовых веток branches.
+
+    pages - генератор страниц записей Item о PR всех веток, как для
+    scan_items. Каждая страница делится по базовой ветке и подсчитывается
+    classify, поэтому список PR проходится один раз для всех веток.
+    Возвращает словарь {ветка: (open, closed, stale)}.
+    """
+    from_time, to_time = isotime(from_date), isotime(to_date)
+    # Элемент старый, если (today() - created).days > age
+    stale_time = isotime(today() - timedelta(days=age + 1))
+
+    totals = {branch: (0, 0, 0) for branch in branches}
+    with closing(pages):
+        for items in pages:
+            profiler = _profiler
+            if profiler is not None:
+                start = time.perf_counter()
+
+            groups = defaultdict(list)
+            for item in items:
+                if item.base in totals:
+                    groups[item.base].append(item)
+            try:
+                for branch, group in groups.items():
+                    counts = classify(group, from_time, to_time, stale_time)
+                    totals[branch] = tuple(
+                        map(sum, zip(totals[branch], counts)))
+            except Exception as e:
+                raise RuntimeError(
+                    'Не удалось подсчитать все {}: {}'.format(what, str(e)))
+
+            if profiler is not None:
+                profiler.timing('count', time.perf_counter() - start)
+
+            # Прекратить получать страницы, как только они выходят за
+            # начало интервала анализа (см. scan_items)
+            if not items or items[-1].created < from_time:
+                break
+
+    return totals
+
+
+# Подсчёт через Search API
+
+class SearchUnavailable(RuntimeError):
+    """Количество нельзя точно получить через Search API."""
+
+
+def search_count(query):
+    """Возвращает количество issue и PR, найденных запросом query."""
+    url = f'{GITHUB_API_ROOT}/search/issues'
+    # У поиска отдельный, намного меньший лимит, который восстанавливается
+    # каждую минуту
+    try:
+        r = http_get(url, params={'q': query, 'per_page': 1},
+                     resource='search', max_wait=SEARCH_MAX_WAIT)
+    except RateLimitExceeded as e:
+        raise SearchUnavailable(str(e))
+
+    if r.status_code != 200:
+        raise SearchUnavailable(
+            'Сервер вернул код ошибки {}'.format(r.status_code))
+
+    try:
+        response = r.json()
+        total = response['total_count']
+    except Exception as e:
+        raise SearchUnavailable(
+            'Неожиданный ответ поиска: {}'.format(str(e)))
+
+    # Результат поиска, прерванного по таймауту, может быть неточным
+    if response.get('incomplete_results'):
+        raise SearchUnavailable('Поиск вернул неполный результат')
+
+    return total
+
+
+def search_qualifier(name, value):
+    """Квалификатор поискового запроса, при необходимости в кавычках."""
+    if '"' in value:
+        raise SearchUnavailable(
+            'Значение "{}" нельзя использовать в поиске'.format(value))
+    if any(c.isspace() for c in value):
+        value = '"{}"'.format(value)
+    return '{}:{}'.format(name, value)
+
+
+def search_items(query, from_date, to_date, age):
+    """
+    Подсчитывает количества открытых, закрытых и "старых" элементов,
+    созданных на интервале анализа, тремя запросами к Search API.
+
+    Условия те же, что в classify: закрытые - закрытые до конца интервала,
+    открытые - все остальные созданные на интервале, "старые" - открытые
+    до сих пор и созданные более age дней назад. Интервалы поиска включают
+    обе границы, а время в GitHub хранится с точностью до секунды, поэтому
+    конец интервала анализа заменяется предыдущей секундой.
+    """
+    if from_date >= to_date:
+        return 0, 0, 0
+
+    def created(last):
+        return 'created:{}..{}'.format(
+            from_date.strftime(SEARCH_TIME_FORMAT),
+            last.strftime(SEARCH_TIME_FORMAT))
+
+    last = to_date - timedelta(seconds=1)
+    total = search_count('{} {}'.format(query, created(last)))
+    closed = search_count('{} {} is:closed closed:<{}'.format(
+        query, created(last), to_date.strftime(SEARCH_TIME_FORMAT)))
+
+    # Элемент старый, если (today() - created).days > age
+    stale_last = min(last, today() - timedelta(days=age + 1))
+    stale = 0
+    if stale_last >= from_date:
+        stale = search_count(
+            '{} {} is:open'.format(query, created(stale_last)))
+
+    return total - closed, closed, stale
+
+
+def count_pull_requests(owner, repo, branch, from_date, to_date, age=30,
+                        store=None, search=False):
+    """
+    Подсчитывает количества открытых, закрытых и "старых" PR.
+
+    PR считается старым, если он открыт до сих пор и создан более age дней
+    назад. Если передано локальное хранилище store, подсчёт делается по нему
+    без обращения к GitHub. Если задан search, количества запрашиваются у
+    Search API, а при невозможности этого PR подсчитываются постранично.
+    """
+    if store is not None:
+        return store.count_pull_requests(
+            owner, repo, branch, from_date, to_date, age=age)
+
+    if search:
+        try:
+            query = 'repo:{}/{} is:pr {}'.format(
+                owner, repo, search_qualifier('base', branch))
+            return search_items(query, from_date, to_date, age)
+        except SearchUnavailable:
+            pass
+
+    checkpoint = open_checkpoint(
+        'pulls', owner, repo, branch=branch, since=from_date.isoformat(),
+        until=to_date.isoformat(), age=age)
+    position = checkpoint.position if checkpoint is not None else None
+    return scan_items(pull_request_pages(owner, repo, branch, position), 'PR',
+                      from_date, to_date, age, checkpoint)
+
+
+def count_branch_pull_requests(owner, repo, branches, from_date, to_date,
+                               age=30, store=None, search=False):
+    """
+    Подсчитывает количества открытых, закрытых и "старых" PR для каждой из
+    базовых веток branches.
+
+    Список PR всех веток запрашивается один раз и делится по базовой ветке
+    (см. scan_branch_items). По локальному хранилищу store и через Search
+    API PR подсчитываются для каждой ветки отдельно, как в
+    count_pull_requests. Возвращает словарь {ветка: (open, closed, stale)}.
+    """
+    if store is not None or search:
+        return {branch: count_pull_requests(
+                    owner, repo, branch, from_date, to_date, age=age,
+                    store=store, search=search)
+                for branch in branches}
+
+    return scan_branch_items(pull_request_pages(owner, repo), 'PR', branches,
+                             from_date, to_date, age)
+
+
+def count_issues(owner, repo, from_date, to_date, age=14, store=None,
+                 search=False):
+    """
+    Посчитывает количество issue.
+
+    Issue считается старой, если она открыта до сих пор и создана более age
+    дней назад. PR не считаются issue. Если передано локальное хранилище
+    store, подсчёт делается по нему без обращения к GitHub. Если задан
+    search, количества запрашиваются у Search API, а при невозможности
+    этого issue подсчитываются постранично. PR, которые содержит список
+    /issues REST API, отбрасываются при разборе страниц (см. issue_pages).
+    """
+    if store is not None:
+        return store.count_issues(owner, repo, from_date, to_date, age=age)
+
+    if search:
+        try:
+            return search_items(
+                'repo:{}/{} is:issue'.format(owner, repo), from_date, to_date,
+                age)
+        except SearchUnavailable:
+            pass
+
+    checkpoint = open_checkpoint(
+        'issues', owner, repo, since=from_date.isoformat(),
+        until=to_date.isoformat(), age=age)
+    position = checkpoint.position if checkpoint is not None else None
+    return scan_items(issue_pages(owner, repo, position), 'issue',
+                      from_date, to_date, age, checkpoint)
+
+
+# Локальное хранилище
+
+def utcnow():
+    """Возвращает текущее время UTC в виде объекта datetime без зоны."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def utcfromtimestamp(ts):
+    """Создаёт объект datetime без зоны (UTC) из секунд с начала эпохи."""
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def iso(time_str):
+    """Приводит время из ответа GitHub к виду, в котором оно хранится в
+    базе и сравнивается с datetime.isoformat()."""
+    return time_str[:19] if time_str else None
+
+
+class SyncStore:
+    """
+    Локальная база коммитов, PR и issue на SQLite.
+
+    Первая синхронизация репозитория загружает всю историю, последующие -
+    только изменившееся с прошлой синхронизации: коммиты и issue с
+    параметром since, PR - в порядке убывания даты обновления до первого
+    не изменившегося. Отчёты для любого периода и ветки строятся запросами
+    к индексированным таблицам.
+
+    Время хранится строками ISO-формата без зоны, поэтому сравнивается с
+    datetime.isoformat() лексикографически.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS commits (
+        repo TEXT NOT NULL,
+        sha TEXT NOT NULL,
+        login TEXT,
+        date TEXT NOT NULL,
+        PRIMARY KEY (repo, sha)
+    );
+    CREATE TABLE IF NOT EXISTS branch_commits (
+        repo TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        sha TEXT NOT NULL,
+        PRIMARY KEY (repo, branch, sha)
+    );
+    CREATE TABLE IF NOT EXISTS pulls (
+        repo TEXT NOT NULL,
+        number INTEGER NOT NULL,
+        base TEXT NOT NULL,
+        state TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        closed_at TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (repo, number)
+    );
+    CREATE TABLE IF NOT EXISTS issues (
+        repo TEXT NOT NULL,
+        number INTEGER NOT NULL,
+        is_pr INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        closed_at TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (repo, number)
+    );
+    CREATE TABLE IF NOT EXISTS sync_state (
+        repo TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        synced_at TEXT NOT NULL,
+        PRIMARY KEY (repo, kind, branch)
+    );
+    CREATE INDEX IF NOT EXISTS commits_date ON commits (repo, date);
+    CREATE INDEX IF NOT EXISTS pulls_created ON pulls (repo, base, created_at);
+    CREATE INDEX IF NOT EXISTS issues_created ON issues (repo, created_at);
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(self.SCHEMA)
+
+    def close(self):
+        """Закрывает базу."""
+        self._db.close()
+
+    def _query(self, sql, args=()):
+        """Выполняет запрос на чтение и возвращает все строки."""
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _write(self, sql, rows):
+        """Выполняет запрос на запись для каждой строки rows."""
+        with self._lock, self._db:
+            self._db.executemany(sql, rows)
+
+    def _synced_at(self, key, kind, branch=''):
+        """Время прошлой синхронизации или None."""
+        rows = self._query(
+            'SELECT synced_at FROM sync_state '
+            'WHERE repo = ? AND kind = ? AND branch = ?', (key, kind, branch))
+        return datetime.fromisoformat(rows[0][0]) if rows else None
+
+    def _set_synced_at(self, key, kind, synced_at, branch=''):
+        """Запоминает время синхронизации."""
+        self._write(
+            'INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)',
+            [(key, kind, branch, synced_at.isoformat())])
+
+    # Синхронизация
+
+    def sync(self, owner, repo, branches, jobs=DEFAULT_JOBS):
+        """Синхронизирует коммиты веток branches, PR и issue
+        репозитория."""
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                submit(executor, self.sync_commits, owner, repo, branch)
+                for branch in branches
+            ] + [
+                submit(executor, self.sync_pull_requests, owner, repo),
+                submit(executor, self.sync_issues, owner, repo),
+            ]
+            for future in futures:
+                future.result()
+
+    def sync_commits(self, owner, repo, branch):
+        """Загружает коммиты ветки, появившиеся с прошлой синхронизации."""
+        key = f'{owner}/{repo}'
+        started = utcnow()
+        synced_at = self._synced_at(key, 'commits', branch)
+
+        url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/commits'
+        params = {'sha': branch}
+        if synced_at is not None:
+            params['since'] = (synced_at - SYNC_OVERLAP).isoformat()
+
+        with closing(paginate(url, params, 'коммиты',
+                              allow_empty=True)) as pages:
+            for response in pages:
+                try:
+                    rows = [(key, commit['sha'],
+                             (commit['author'] or {}).get('login'),
+                             iso(commit['commit']['committer']['date']))
+                            for commit in response]
+                except Exception as e:
+                    raise RuntimeError(
+                        'Неожиданный формат коммита: {}'.format(str(e)))
+                self._write(
+                    'INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?)', rows)
+                self._write(
+                    'INSERT OR IGNORE INTO branch_commits VALUES (?, ?, ?)',
+                    [(key, branch, row[1]) for row in rows])
+
+        self._set_synced_at(key, 'commits', started, branch)
+
+    def sync_pull_requests(self, owner, repo):
+        """Загружает PR всех веток, изменившиеся с прошлой синхронизации."""
+        key = f'{owner}/{repo}'
+        started = utcnow()
+        synced_at = self._synced_at(key, 'pulls')
+        since = synced_at.isoformat() if synced_at is not None else ''
+
+        url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/pulls'
+        # У /pulls нет параметра since, поэтому PR запрашиваются в порядке
+        # убывания даты обновления до первого не изменившегося
+        params = {
+            'state': 'all',
+            'sort': 'updated',
+            'direction': 'desc'
+        }
+
+        with closing(paginate(url, params, 'PR', allow_empty=True)) as pages:
+            for response in pages:
+                try:
+                    rows = [(key, pr['number'], pr['base']['ref'], pr['state'],
+                             iso(pr['created_at']), iso(pr['closed_at']),
+                             iso(pr['updated_at']))
+                            for pr in response
+                            if iso(pr['updated_at']) >= since]
+                except Exception as e:
+                    raise RuntimeError(
+                        'Неожиданный формат PR: {}'.format(str(e)))
+                self._write('INSERT OR REPLACE INTO pulls '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+                if len(rows) < len(response):
+                    break
+
+        self._set_synced_at(key, 'pulls', started)
+
+    def sync_issues(self, owner, repo):
+        """Загружает issue, изменившиеся с прошлой синхронизации."""
+        key = f'{owner}/{repo}'
+        started = utcnow()
+        synced_at = self._synced_at(key, 'issues')
+
+        url = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}/issues'
+        params = {
+            'state': 'all',
+            'sort': 'updated',
+            'direction': 'asc'
+        }
+        if synced_at is not None:
+            params['since'] = synced_at.isoformat() + 'Z'
+
+        with closing(paginate(url, params, 'issue',
+                              allow_empty=True)) as pages:
+            for response in pages:
+                try:
+                    rows = [(key, issue['number'],
+                             int('pull_request' in issue), issue['state'],
+                             iso(issue['created_at']), iso(issue['closed_at']),
+                             iso(issue['updated_at']))
+                            for issue in response]
+                except Exception as e:
+                    raise RuntimeError(
+                        'Неожиданный формат issue: {}'.format(str(e)))
+                self._write(
+                    'INSERT OR REPLACE INTO issues '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+        self._set_synced_at(key, 'issues', started)
+
+    def sync_cost(self, owner, repo, branches, list_size):
+        """
+        Оценка количества запросов синхронизации (см. sync).
+
+        list_size(kind, **params) - количество элементов списка
+        /repos/{owner}/{repo}/{kind} с параметрами params. У /pulls нет
+        параметра since, поэтому при повторной синхронизации количество
+        изменившихся PR оценивается сверху количеством изменившихся issue и
+        PR из /issues.
+        """
+        key = f'{owner}/{repo}'
+        cost = 0
+        for branch in branches:
+            params = {'sha': branch}
+            synced_at = self._synced_at(key, 'commits', branch)
+            if synced_at is not None:
+                params['since'] = (synced_at - SYNC_OVERLAP).isoformat()
+            cost += page_count(list_size('commits', **params))
+
+        params = {'state': 'all'}
+        synced_at = self._synced_at(key, 'issues')
+        if synced_at is not None:
+            params['since'] = synced_at.isoformat() + 'Z'
+        changed = list_size('issues', **params)
+        cost += page_count(changed)
+
+        if self._synced_at(key, 'pulls') is None:
+            cost += page_count(list_size('pulls', state='all'))
+        else:
+            # Страницы, запрошенные заранее, тоже расходуют лимит
+            cost += page_count(changed) + PAGE_WINDOW - 1
+
+        return cost
+
+    # Отчёты
+
+    def active_commiters(self, owner, repo, branch, from_date, to_date,
+                         limit=30):
+        """Самые активные участники ветки за период."""
+        # При равном количестве коммитов выше тот, чей коммит новее, - в
+        # таком же порядке участники оказываются при обходе истории
+        return self._query(
+            'SELECT c.login, COUNT(*) AS n FROM commits c '
+            'JOIN branch_commits b ON b.repo = c.repo AND b.sha = c.sha '
+            'WHERE b.repo = ? AND b.branch = ? '
+            'AND c.date >= ? AND c.date <= ? AND c.login IS NOT NULL '
+            'GROUP BY c.login ORDER BY n DESC, MAX(c.date) DESC LIMIT ?',
+            (f'{owner}/{repo}', branch, from_date.isoformat(),
+             to_date.isoformat(), limit))
+
+    def _count(self, table, condition, args, from_date, to_date, age):
+        """Количества открытых, закрытых и "старых" записей, созданных
+        на интервале анализа."""
+        # Запись старая, если (today() - created_at).days > age
+        stale_before = (today() - timedelta(days=age + 1)).isoformat()
+        to = to_date.isoformat()
+        row = self._query(
+            'SELECT '
+            'SUM(state = \'open\' OR closed_at >= ?), '
+            'SUM(state = \'closed\' AND closed_at < ?), '
+            'SUM(state = \'open\' AND created_at <= ?) '
+            f'FROM {table} WHERE {condition} '
+            'AND created_at >= ? AND created_at < ?',
+            (to, to, stale_before) + args + (from_date.isoformat(), to))[0]
+        return tuple(value or 0 for value in row)
+
+    def count_pull_requests(self, owner, repo, branch, from_date, to_date,
+                            age=30):
+        """Количества открытых, закрытых и "старых" PR ветки."""
+        return self._count(
+            'pulls', 'repo = ? AND base = ?', (f'{owner}/{repo}', branch),
+            from_date, to_date, age)
+
+    def count_issues(self, owner, repo, from_date, to_date, age=14):
+        """Количества открытых, закрытых и "старых" issue без PR."""
+        return self._count(
+            'issues', 'repo = ? AND is_pr = 0', (f'{owner}/{repo}',),
+            from_date, to_date, age)
+
+
+# Временные ряды
+
+# Длительности окон временного ряда
+SERIES_PERIODS = ('daily', 'weekly', 'monthly')
+# Количество самых активных участников в строке временного ряда
+SERIES_MAX_COMMITERS = 5
+SERIES_ROW = '{:<10} {:<10} {:>7} {:>6} {:>6} {:>6} {:>6} {:>6} {:>6}  {}'
+SERIES_HEADER = SERIES_ROW.format(
+    'Начало', 'Конец', 'Коммиты', 'PR+', 'PR-', 'PR!', 'Iss+', 'Iss-', 'Iss!',
+    'Самые активные участники')
+
+
+def series_bounds(from_date, to_date, period):
+    """
+    Границы окон временного ряда на интервале [from_date, to_date).
+
+    Окна выровнены по календарю: сутки, неделя с понедельника, месяц с
+    первого числа. Первое и последнее окна могут быть неполными. Возвращает
+    список моментов datetime от from_date до to_date включительно.
+    """
+    bounds = [from_date]
+    start = from_date
+    while start < to_date:
+        midnight = datetime(start.year, start.month, start.day)
+        if period == 'daily':
+            start = midnight + timedelta(days=1)
+        elif period == 'weekly':
+            start = midnight + timedelta(days=7 - midnight.weekday())
+        else:
+            start = midnight.replace(day=1) + timedelta(days=32)
+            start = start.replace(day=1)
+        bounds.append(min(start, to_date))
+
+    return bounds
+
+
+def collect_commits(owner, repo, branch, from_date, to_date):
+    """
+    Коммиты ветки на интервале [from_date, to_date).
+
+    Возвращает пару списков (время, логин автора) в порядке возрастания
+    времени.
+    """
+    times, logins = [], []
+    with closing(commit_author_pages(owner, repo, branch, from_date, to_date,
+                                     allow_empty=True)) as pages:
+        for commits in pages:
+            for _, time_str, login in commits:
+                times.append(time_str)
+                logins.append(login)
+
+    # GitHub возвращает коммиты от новых к старым
+    times.reverse()
+    logins.reverse()
+    return times, logins
+
+
+def collect_items(pages, from_date, to_date):
+    """
+    Записи Item, созданные на интервале [from_date, to_date), в порядке
+    возрастания даты создания.
+
+    pages - генератор страниц, как для scan_items.
+    """
+    from_time, to_time = isotime(from_date), isotime(to_date)
+    collected = []
+    with closing(pages):
+        for items in pages:
+            collected.extend(item for item in items
+                             if from_time <= item.created < to_time)
+            if items and items[-1].created < from_time:
+                break
+
+    collected.sort(key=attrgetter('created'))
+    return collected
+
+
+def series_commiters(times, logins, bounds, limit=SERIES_MAX_COMMITERS):
+    """
+    Количество коммитов и самые активные участники в каждом окне.
+
+    times - отсортированные по возрастанию времена коммитов, logins -
+    соответствующие им логины, bounds - границы окон в формате isotime.
+    Коммиты окна находятся двоичным поиском, поэтому каждый коммит
+    просматривается один раз. Возвращает список пар (количество коммитов,
+    [(login, count)]).
+    """
+    edges = [bisect.bisect_left(times, bound) for bound in bounds]
+    result = []
+    for lo, hi in zip(edges, edges[1:]):
+        # Подсчитывать от новых коммитов к старым, как select_active_commiters,
+        # чтобы участники с равным числом коммитов шли в том же порядке
+        commiters = CommitCounter()
+        for i in range(hi - 1, lo - 1, -1):
+            commiters.add(logins[i])
+        result.append((hi - lo, commiters.most_common(limit)))
+
+    return result
+
+
+def series_counts(items, bounds, age, now=None):
+    """
+    Количества открытых, закрытых и "старых" элементов в каждом окне.
+
+    items - записи Item в порядке возрастания даты создания, bounds -
+    границы окон в формате isotime. Каждое окно - непрерывный отрезок items,
+    который находится двоичным поиском и подсчитывается classify. now -
+    дата, от которой отсчитывается возраст "старых" элементов, по умолчанию
+    сегодняшняя.
+    """
+    created = [item.created for item in items]
+    edges = [bisect.bisect_left(created, bound) for bound in bounds]
+    # Элемент старый, если (today() - created).days > age
+    stale_time = isotime((now or today()) - timedelta(days=age + 1))
+    return [classify(items[lo:hi], bounds[i], bounds[i + 1], stale_time)
+            for i, (lo, hi) in enumerate(zip(edges, edges[1:]))]
+
+
+def format_series(owner, repo, branch, from_date, to_date, period, jobs=1,
+                  pr_age=30, issue_age=14, snapshot=None):
+    """
+    Отчёт по окнам временного ряда.
+
+    Коммиты, PR и issue за весь интервал [from_date, to_date) загружаются
+    один раз, после чего для каждого окна подсчитываются количество
+    коммитов, самые активные участники и количества открытых (+), закрытых
+    (-) и "старых" (!) PR и issue - так же, как в обычных отчётах. Таблица
+    по всем окнам возвращается одним текстом. Если передан снимок snapshot,
+    данные берутся из него.
+    """
+    now = None
+    if snapshot is not None:
+        commits = snapshot.commits(owner, repo, branch, from_date, to_date)
+        pulls = snapshot.items('pulls', owner, repo, from_date, to_date,
+                               branch)
+        issues = snapshot.items('issues', owner, repo, from_date, to_date)
+        now = snapshot.today
+    else:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            commits = executor.submit(
+                collect_commits, owner, repo, branch, from_date, to_date)
+            pulls = executor.submit(
+                collect_items, pull_request_pages(owner, repo, branch),
+                from_date, to_date)
+            issues = executor.submit(
+                collect_items, issue_pages(owner, repo), from_date, to_date)
+            commits, pulls, issues = \
+                commits.result(), pulls.result(), issues.result()
+
+    bounds = series_bounds(from_date, to_date, period)
+    times = [isotime(bound) for bound in bounds]
+    rows = zip(bounds, bounds[1:], series_commiters(*commits, times),
+               series_counts(pulls, times, pr_age, now),
+               series_counts(issues, times, issue_age, now))
+
+    lines = [SERIES_HEADER]
+    for start, end, (total, commiters), pr, issue in rows:
+        lines.append(
+            SERIES_ROW.format(
+                start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT), total,
+                *pr, *issue,
+                ', '.join('{} ({})'.format(*item) for item in commiters)))
+
+    return '\n'.join(lines)
+
+
+# Снимки данных
+
+# Версия формата снимка
+SNAPSHOT_VERSION = 2
+# Сколько записей помещается в одну строку снимка
+SNAPSHOT_ROWS = 1000
+
+
+def write_snapshot(path, owner, repo, branches, from_date, to_date,
+                   jobs=DEFAULT_JOBS):
+    """
+    Загружает данные для отчётов и сохраняет их в снимок path.
+
+    Снимок - сжатый gzip файл NDJSON. Первая строка описывает снимок
+    (репозиторий, ветки, интервал, дату и длины разделов в байтах), за ней
+    идут разделы коммитов, PR и issue. Каждый раздел - отдельный член gzip,
+    каждая строка которого содержит до SNAPSHOT_ROWS записей в поле rows:
+        c - коммиты: [время, логин автора, битовая маска веток];
+        p - PR: [дата создания, дата закрытия, открыт ли, базовая ветка];
+        i - issue: [дата создания, дата закрытия, открыта ли].
+    Записи каждого раздела идут в порядке убывания времени коммита или
+    даты создания. Коммиты нескольких веток загружаются, как в
+    select_branch_commiters, и записываются один раз. PR всех веток и
+    issue записываются от созданных до сих пор до созданных в начале
+    интервала. Разделы загружаются одновременно во временные файлы и
+    дописываются за первой строкой. Файл записывается атомарно.
+    """
+    import gzip
+
+    from_time = isotime(from_date)
+
+    def write_rows(f, kind, rows):
+        for start in range(0, len(rows), SNAPSHOT_ROWS):
+            line = json.dumps({'k': kind,
+                               'rows': rows[start:start + SNAPSHOT_ROWS]},
+                              ensure_ascii=False, separators=(',', ':'))
+            f.write(line.encode('utf-8') + b'\n')
+
+    def write_commits(raw):
+        primary = branches[0]
+        history = branch_history(owner, repo, primary, from_date, to_date)
+        with ThreadPoolExecutor(max_workers=PAGE_WINDOW) as executor:
+            others = [executor.submit(
+                          branch_commits, owner, repo, primary, history,
+                          branch, from_date, to_date)
+                      for branch in branches[1:]]
+            histories = [history] + [future.result() for future in others]
+
+        # {SHA: [время, логин, маска веток]} в порядке появления
+        commits = {}
+        for bit, listed in enumerate(histories):
+            for sha, time_str, login in listed:
+                row = commits.get(sha)
+                if row is None:
+                    commits[sha] = [time_str, login, 1 << bit]
+                else:
+                    row[2] |= 1 << bit
+        rows = list(commits.values())
+        rows.sort(key=lambda row: row[0], reverse=True)
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            write_rows(f, 'c', rows)
+
+    def write_items(raw, kind, pages, fields):
+        with closing(pages), gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for items in pages:
+                write_rows(f, kind, [fields(item) for item in items
+                                     if item.created >= from_time])
+                if items and items[-1].created < from_time:
+                    break
+
+    meta = {
+        'k': 'meta',
+        'version': SNAPSHOT_VERSION,
+        'repo': f'{owner}/{repo}',
+        'branches': list(branches),
+        'from': from_date.isoformat(),
+        'to': to_date.isoformat(),
+        'today': today().isoformat(),
+    }
+    tmp = path + '.tmp'
+    # Сжатые разделы коммитов, PR и issue
+    parts = [tempfile.TemporaryFile() for _ in range(3)]
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(write_commits, parts[0]),
+                executor.submit(
+                    write_items, parts[1], 'p',
+                    pull_request_pages(owner, repo),
+                    lambda item: [item.created, item.closed,
+                                  int(item.open), item.base]),
+                executor.submit(
+                    write_items, parts[2], 'i', issue_pages(owner, repo),
+                    lambda item: [item.created, item.closed,
+                                  int(item.open)]),
+            ]
+            for future in futures:
+                future.result()
+
+        meta['sections'] = [[kind, part.tell()]
+                            for kind, part in zip('cpi', parts)]
+        with open(tmp, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')
+                        + b'\n')
+            for part in parts:
+                part.seek(0)
+                for chunk in iter(partial(part.read, 1 << 20), b''):
+                    raw.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    finally:
+        for part in parts:
+            part.close()
+
+
+class Snapshot:
+    """
+    Снимок данных репозитория (см. write_snapshot).
+
+    Отчёты строятся по снимку без обращения к GitHub: методы отчётов те же,
+    что у SyncStore, поэтому снимок передаётся в функции отчётов вместо
+    локального хранилища. Файл отображается в память, и каждый отчёт
+    распаковывает только раздел нужного вида, не загружая снимок целиком:
+    записи раздела идут в порядке убывания времени, поэтому чтение
+    прекращается на первой записи старше начала интервала отчёта. Возраст
+    "старых" элементов отсчитывается от даты снимка, поэтому повторные
+    отчёты по нему совпадают.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._open() as f:
+            try:
+                meta = json.loads(f.readline())
+            except ValueError as e:
+                raise ValueError('Неправильный формат снимка: {}'.format(
+                    str(e)))
+        if meta.get('k') != 'meta' or meta.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Неподдерживаемый формат снимка')
+        self.owner, _, self.repo = meta['repo'].partition('/')
+        self.branches = meta['branches']
+        self.from_date = datetime.fromisoformat(meta['from'])
+        self.to_date = datetime.fromisoformat(meta['to'])
+        self.today = datetime.fromisoformat(meta['today'])
+
+        # {вид: смещение раздела}: разделы идут в конце файла
+        self._offsets = {}
+        offset = os.path.getsize(path) - sum(
+            length for _, length in meta['sections'])
+        for kind, length in meta['sections']:
+            self._offsets[kind] = offset
+            offset += length
+
+    @contextmanager
+    def _open(self, offset=0):
+        import gzip
+        import mmap
+
+        with open(self.path, 'rb') as raw, \
+                mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            data.seek(offset)
+            with gzip.GzipFile(fileobj=data) as f:
+                yield f
+
+    def close(self):
+        pass
+
+    def _rows(self, kind):
+        """Генератор списков записей раздела вида kind."""
+        prefix = '{{"k":"{}"'.format(kind).encode('utf-8')
+        with self._open(self._offsets[kind]) as f:
+            for line in f:
+                # Следующий раздел распаковывать не нужно
+                if not line.startswith(prefix):
+                    return
+                yield json.loads(line)['rows']
+
+    def _check(self, owner, repo, from_date, to_date, branch=None):
+        """Проверяет, что снимок содержит данные для отчёта."""
+        if (owner, repo) != (self.owner, self.repo):
+            raise RuntimeError('Снимок содержит данные репозитория {}/{}'
+                               .format(self.owner, self.repo))
+        if from_date < self.from_date or to_date > self.to_date:
+            raise RuntimeError('Снимок содержит данные с {} до {}'.format(
+                self.from_date.date(), self.to_date.date()))
+        if branch is not None and branch not in self.branches:
+            raise RuntimeError('Ветки {} нет в снимке'.format(branch))
+
+    def _stale_time(self, age):
+        # Элемент старый, если (дата снимка - created).days > age
+        return isotime(self.today - timedelta(days=age + 1))
+
+    def _commits(self, branch, from_date, to_date):
+        """Генератор пар (время, логин) коммитов ветки в порядке убывания
+        времени. Границы интервала включаются, как при запросе истории
+        ветки."""
+        mask = 1 << self.branches.index(branch)
+        from_time, to_time = isotime(from_date), isotime(to_date)
+        for rows in self._rows('c'):
+            for time_str, login, branches in rows:
+                if time_str < from_time:
+                    return
+                if branches & mask and time_str <= to_time:
+                    yield time_str, login
+
+    def _items(self, kind, from_date, branch=None):
+        """Генератор страниц записей Item вида kind ('p' или 'i'),
+        заканчивающийся на странице с записью старше from_date."""
+        from_time = isotime(from_date)
+        for rows in self._rows(kind):
+            items = [Item(*row) for row in rows
+                     if branch is None or row[3] == branch]
+            yield items
+            if rows and rows[-1][0] < from_time:
+                return
+
+    # Отчёты
+
+    def active_commiters(self, owner, repo, branch, from_date, to_date,
+                         limit=30):
+        """Самые активные участники ветки за период."""
+        self._check(owner, repo, from_date, to_date, branch)
+        commiters = CommitCounter()
+        for _, login in self._commits(branch, from_date, to_date):
+            commiters.add(login)
+        return commiters.most_common(limit)
+
+    def _count(self, pages, from_date, to_date, age):
+        from_time, to_time = isotime(from_date), isotime(to_date)
+        stale_time = self._stale_time(age)
+        total_open, total_closed, total_stale = 0, 0, 0
+        for items in pages:
+            o, c, s = classify(items, from_time, to_time, stale_time)
+            total_open += o
+            total_closed += c
+            total_stale += s
+        return total_open, total_closed, total_stale
+
+    def count_pull_requests(self, owner, repo, branch, from_date, to_date,
+                            age=30):
+        """Количества открытых, закрытых и "старых" PR ветки."""
+        self._check(owner, repo, from_date, to_date, branch)
+        return self._count(self._items('p', from_date, branch), from_date,
+                           to_date, age)
+
+    def count_issues(self, owner, repo, from_date, to_date, age=14):
+        """Количества открытых, закрытых и "старых" issue."""
+        self._check(owner, repo, from_date, to_date)
+        return self._count(self._items('i', from_date), from_date, to_date,
+                           age)
+
+    # Данные временного ряда (см. format_series)
+
+    def commits(self, owner, repo, branch, from_date, to_date):
+        """Пара списков (время, логин автора) коммитов ветки в порядке
+        возрастания времени, как collect_commits."""
+        self._check(owner, repo, from_date, to_date, branch)
+        times, logins = [], []
+        for time_str, login in self._commits(branch, from_date, to_date):
+            times.append(time_str)
+            logins.append(login)
+        times.reverse()
+        logins.reverse()
+        return times, logins
+
+    def items(self, kind, owner, repo, from_date, to_date, branch=None):
+        """Записи Item PR (kind - 'pulls') или issue, созданные на
+        интервале, в порядке возрастания даты создания, как
+        collect_items."""
+        self._check(owner, repo, from_date, to_date, branch)
+        pages = self._items('p' if kind == 'pulls' else 'i', from_date,
+                            branch)
+        return collect_items(pages, from_date, to_date)
+
+
+# Планирование запуска
+
+# Сколько запросов стоит подсчёт через Search API (см. search_items) и
+# выборка участников по недельной статистике вместе с коммитами неполных
+# недель (см. stats_active_commiters)
+SEARCH_COST = 3
+STATS_COST = 3
+PLAN_ROW = '{:<14} {:<36} {:<8} {:>8}'
+
+
+class Plan:
+    """
+    План запуска: способ формирования каждого отчёта и оценка количества
+    запросов, которые он израсходует из каждого лимита.
+
+    stats, search_pulls и search_issues - выбранные способы, которыми
+    build_reports заменяет параметры запуска.
+    """
+
+    def __init__(self):
+        # [(отчёт, способ, лимит, количество запросов)]
+        self.steps = []
+        # Сколько запросов израсходовала сама оценка
+        self.probes = 0
+        self.stats = False
+        self.search_pulls = False
+        self.search_issues = False
+
+    def add(self, report, strategy, resource, cost):
+        """Добавляет в план шаг формирования отчёта report."""
+        self.steps.append((report, strategy, resource, cost))
+
+    def cost(self, resource):
+        """Оценка количества запросов лимита resource."""
+        return sum(cost for _, _, r, cost in self.steps if r == resource)
+
+    def shortage(self, remaining):
+        """
+        Лимиты, остатка которых не хватит на запуск.
+
+        remaining - словарь {лимит: остаток}. Возвращает список лимитов.
+        Лимит Search API восстанавливается каждую минуту, поэтому не
+        проверяется.
+        """
+        return [resource for resource, left in remaining.items()
+                if self.cost(resource) > left]
+
+    def format(self, remaining):
+        """Текст плана с остатками лимитов remaining."""
+        lines = ['План запуска',
+                 PLAN_ROW.format('Отчёт', 'Способ', 'Лимит', 'Запросов')]
+        for report, strategy, resource, cost in self.steps:
+            lines.append(PLAN_ROW.format(report, strategy, resource or '-',
+                                         cost))
+        resources = sorted({r for _, _, r, _ in self.steps if r})
+        for resource in resources:
+            if resource in remaining:
+                lines.append('Лимит {}: нужно {}, осталось {}'.format(
+                    resource, self.cost(resource), remaining[resource]))
+            else:
+                lines.append(
+                    'Лимит {}: нужно {}, восстанавливается каждую '
+                    'минуту'.format(resource, self.cost(resource)))
+        lines.append('Оценка израсходовала запросов: {}'.format(self.probes))
+        return '\n'.join(lines)
+
+
+def list_size(url, params):
+    """
+    Количество элементов списка REST API, полученное одним запросом.
+
+    Запрашивается страница из одного элемента: номер последней страницы в
+    ссылке rel="last" заголовка Link равен длине списка.
+    """
+    r = http_get(url, params=dict(params, per_page=1))
+
+    # Бросить исключение, если код ответа не 200
+    if r.status_code != 200:
+        raise RuntimeError(
+            'Сервер вернул код ошибки {}'.format(r.status_code))
+
+    last_url = r.links.get('last', {}).get('url')
+    if last_url:
+        return page_number(last_url) or 0
+    try:
+        return len(r.json())
+    except Exception as e:
+        raise RuntimeError('Неожиданный ответ сервера: {}'.format(str(e)))
+
+
+def page_count(size):
+    """Количество страниц списка из size элементов (хотя бы одна)."""
+    return max(1, -(-size // PER_PAGE))
+
+
+def created_since(size, from_date, start_date):
+    """
+    Оценка количества элементов списка из size элементов, созданных после
+    from_date, если они создавались равномерно с start_date.
+    """
+    now = utcnow()
+    if from_date <= start_date or now <= start_date:
+        return size
+    if from_date >= now:
+        return 0
+    return min(size, int(size * ((now - from_date) / (now - start_date))) + 1)
+
+
+def plan_run(owner, repo, from_date, options, stats=False, store=None,
+             choose=True):
+    """
+    Оценивает количество запросов, которые израсходует запуск, и выбирает
+    для каждого отчёта самый дешёвый способ. Если choose не задан, способы
+    не выбираются, а оцениваются заданные параметрами запуска (stats и
+    options.search).
+
+    Длина каждого нужного списка (коммиты ветки за интервал анализа, PR,
+    issue) запрашивается одним запросом (см. list_size). Коммиты за
+    интервал подсчитываются точно, а доля PR и issue, созданных после
+    начала интервала, до которой доходит обход с остановкой, оценивается
+    по равномерному распределению со дня создания репозитория. Поиск
+    выбирается, если он дешевле обхода; недельная статистика - если она
+    доступна и дешевле обхода коммитов. Если задан options.snapshot_out,
+    оценивается сохранение снимка. Возвращает объект Plan.
+    """
+    plan = Plan()
+    root = f'{GITHUB_API_ROOT}/repos/{owner}/{repo}'
+    to_date, branches = options.to_date, options.branches
+    # Временной ряд строится по спискам для первой ветки (см. run)
+    series = options.series is not None
+    if series:
+        branches = branches[:1]
+    multi = len(branches) > 1
+    resource = 'graphql' if graphql_enabled() else 'core'
+    start_date = get_repository_start_date(owner, repo)
+
+    def size(kind, **params):
+        plan.probes += 1
+        return list_size(f'{root}/{kind}', params)
+
+    def scan_cost(total):
+        """Страницы обхода с остановкой списка из total элементов."""
+        pages = page_count(created_since(total, from_date, start_date))
+        if resource == 'core':
+            # Страницы, запрошенные заранее, тоже расходуют лимит
+            pages = min(page_count(total), pages + PAGE_WINDOW - 1)
+        return pages
+
+    if options.snapshot_out is not None:
+        # Снимок сохраняется обходом списков всех веток, без поиска и
+        # недельной статистики (см. write_snapshot)
+        branches = options.branches
+        plan.add('снимок', 'история ветки ' + branches[0], resource,
+                 page_count(size('commits', sha=branches[0],
+                                 since=from_date.isoformat(),
+                                 until=to_date.isoformat())))
+        if len(branches) > 1:
+            plan.add('снимок', 'сравнение веток', 'core',
+                     2 * (len(branches) - 1))
+        pulls = size('pulls', state='all')
+        plan.add('снимок', 'обход PR с остановкой', resource,
+                 scan_cost(pulls))
+        issues = size('issues', state='all')
+        if graphql_enabled():
+            issues -= pulls
+        plan.add('снимок', 'обход issue с остановкой', resource,
+                 scan_cost(max(issues, 0)))
+        plan.add('отчёты', 'снимок', None, 0)
+        return plan
+
+    if store is not None:
+        plan.add('синхронизация', 'изменения с прошлого запуска', 'core',
+                 store.sync_cost(owner, repo, branches, size))
+        plan.add('отчёты', 'локальная база', None, 0)
+        return plan
+
+    # Участники
+    commits = page_count(size('commits', sha=branches[0],
+                              since=from_date.isoformat(),
+                              until=to_date.isoformat()))
+    if multi:
+        plan.add('участники', 'история ветки ' + branches[0], resource,
+                 commits)
+        plan.add('участники', 'сравнение веток', 'core',
+                 2 * (len(branches) - 1))
+    elif (stats and not series and (commits > STATS_COST or not choose)
+          and branches[0] == get_repository(owner, repo).get(
+              'default_branch')):
+        plan.stats = True
+        plan.add('участники', 'недельная статистика', 'core', STATS_COST)
+    else:
+        plan.add('участники', 'обход коммитов', resource, commits)
+
+    # PR
+    pulls = size('pulls', state='all') if multi \
+        else size('pulls', state='all', base=branches[0])
+    scan = scan_cost(pulls)
+    search = SEARCH_COST * len(branches)
+    if not series and (options.search or choose and scan > search):
+        plan.search_pulls = True
+        plan.add('PR', 'поиск', 'search', search)
+    else:
+        plan.add('PR', 'обход с остановкой', resource, scan)
+
+    # Issue. Список /issues REST API содержит и PR, а связь issues GraphQL
+    # API - нет
+    issues = size('issues', state='all')
+    if graphql_enabled():
+        issues -= pulls if multi else size('pulls', state='all')
+    scan = scan_cost(max(issues, 0))
+    if not series and (options.search or choose and scan > SEARCH_COST):
+        plan.search_issues = True
+        plan.add('issue', 'поиск', 'search', SEARCH_COST)
+    else:
+        plan.add('issue', 'обход с остановкой', resource, scan)
+
+    return plan
+
+
+# Функции печати отчётов
+
+
+def format_active_commiters(
+        owner, repo, branch, from_date, to_date, max_commiters=30,
+        store=None, stats=False):
+    """
+    Самые активные участники.
+
+    Таблица из 2 столбцов: login автора, количество его
+    коммитов. Таблица отсортирована по количеству коммитов по убыванию. Не
+    более 30 строк. Анализ производится на заданном периоде времени и заданной
+    ветке.
+    """
+    commiters = select_active_commiters(
+        owner, repo, branch, from_date, to_date, limit=max_commiters,
+        store=store, stats=stats)
+    return ACTIVE_COMMITERS_TEMPLATE.format(
+        '\n'.join('{:<20.20} {:6d}'.format(*item) for item in commiters)
+    )
+
+
+def format_pull_requests(owner, repo, branch, from_date, to_date, age=30,
+                         store=None, search=False):
+    """
+    Отчёт по PR.
+
+    Количество открытых и закрытых pull requests на заданном периоде времени по
+    дате создания PR и заданной ветке, являющейся базовой для этого PR.
+
+    Количество "старых" pull requests на заданном периоде времени по дате
+    создания PR и заданной ветке, являющейся базовой для этого PR.
+
+    Pull request считается старым, если он не закрывается в течение 30 дней
+    и до сих пор открыт.
+    """
+    return PR_TEMPLATE.format(
+        *count_pull_requests(owner, repo, branch, from_date, to_date, age=age,
+                             store=store, search=search))
+
+
+def format_issues(owner, repo, from_date, to_date, age=14, store=None,
+                  search=False):
+    """
+    Отчёт по issues.
+
+    Количество открытых и закрытых issues на заданном периоде времени.
+    Количество "старых" issues на заданном периоде времени по дате создания
+    issue. Issue считается старым, если он не закрывается в течение 14 дней.
+    """
+    return ISSUES_TEMPLATE.format(
+        *count_issues(owner, repo, from_date, to_date, age=age, store=store,
+                      search=search))
+
+
+def format_branches(owner, repo, branches, from_date, to_date,
+                    max_commiters=30, age=30, store=None, search=False):
+    """
+    Отчёты по самым активным участникам и PR каждой из веток branches.
+
+    Коммиты, общие для нескольких веток, и список PR всех веток
+    запрашиваются один раз (см. select_branch_commiters и
+    count_branch_pull_requests), после чего отчёты выводятся по веткам в
+    порядке их перечисления.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        commiters = submit(
+            executor, select_branch_commiters, owner, repo, branches,
+            from_date, to_date, limit=max_commiters, store=store)
+        pulls = submit(
+            executor, count_branch_pull_requests, owner, repo, branches,
+            from_date, to_date, age=age, store=store, search=search)
+        commiters, pulls = commiters.result(), pulls.result()
+
+    return '\n'.join(
+        '\n'.join([
+            BRANCH_TEMPLATE.format(branch),
+            ACTIVE_COMMITERS_TEMPLATE.format('\n'.join(
+                '{:<20.20} {:6d}'.format(*item)
+                for item in commiters[branch])),
+            PR_TEMPLATE.format(*pulls[branch])])
+        for branch in branches)
+
+
+def print_active_commiters(
+        owner, repo, branch, from_date, to_date, max_commiters=30):
+    """Печатает отчёт по самым активным участникам."""
+    print(format_active_commiters(
+        owner, repo, branch, from_date, to_date, max_commiters=max_commiters))
+
+
+def print_pull_requests(owner, repo, branch, from_date, to_date, age=30):
+    """Печатает отчёт по PR."""
+    print(format_pull_requests(
+        owner, repo, branch, from_date, to_date, age=age))
+
+
+def print_issues(owner, repo, from_date, to_date, age=14):
+    """Печатает отчёт по issues."""
+    print(format_issues(owner, repo, from_date, to_date, age=age))
+
+
+def run_reports(reports, jobs, verbose):
+    """
+    Формирует отчёты и печатает их в исходном порядке.
+
+    reports - список кортежей (описание, сообщение, функция без
+    аргументов, возвращающая текст отчёта). Отчёты формируются
+    одновременно пулом из jobs потоков, но печатаются строго в порядке
+    следования в списке, чтобы вывод не зависел от того, какой из отчётов
+    был готов раньше. При первой ошибке, в каком бы отчёте она ни
+    произошла, остальные отчёты прерываются: их ещё не отправленные
+    запросы не отправляются (см. Cancelled).
+    """
+    global _cancel
+    _cancel = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = []
+            for _, message, func in reports:
+                if verbose:
+                    print(message)
+                futures.append(executor.submit(func))
+
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = next((future for future in futures if future in done
+                           and future.exception() is not None), None)
+            if failed is not None:
+                _cancel.set()
+                for future in futures:
+                    future.cancel()
+
+            for (name, _, _), future in zip(reports, futures):
+                if future is failed:
+                    print('Не удалось сформировать отчёт по {}: {}'.format(
+                        name, str(future.exception())))
+                    return -1
+                # После ошибки выводятся только отчёты, готовые до неё
+                if future in done and future.exception() is None:
+                    print(future.result())
+    finally:
+        _cancel = None
+
+    return 0
+
+
+def build_reports(owner, repo, from_date, options, store=None, stats=False,
+                  plan=None):
+    """
+    Список отчётов по репозиторию для run_reports.
+
+    Отчёты по участникам, PR и issue не зависят друг от друга, поэтому
+    могут формироваться одновременно. Если задано несколько веток, отчёты
+    по участникам и PR всех веток формируются вместе (см.
+    format_branches), а недельная статистика не используется. Если
+    передан план plan, отчёты формируются выбранными в нём способами.
+    """
+    branch, to_date = options.branch, options.to_date
+    search_pulls = search_issues = options.search
+    if plan is not None:
+        stats = plan.stats
+        search_pulls, search_issues = plan.search_pulls, plan.search_issues
+
+    if len(options.branches) > 1:
+        return [
+            ('веткам',
+             'Получение данных для отчётов по веткам {}.'.format(
+                 ', '.join(options.branches)),
+             partial(format_branches,
+                     owner, repo, options.branches, from_date, to_date,
+                     store=store, search=search_pulls)),
+            ('issue',
+             'Получение данных для отчёта по issue.',
+             partial(format_issues,
+                     owner, repo, from_date, to_date, store=store,
+                     search=search_issues)),
+        ]
+
+    return [
+        ('участникам',
+         'Получение данных для отчёта по самым активным участника.',
+         partial(format_active_commiters,
+                 owner, repo, branch, from_date, to_date, store=store,
+                 stats=stats)),
+        ('PR',
+         'Получение данных для отчёта по PR.',
+         partial(format_pull_requests,
+                 owner, repo, branch, from_date, to_date, store=store,
+                 search=search_pulls)),
+        ('issue',
+         'Получение данных для отчёта по issue.',
+         partial(format_issues,
+                 owner, repo, from_date, to_date, store=store,
+                 search=search_issues)),
+    ]
+
+
+# Пакетный режим
+
+# Минимальный бюджет запросов, при котором начинается анализ очередного
+# репозитория: при меньшем остатке задание сразу остановилось бы до
+# восстановления лимита
+MIN_JOB_BUDGET = 10
+# Лимиты, запросы которых резервируют задания пакетного режима. Лимит
+# Search API восстанавливается каждую минуту, поэтому не резервируется
+RESERVED_LIMITS = ('core', 'graphql')
+
+
+def read_batch(path):
+    """
+    Читает файл со ссылками на репозитории.
+
+    Пустые строки и строки, начинающиеся с "#", пропускаются. Возвращает
+    список кортежей (URL, владелец, репозиторий).
+    """
+    repositories = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            url = line.strip()
+            if not url or url.startswith('#'):
+                continue
+            try:
+                owner, repo = parse_url(url)
+            except Exception:
+                raise ValueError(
+                    'строка {}: неправильный формат URL ({})'.format(
+                        number, url))
+            repositories.append((url, owner, repo))
+
+    return repositories
+
+
+def analyze_repository(owner, repo, options, store=None):
+    """
+    Формирует все отчёты по репозиторию и возвращает их текст.
+
+    Сначала оценивается количество запросов, которые израсходует анализ
+    (см. plan_run), и оценка резервируется в лимитах (см.
+    RateLimitGovernor.reserve) до конца анализа. С опцией --plan отчёты
+    формируются самыми дешёвыми способами, иначе - заданными параметрами
+    запуска.
+    """
+    from_date, stats = options.from_date, False
+    if from_date is None:
+        from_date = get_repository_start_date(owner, repo)
+        stats = options.stats
+
+    plan = plan_run(owner, repo, from_date, options, stats=stats,
+                    store=store, choose=options.plan)
+    reservation = _governor.reserve(
+        {resource: plan.cost(resource) for resource in RESERVED_LIMITS})
+    context = _reservation.set(reservation)
+    try:
+        if store is not None:
+            store.sync(owner, repo, options.branches, jobs=1)
+
+        # Репозитории уже анализируются одновременно, поэтому отчёты по
+        # одному репозиторию формируются последовательно
+        return '\n'.join(func() for _, _, func in build_reports(
+            owner, repo, from_date, options, store=store, plan=plan))
+    finally:
+        _reservation.reset(context)
+        _governor.release(reservation)
+
+
+def run_batch(options):
+    """
+    Анализирует репозитории из файла options.batch.
+
+    Репозитории анализируются одновременно пулом из options.jobs потоков.
+    Все запросы к API расходуют общий лимит (см. RateLimitGovernor): когда
+    он исчерпан, задания приостанавливаются до его восстановления. Новое
+    задание не начинается, пока в лимите меньше MIN_JOB_BUDGET запросов,
+    а после оценки своих запросов - пока их не хватает с учётом резервов
+    уже начатых заданий (см. analyze_repository). Отчёт по каждому
+    репозиторию печатается сразу после готовности.
+    """
+    try:
+        repositories = read_batch(options.batch)
+    except (OSError, ValueError) as e:
+        print('Не удалось прочитать список репозиториев: {}'.format(str(e)))
+        return 2
+
+    # Резервы заданий сравниваются с известными остатками лимитов
+    remaining = rate_limit()
+    if graphql_enabled():
+        rate_limit('graphql')
+    if options.verbose:
+        print('Репозиториев: {}, оставший запас запросов: {}'.format(
+            len(repositories), remaining))
+
+    store = SyncStore(options.db_path) if options.sync else None
+
+    def job(owner, repo):
+        _governor.wait_for(MIN_JOB_BUDGET)
+        return analyze_repository(owner, repo, options, store=store)
+
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=options.jobs) as executor:
+            futures = {executor.submit(job, owner, repo): url
+                       for url, owner, repo in repositories}
+            for future in as_completed(futures):
+                print('\nРепозиторий {}'.format(futures[future]))
+                try:
+                    print(future.result(), flush=True)
+                except Exception as e:
+                    failed += 1
+                    print('Не удалось сформировать отчёты: {}'.format(str(e)),
+                          flush=True)
+    finally:
+        if store is not None:
+            store.close()
+
+    if options.verbose:
+        print('\nГотово: {}, с ошибками: {}, оставший запас запросов: '
+              '{}'.format(len(repositories) - failed, failed, rate_limit()))
+
+    return -1 if failed else 0
+
+
+# Сервис отчётов
+
+# Сколько отчётов хранится в памяти сервиса и сколько секунд отчёт считается
+# актуальным
+SERVICE_CACHE_SIZE = 256
+SERVICE_CACHE_TTL = 600
+# Сколько разных отчётов может ожидать формирования: запросы сверх этого
+# отклоняются, а не ставятся в очередь
+SERVICE_MAX_PENDING = 32
+
+
+class ServiceBusy(RuntimeError):
+    """Слишком много отчётов ожидает формирования."""
+
+
+class ReportCache:
+    """
+    Кэш отчётов сервиса.
+
+    Готовые отчёты хранятся не дольше ttl секунд, при превышении size
+    вытесняются давно не запрашивавшиеся. Отчёты формируются пулом
+    executor; одновременные запросы одного и того же отчёта ждут одно
+    формирование, а не запускают каждый своё.
+    """
+
+    def __init__(self, executor, size=SERVICE_CACHE_SIZE,
+                 ttl=SERVICE_CACHE_TTL, max_pending=SERVICE_MAX_PENDING):
+        self.executor = executor
+        self.size = size
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.hits = 0
+        self.misses = 0
+        # Отчёты в формате {ключ: (время устаревания, отчёт)}
+        self._reports = OrderedDict()
+        # Формируемые отчёты в формате {ключ: Future}
+        self._pending = {}
+        # Колбэк future может выполниться сразу в вызывающем потоке
+        self._lock = threading.RLock()
+
+    def get(self, key, func):
+        """
+        Возвращает отчёт с ключом key, при необходимости формируя его
+        функцией func без аргументов.
+        """
+        with self._lock:
+            entry = self._reports.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._reports.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            future = self._pending.get(key)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    raise ServiceBusy(
+                        'Слишком много запросов, повторите позже')
+                self.misses += 1
+                future = self.executor.submit(func)
+                self._pending[key] = future
+                future.add_done_callback(partial(self._done, key))
+
+        return future.result()
+
+    def _done(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            # Ошибки не кэшируются: следующий запрос сформирует отчёт заново
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._reports[key] = (time.monotonic() + self.ttl, future.result())
+            self._reports.move_to_end(key)
+            while len(self._reports) > self.size:
+                self._reports.popitem(last=False)
+
+
+def service_parameters(query, options):
+    """
+    Разбирает параметры запроса отчёта.
+
+    Возвращает кортеж (владелец, репозиторий, ветка, дата начала или None,
+    дата окончания, возраст "старых" элементов или None). Неправильные
+    параметры приводят к ValueError. Если дата окончания не задана ни в
+    запросе, ни опцией -t, это сегодняшняя дата на момент запроса: сервис
+    работает дольше суток.
+    """
+    params = {k: v[-1] for k, v in parse_qs(query).items()}
+    try:
+        owner, repo = params['repo'].split('/')
+    except (KeyError, ValueError):
+        raise ValueError('параметр repo должен иметь вид владелец/репозиторий')
+    if not owner or not repo:
+        raise ValueError('параметр repo должен иметь вид владелец/репозиторий')
+
+    from_date = params.get('from')
+    if from_date is not None:
+        from_date = datetime.strptime(from_date, DATE_FORMAT)
+    to_date = options.to_date if options.to_date_set else today()
+    if 'to' in params:
+        to_date = datetime.strptime(params['to'], DATE_FORMAT)
+    age = params.get('age')
+    if age is not None:
+        age = int(age)
+        if age < 0:
+            raise ValueError('возраст не может быть отрицательным')
+
+    return (owner, repo, params.get('branch', options.branch), from_date,
+            to_date, age)
+
+
+def service_report(kind, owner, repo, branch, from_date, to_date, age,
+                   options):
+    """Формирует отчёт сервиса kind и возвращает его в виде словаря."""
+    _governor.wait_for(MIN_JOB_BUDGET)
+
+    stats = from_date is None and options.stats
+    if from_date is None:
+        from_date = get_repository_start_date(owner, repo)
+
+    report = {
+        'repo': '{}/{}'.format(owner, repo),
+        'from': from_date.strftime(DATE_FORMAT),
+        'to': to_date.strftime(DATE_FORMAT)
+    }
+    if kind == 'commiters':
+        report['branch'] = branch
+        report['commiters'] = [
+            {'login': login, 'commits': count}
+            for login, count in select_active_commiters(
+                owner, repo, branch, from_date, to_date, stats=stats)]
+        return report
+
+    if kind == 'pulls':
+        report['branch'] = branch
+        report['age'] = 30 if age is None else age
+        counts = count_pull_requests(owner, repo, branch, from_date, to_date,
+                                     age=report['age'], search=options.search)
+    else:
+        report['age'] = 14 if age is None else age
+        counts = count_issues(owner, repo, from_date, to_date,
+                              age=report['age'], search=options.search)
+    report.update(zip(('open', 'closed', 'stale'), counts))
+    return report
+
+
+def json_handler():
+    """
+    Базовый класс обработчиков запросов, отвечающих в формате JSON.
+
+    http.server нужен только сервису и приёму веб-хуков, поэтому он
+    импортируется, а классы обработчиков создаются при их запуске.
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class JsonHandler(BaseHTTPRequestHandler):
+        """Обработчик запросов, отвечающий в формате JSON."""
+
+        protocol_version = 'HTTP/1.1'
+
+        def send_json(self, code, data, headers=None):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if self.server.verbose:
+                super().log_message(format, *args)
+
+    return JsonHandler
+
+
+def report_handler():
+    """Класс обработчика запросов сервиса отчётов (см. json_handler)."""
+
+    class ReportHandler(json_handler()):
+        """
+        Обработчик запросов сервиса.
+
+        GET /commiters, /pulls и /issues возвращают соответствующий отчёт в
+        формате JSON, параметры передаются в строке запроса (см.
+        service_parameters).
+        """
+
+        kinds = ('commiters', 'pulls', 'issues')
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            kind = parts.path.strip('/')
+            if kind not in self.kinds:
+                return self.send_json(404, {'error': 'Неизвестный отчёт'})
+
+            service = self.server.service
+            try:
+                params = service_parameters(parts.query, service.options)
+            except ValueError as e:
+                return self.send_json(400, {'error': str(e)})
+
+            try:
+                report = service.cache.get(
+                    (kind,) + params,
+                    partial(service_report, kind, *params, service.options))
+            except ServiceBusy as e:
+                return self.send_json(503, {'error': str(e)},
+                                      {'Retry-After': '60'})
+            except Exception as e:
+                return self.send_json(502, {'error': str(e)})
+
+            self.send_json(200, report)
+
+    return ReportHandler
+
+
+class ReportService:
+    """HTTP-сервис отчётов по репозиториям."""
+
+    def __init__(self, options):
+        self.options = options
+        # Пул ограничивает количество одновременно формируемых отчётов, а
+        # значит и скорость расходования лимита запросов
+        self.executor = ThreadPoolExecutor(max_workers=options.jobs)
+        self.cache = ReportCache(self.executor)
+
+
+def run_service(options):
+    """Запускает HTTP-сервис отчётов по адресу options.serve."""
+    from http.server import ThreadingHTTPServer
+
+    service = ReportService(options)
+    try:
+        server = ThreadingHTTPServer(parse_address(options.serve),
+                                     report_handler())
+    except OSError as e:
+        print('Не удалось запустить сервис: {}'.format(str(e)))
+        return -1
+
+    server.service = service
+    server.verbose = options.verbose
+    server.daemon_threads = True
+    if options.verbose:
+        print('Сервис отчётов запущен на {}:{}'.format(
+            *server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False)
+
+    return 0
+
+
+# Приём веб-хуков
+
+# Как часто счётчики веб-хуков сверяются с GitHub, в секундах
+WEBHOOK_RECONCILE_INTERVAL = 6 * 3600
+
+
+def parse_address(address):
+    """Разбирает адрес вида [ХОСТ:]ПОРТ в пару (хост, порт)."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def verify_signature(secret, body, signature):
+    """
+    Проверяет подпись X-Hub-Signature-256 тела веб-хука: HMAC-SHA256 тела с
+    общим секретом в виде "sha256=<hex>".
+    """
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256)
+    return hmac.compare_digest('sha256=' + expected.hexdigest(), signature)
+
+
+class LiveCounters:
+    """
+    Счётчики, обновляемые событиями веб-хуков, в базе SQLite.
+
+    Для каждого репозитория хранятся количества коммитов участников в
+    каждой ветке и количества открытых и закрытых PR (по базовым веткам) и
+    issue за всю историю. Каждое событие обновляет их за O(1): для коммита
+    проверяется, не учтён ли он уже в ветке, для PR и issue запоминается
+    последнее известное состояние, и счётчики меняются только при его
+    изменении. Поэтому повторная доставка события ничего не портит.
+
+    Коммиты, PR и issue, появившиеся, пока веб-хуки не принимались, в
+    счётчики не попадают; количества PR и issue периодически сверяются с
+    GitHub (см. reconcile).
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS live_commits (
+        repo TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        login TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (repo, branch, login)
+    );
+    CREATE TABLE IF NOT EXISTS live_commit_shas (
+        repo TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        sha TEXT NOT NULL,
+        PRIMARY KEY (repo, branch, sha)
+    );
+    CREATE TABLE IF NOT EXISTS live_items (
+        repo TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        number INTEGER NOT NULL,
+        branch TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (repo, kind, number)
+    );
+    CREATE TABLE IF NOT EXISTS live_counts (
+        repo TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        open INTEGER NOT NULL,
+        closed INTEGER NOT NULL,
+        reconciled_at TEXT,
+        PRIMARY KEY (repo, kind, branch)
+    );
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(self.SCHEMA)
+
+    def close(self):
+        """Закрывает базу."""
+        self._db.close()
+
+    def _query(self, sql, args=()):
+        """Выполняет запрос на чтение и возвращает все строки."""
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    # События
+
+    def push(self, payload):
+        """Учитывает коммиты события push."""
+        ref = payload.get('ref', '')
+        if not ref.startswith('refs/heads/'):
+            return
+        key = payload['repository']['full_name']
+        branch = ref[len('refs/heads/'):]
+
+        with self._lock, self._db:
+            for commit in payload.get('commits', []):
+                login = (commit.get('author') or {}).get('username')
+                if not login:
+                    continue
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO live_commit_shas VALUES (?, ?, ?)',
+                    (key, branch, commit['id']))
+                if cursor.rowcount:
+                    self._db.execute(
+                        'INSERT INTO live_commits VALUES (?, ?, ?, 1) '
+                        'ON CONFLICT (repo, branch, login) DO UPDATE '
+                        'SET n = n + 1', (key, branch, login))
+
+    def item(self, kind, payload):
+        """
+        Учитывает событие pull_request (kind - 'pulls') или issues (kind -
+        'issues').
+        """
+        field = 'pull_request' if kind == 'pulls' else 'issue'
+        key = payload['repository']['full_name']
+        item, action = payload[field], payload.get('action')
+        branch = item['base']['ref'] if kind == 'pulls' else ''
+        state = item['state']
+        if action in ('deleted', 'transferred'):
+            state = None
+
+        with self._lock, self._db:
+            rows = self._db.execute(
+                'SELECT branch, state FROM live_items '
+                'WHERE repo = ? AND kind = ? AND number = ?',
+                (key, kind, item['number'])).fetchall()
+            if rows:
+                previous = rows[0]
+            elif action == 'opened':
+                previous = None
+            elif action == 'closed':
+                # Элемент открыт до начала приёма веб-хуков
+                previous = (branch, 'open')
+            elif action == 'reopened':
+                previous = (branch, 'closed')
+            else:
+                previous = (branch, item['state'])
+
+            if previous == (branch, state):
+                return
+            if previous is not None:
+                self._add(kind, key, previous[0], previous[1], -1)
+            if state is None:
+                self._db.execute(
+                    'DELETE FROM live_items '
+                    'WHERE repo = ? AND kind = ? AND number = ?',
+                    (key, kind, item['number']))
+            else:
+                self._add(kind, key, branch, state, 1)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO live_items VALUES (?, ?, ?, ?, ?)',
+                    (key, kind, item['number'], branch, state))
+
+    def _add(self, kind, key, branch, state, delta):
+        """Изменяет счётчик открытых или закрытых элементов на delta."""
+        column = 'open' if state == 'open' else 'closed'
+        self._db.execute(
+            'INSERT OR IGNORE INTO live_counts (repo, kind, branch, open, '
+            'closed) VALUES (?, ?, ?, 0, 0)', (key, kind, branch))
+        self._db.execute(
+            f'UPDATE live_counts SET {column} = MAX({column} + ?, 0) '
+            'WHERE repo = ? AND kind = ? AND branch = ?',
+            (delta, key, kind, branch))
+
+    # Сверка с GitHub
+
+    def reconcile(self, owner, repo, branches):
+        """
+        Заменяет количества открытых и закрытых PR базовых веток branches и
+        issue репозитория подсчитанными по данным GitHub.
+        """
+        key = f'{owner}/{repo}'
+        from_date = get_repository_start_date(owner, repo)
+        # Включая элементы, созданные сегодня
+        to_date = today() + timedelta(days=1)
+        counts = [('issues', '',
+                   count_issues(owner, repo, from_date, to_date))]
+        for branch in branches:
+            counts.append(('pulls', branch, count_pull_requests(
+                owner, repo, branch, from_date, to_date)))
+
+        reconciled_at = utcnow().isoformat()
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO live_counts VALUES (?, ?, ?, ?, ?, ?)',
+                [(key, kind, branch, opened, closed, reconciled_at)
+                 for kind, branch, (opened, closed, _) in counts])
+
+    def repositories(self):
+        """Словарь {(владелец, репозиторий): [базовые ветки PR]} всех
+        репозиториев, по которым есть счётчики."""
+        repositories = {}
+        for key, kind, branch in self._query(
+                'SELECT repo, kind, branch FROM live_counts '
+                'UNION SELECT repo, \'commits\', branch FROM live_commits'):
+            branches = repositories.setdefault(tuple(key.split('/', 1)), [])
+            if kind == 'pulls' and branch not in branches:
+                branches.append(branch)
+        return repositories
+
+    # Отчёты
+
+    def report(self, owner, repo, limit=30):
+        """Текущие значения счётчиков репозитория в виде словаря."""
+        key = f'{owner}/{repo}'
+        report = {'repo': key, 'commiters': {}, 'pulls': {}, 'issues': None}
+        for branch, login, n in self._query(
+                'SELECT branch, login, n FROM live_commits WHERE repo = ? '
+                'ORDER BY branch, n DESC, login', (key,)):
+            commiters = report['commiters'].setdefault(branch, [])
+            if len(commiters) < limit:
+                commiters.append({'login': login, 'commits': n})
+        for kind, branch, opened, closed, reconciled_at in self._query(
+                'SELECT kind, branch, open, closed, reconciled_at '
+                'FROM live_counts WHERE repo = ?', (key,)):
+            counts = {'open': opened, 'closed': closed,
+                      'reconciled_at': reconciled_at}
+            if kind == 'pulls':
+                report['pulls'][branch] = counts
+            else:
+                report['issues'] = counts
+        return report
+
+
+def webhook_handler():
+    """Класс обработчика веб-хуков GitHub (см. json_handler)."""
+
+    class WebhookHandler(json_handler()):
+        """
+        Обработчик веб-хуков GitHub.
+
+        POST принимает события push, pull_request и issues с подписью
+        X-Hub-Signature-256, GET /counters?repo=владелец/репозиторий
+        возвращает текущие значения счётчиков.
+        """
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not verify_signature(self.server.secret, body,
+                                    self.headers.get('X-Hub-Signature-256')):
+                return self.send_json(401, {'error': 'Неправильная подпись'})
+
+            event = self.headers.get('X-GitHub-Event')
+            counters = self.server.counters
+            try:
+                payload = json.loads(body)
+                if event == 'push':
+                    counters.push(payload)
+                elif event == 'pull_request':
+                    counters.item('pulls', payload)
+                elif event == 'issues':
+                    counters.item('issues', payload)
+                else:
+                    return self.send_json(200, {'status': 'ignored'})
+            except (ValueError, KeyError, TypeError) as e:
+                return self.send_json(
+                    400, {'error': 'Неожиданный формат события: {}'.format(e)})
+
+            self.send_json(200, {'status': 'ok'})
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if parts.path.strip('/') != 'counters':
+                return self.send_json(404, {'error': 'Неизвестный запрос'})
+            repo = parse_qs(parts.query).get('repo', [''])[-1]
+            if repo.count('/') != 1:
+                return self.send_json(400, {
+                    'error': 'параметр repo должен иметь вид '
+                             'владелец/репозиторий'})
+            self.send_json(200, self.server.counters.report(*repo.split('/')))
+
+    return WebhookHandler
+
+
+def reconcile_counters(counters, interval, verbose, stop):
+    """
+    Сверяет счётчики всех репозиториев с GitHub каждые interval секунд,
+    пока не установлено событие stop.
+    """
+    while not stop.wait(interval):
+        for (owner, repo), branches in counters.repositories().items():
+            try:
+                counters.reconcile(owner, repo, branches)
+            except Exception as e:
+                print('Не удалось сверить счётчики {}/{}: {}'.format(
+                    owner, repo, str(e)), flush=True)
+            else:
+                if verbose:
+                    print('Счётчики {}/{} сверены с GitHub'.format(
+                        owner, repo), flush=True)
+
+
+def run_webhook(options):
+    """Запускает приём веб-хуков по адресу options.webhook."""
+    if not options.webhook_secret:
+        print('Не задан секрет веб-хуков (--webhook-secret или '
+              'GITHUB_WEBHOOK_SECRET).')
+        return 2
+
+    import sqlite3
+    from http.server import ThreadingHTTPServer
+
+    try:
+        counters = LiveCounters(options.db_path)
+        server = ThreadingHTTPServer(parse_address(options.webhook),
+                                     webhook_handler())
+    except (OSError, sqlite3.Error) as e:
+        print('Не удалось запустить приём веб-хуков: {}'.format(str(e)))
+        return -1
+
+    server.counters = counters
+    server.secret = options.webhook_secret
+    server.verbose = options.verbose
+    server.daemon_threads = True
+
+    stop = threading.Event()
+    reconciler = threading.Thread(
+        target=reconcile_counters, daemon=True,
+        args=(counters, WEBHOOK_RECONCILE_INTERVAL, options.verbose, stop))
+    reconciler.start()
+
+    if options.verbose:
+        print('Приём веб-хуков запущен на {}:{}'.format(
+            *server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        counters.close()
+
+    return 0
+
+
+def main():
+    """Точка входа."""
+    try:
+        options = parse_args(sys.argv[1:])
+    except getopt.GetoptError as err:
+        print('Неизвестная опция: {}'.format(str(err)))
+        usage()
+        return 2
+    except ValueError as err:
+        print('Неправильное значение опции: {}'.format(str(err)))
+        usage()
+        return 2
+
+    if options.profile or options.profile_json:
+        configure_profiler()
+    try:
+        return run(options)
+    finally:
+        if options.use_cache:
+            _governor.save(os.path.join(options.cache_dir, RATE_STATE_FILE))
+        if _profiler is not None:
+            write_profile(options)
+
+
+def write_profile(options):
+    """Выводит и сохраняет телеметрию запуска."""
+    if options.profile:
+        print(_profiler.format(), file=sys.stderr)
+    if options.profile_json:
+        try:
+            with open(options.profile_json, 'w', encoding='utf-8') as f:
+                json.dump(_profiler.as_dict(), f, ensure_ascii=False,
+                          indent=2)
+        except OSError as e:
+            print('Не удалось сохранить профиль: {}'.format(str(e)),
+                  file=sys.stderr)
+
+
+def run_snapshot(options):
+    """Формирует отчёты по снимку options.snapshot_in."""
+    try:
+        snapshot = Snapshot(options.snapshot_in)
+    except (OSError, EOFError, ValueError, KeyError) as e:
+        print('Не удалось открыть снимок: {}'.format(str(e)))
+        return -1
+
+    owner, repo = snapshot.owner, snapshot.repo
+    if options.url is not None:
+        try:
+            owner, repo = parse_url(options.url)
+        except Exception:
+            print('Неправильный формат строки URL ({}).'.format(options.url))
+            return 2
+
+    # По умолчанию отчёты строятся по всем веткам снимка
+    if not options.branch_set:
+        options.branches = snapshot.branches
+        options.branch = snapshot.branches[0]
+
+    # Интервал анализа по умолчанию - интервал снимка. Конец интервала по
+    # умолчанию (сегодняшняя дата) ограничивается концом снимка, а
+    # заданный опцией -t должен попадать в снимок, как и начало (-f)
+    from_date = options.from_date or snapshot.from_date
+    if not options.to_date_set:
+        options.to_date = min(options.to_date, snapshot.to_date)
+    elif not snapshot.from_date <= options.to_date <= snapshot.to_date:
+        print('Снимок содержит данные с {} до {}'.format(
+            snapshot.from_date.date(), snapshot.to_date.date()))
+        return -1
+
+    if options.verbose:
+        print('Анализ репозитория {}/{} с {} до {} по снимку {} от {}'.format(
+            owner, repo, from_date.date(), options.to_date.date(),
+            options.snapshot_in, snapshot.today.date()))
+
+    if options.series is not None:
+        try:
+            print(format_series(owner, repo, options.branch, from_date,
+                                options.to_date, options.series,
+                                snapshot=snapshot))
+        except Exception as e:
+            print('Не удалось сформировать временной ряд: {}'.format(str(e)))
+            return -1
+        return 0
+
+    reports = build_reports(owner, repo, from_date, options, store=snapshot)
+    if run_reports(reports, options.jobs, options.verbose) != 0:
+        return -1
+    return 0
+
+
+def run(options):
+    """Выполняет запуск с разобранными параметрами options."""
+    url, from_date, to_date = options.url, options.from_date, options.to_date
+    verbose, branch = options.verbose, options.branch
+
+    if (url is None and options.batch is None and options.serve is None
+            and options.webhook is None and options.snapshot_in is None):
+        print('Не задан URL репозитория.')
+        usage()
+        return 2
+
+    # Отчёты по снимку строятся без обращения к GitHub
+    if options.snapshot_in is not None:
+        return run_snapshot(options)
+
+    configure_tokens(options.tokens, graphql=options.graphql, verbose=verbose)
+
+    if options.use_cache:
+        try:
+            configure_cache(options.cache_dir, options.cache_ttl)
+        except OSError as e:
+            print('Не удалось открыть кэш ответов: {}'.format(str(e)))
+            return -1
+        # Остатки лимитов, известные по ответам недавних запусков: для них
+        # /rate_limit перед запуском не запрашивается
+        _governor.load(os.path.join(options.cache_dir, RATE_STATE_FILE))
+
+    # Контрольные точки хранятся рядом с кэшем ответов
+    try:
+        configure_checkpoints(os.path.join(options.cache_dir, 'checkpoints'),
+                              resume=options.resume)
+    except OSError as e:
+        print('Не удалось открыть каталог контрольных точек: {}'.format(
+            str(e)))
+        return -1
+
+    if options.batch is not None:
+        return run_batch(options)
+
+    if options.serve is not None:
+        return run_service(options)
+
+    if options.webhook is not None:
+        return run_webhook(options)
+
+    # Попытаться разобрать переданный URL
+    try:
+        owner, repo = parse_url(url)
+    except Exception:
+        print('Неправильный формат строки URL ({}).'.format(url))
+        return 2
+
+    # Если дата начала анализа не указана, получить дату создания репозитория.
+    # Участников за всю историю основной ветки быстрее подсчитать по
+    # недельной статистике
+    stats = from_date is None and options.stats
+    if from_date is None:
+        try:
+            from_date = get_repository_start_date(owner, repo)
+        except Exception:
+            print('Неожиданный ответ сервера')
+            return -1
+
+    if verbose:
+        print('Анализ {} {} репозитория {} с {} до {}'.format(
+            'веток' if len(options.branches) > 1 else 'ветки',
+            ', '.join(options.branches), url, from_date.date(),
+            to_date.date()))
+
+    # Проверка исчерпания лимита запросов в GitHub
+    limit = rate_limit()
+
+    if limit == 0:
+        print('Лимит запросов в час исчерпан.')
+        sys.exit(-1)
+    elif verbose:
+        print('Оставший запас запросов: {}'.format(limit))
+
+    # Оценить количество запросов и выбрать способы формирования отчётов
+    plan = None
+    if options.plan or options.dry_run:
+        if verbose:
+            print('Оценка количества запросов.')
+        try:
+            if options.sync and options.series is None:
+                with closing(SyncStore(options.db_path)) as store:
+                    plan = plan_run(owner, repo, from_date, options,
+                                    stats=stats, store=store)
+            else:
+                plan = plan_run(owner, repo, from_date, options, stats=stats)
+            remaining = {'core': rate_limit()}
+            if graphql_enabled():
+                remaining['graphql'] = rate_limit('graphql')
+        except Exception as e:
+            print('Не удалось оценить количество запросов: {}'.format(str(e)))
+            return -1
+
+        print(plan.format(remaining))
+        if options.dry_run:
+            return 0
+
+        shortage = plan.shortage(remaining)
+        if shortage:
+            print('Запуск не начат: лимита {} не хватит на весь '
+                  'запуск.'.format(', '.join(shortage)))
+            return -1
+
+    if options.snapshot_out is not None:
+        # Сохранить снимок и построить отчёты по нему
+        if verbose:
+            print('Сохранение снимка {}.'.format(options.snapshot_out))
+        try:
+            write_snapshot(options.snapshot_out, owner, repo,
+                           options.branches, from_date, to_date,
+                           jobs=options.jobs)
+        except Exception as e:
+            print('Не удалось сохранить снимок: {}'.format(str(e)))
+            return -1
+
+        options.snapshot_in, options.from_date = \
+            options.snapshot_out, from_date
+        if run_snapshot(options) != 0:
+            return -1
+    elif options.series is not None:
+        # Временной ряд строится по однократно загруженным данным, поэтому
+        # локальная база и Search API для него не используются
+        if verbose:
+            print('Получение данных для временного ряда.')
+        try:
+            print(format_series(owner, repo, branch, from_date, to_date,
+                                options.series, jobs=options.jobs))
+        except Exception as e:
+            print('Не удалось сформировать временной ряд: {}'.format(str(e)))
+            return -1
+    else:
+        # Синхронизировать локальную базу, чтобы строить отчёты по ней
+        store = None
+        if options.sync:
+            if verbose:
+                print('Синхронизация локальной базы {}.'.format(
+                    options.db_path))
+            try:
+                store = SyncStore(options.db_path)
+                store.sync(owner, repo, options.branches, jobs=options.jobs)
+            except Exception as e:
+                print('Не удалось синхронизировать локальную базу: {}'.format(
+                    str(e)))
+                return -1
+
+        reports = build_reports(owner, repo, from_date, options, store=store,
+                                stats=stats, plan=plan)
+
+        try:
+            if run_reports(reports, options.jobs, verbose) != 0:
+                return -1
+        finally:
+            if store is not None:
+                store.close()
 
     if verbose:
         limit = rate_limit()
         print('Оставший запас запросов: {}'.format(limit))
+        if _cache is not None:
+            print('Кэш ответов: попаданий {}, промахов {}'.format(
+                _cache.hits, _cache.misses))
 
     return 0
 
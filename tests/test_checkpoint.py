@@ -0,0 +1,124 @@
+"""
+Тесты продолжения прерванного обхода с контрольной точки (--resume).
+
+Список /issues REST API подменяется в процессе: элементы отдаются
+страницами по PER_PAGE в порядке убывания даты создания, как у GitHub.
+
+Использование:
+python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import github_analyzer as ga  # noqa: E402
+
+NOW = datetime(2024, 6, 1)
+FROM_DATE, TO_DATE = datetime(2023, 1, 1), datetime(2100, 1, 1)
+
+
+def make_issue(number, created, closed=None):
+    if closed is None and number % 3 == 0:
+        closed = created + timedelta(days=3)
+    return {
+        'number': number,
+        'created_at': created.strftime(ga.GITHUB_TIME_FORMAT),
+        'closed_at': closed.strftime(ga.GITHUB_TIME_FORMAT)
+        if closed else None,
+        'state': 'closed' if closed else 'open',
+    }
+
+
+def make_issues(count, first=1):
+    """count issue с номерами от first, созданных раз в 6 часов до NOW, в
+    порядке убывания даты создания."""
+    return [make_issue(first + count - 1 - i, NOW - timedelta(hours=6 * i))
+            for i in range(count)]
+
+
+class FakeResponse:
+    """Страница списка с заголовком Link."""
+
+    status_code = 200
+    headers = {}
+
+    def __init__(self, items, links):
+        self.items = items
+        self.links = links
+
+    def json(self):
+        return self.items
+
+
+class ResumeTest(unittest.TestCase):
+    """Обход issue, прерванный ошибкой и продолжённый с --resume."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='test_checkpoint_')
+        self.http_get = ga.http_get
+        ga.http_get = self.fake_http_get
+        self.issues = []
+        self.fail_page = None
+
+    def tearDown(self):
+        ga.http_get = self.http_get
+        ga._checkpoints = None
+        shutil.rmtree(self.directory)
+
+    def fake_http_get(self, url, params=None, **kwargs):
+        query = dict(params or {})
+        if '?page=' in url:
+            url, page = url.split('?page=')
+            query['page'] = page
+        page = int(query.get('page', 1))
+        if page == self.fail_page:
+            raise ConnectionError('соединение разорвано')
+        pages = ga.page_count(len(self.issues))
+        links = {'last': {'url': '{}?page={}'.format(url, pages)}}
+        if page < pages:
+            links['next'] = {'url': '{}?page={}'.format(url, page + 1)}
+        start = (page - 1) * ga.PER_PAGE
+        return FakeResponse(self.issues[start:start + ga.PER_PAGE], links)
+
+    def count(self, resume=False):
+        ga.configure_checkpoints(self.directory, resume=resume)
+        return ga.count_issues('o', 'r', FROM_DATE, TO_DATE)
+
+    def test_resume_after_new_issues(self):
+        self.issues = make_issues(2000)
+        # Обход прерывается после контрольной точки на 10-й странице
+        self.fail_page = ga.CHECKPOINT_EVERY + 3
+        with self.assertRaises(Exception):
+            self.count()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        # До продолжения создано и закрыто 150 новых issue: остальные
+        # сдвинулись на полторы страницы. Продолжение с сохранённого
+        # номера страницы подсчитало бы 150 старых issue дважды, а новые -
+        # ни разу
+        self.issues = [make_issue(2001 + i, NOW + timedelta(hours=i),
+                                  closed=NOW + timedelta(hours=i))
+                       for i in reversed(range(150))] + self.issues
+        self.fail_page = None
+        resumed = self.count(resume=True)
+
+        self.assertEqual(resumed, self.count())
+
+    def test_resume_without_changes(self):
+        self.issues = make_issues(2000)
+        self.fail_page = ga.CHECKPOINT_EVERY + 3
+        with self.assertRaises(Exception):
+            self.count()
+
+        self.fail_page = None
+        self.assertEqual(self.count(resume=True), self.count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+Тест памяти, занимаемой обходом длинной истории: пик памяти обхода
+коммитов и issue не растёт с длиной истории (см. benchmarks/bench_memory.py).
+
+Использование:
+python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmarks'))
+
+import bench_memory  # noqa: E402
+
+# Самая длинная история в страницах: короче, чем в бенчмарке, чтобы тест
+# выполнялся за несколько секунд
+MAX_PAGES = 256
+
+
+class MemoryTest(unittest.TestCase):
+    """Пик памяти обходов при разной длине истории."""
+
+    def test_peak_does_not_grow(self):
+        for name, func in bench_memory.cases():
+            with self.subTest(name):
+                peaks = [bench_memory.measure(func, pages)[0]
+                         for pages in bench_memory.sizes(MAX_PAGES)]
+                self.assertLessEqual(peaks[-1] / peaks[0],
+                                     bench_memory.MAX_GROWTH, peaks)
+
+
+if __name__ == '__main__':
+    unittest.main()
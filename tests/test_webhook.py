@@ -0,0 +1,209 @@
+"""
+Тесты приёма веб-хуков: проверка подписи, переходы состояний PR и issue и
+итоговые значения счётчиков.
+
+Записанные доставки GitHub лежат в fixtures/webhooks: тела событий в том
+виде, в котором они подписаны, и список доставок (deliveries.json) с
+событием и заголовком X-Hub-Signature-256 каждой. Подписи вычислены с
+секретом SECRET.
+
+Использование:
+python -m pytest tests
+"""
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import github_analyzer as ga  # noqa: E402
+
+FIXTURES = os.path.join(HERE, 'fixtures', 'webhooks')
+SECRET = 'test-secret'
+REPO = ('octocat', 'Hello-World')
+
+
+def load_deliveries():
+    """Записанные доставки: {имя файла: (событие, тело, подпись)}."""
+    with open(os.path.join(FIXTURES, 'deliveries.json'),
+              encoding='utf-8') as f:
+        index = json.load(f)
+    deliveries = {}
+    for delivery in index:
+        with open(os.path.join(FIXTURES, delivery['file']), 'rb') as f:
+            deliveries[delivery['file'][:-len('.json')]] = (
+                delivery['event'], f.read(), delivery['signature'])
+    return deliveries
+
+
+class WebhookTest(unittest.TestCase):
+    """Приём веб-хуков сервером с webhook_handler() и LiveCounters."""
+
+    deliveries = load_deliveries()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='test_webhook_')
+        self.counters = ga.LiveCounters(
+            os.path.join(self.directory, 'github.db'))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          ga.webhook_handler())
+        self.server.counters = self.counters
+        self.server.secret = SECRET
+        self.server.verbose = False
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.counters.close()
+        shutil.rmtree(self.directory)
+
+    def request(self, method, path, body=None, headers=None):
+        """Отправляет запрос серверу и возвращает (код ответа, JSON)."""
+        connection = http.client.HTTPConnection(
+            *self.server.server_address[:2], timeout=10)
+        try:
+            connection.request(method, path, body=body,
+                               headers=headers or {})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def post(self, event, body, signature):
+        """Доставляет событие, как это делает GitHub."""
+        headers = {'X-GitHub-Event': event,
+                   'Content-Type': 'application/json'}
+        if signature is not None:
+            headers['X-Hub-Signature-256'] = signature
+        return self.request('POST', '/', body, headers)
+
+    def deliver(self, *names):
+        """Доставляет записанные события и проверяет, что они приняты."""
+        for name in names:
+            status, data = self.post(*self.deliveries[name])
+            self.assertEqual(status, 200, name)
+
+    def report(self):
+        status, data = self.request(
+            'GET', '/counters?repo={}/{}'.format(*REPO))
+        self.assertEqual(status, 200)
+        return data
+
+    def pulls(self, branch='main'):
+        counts = self.report()['pulls'][branch]
+        return counts['open'], counts['closed']
+
+    def issues(self):
+        counts = self.report()['issues']
+        return counts['open'], counts['closed']
+
+    def test_signature_rejected(self):
+        event, body, signature = self.deliveries['push-main']
+        wrong = 'sha256=' + hmac.new(b'other-secret', body,
+                                     hashlib.sha256).hexdigest()
+        cases = [
+            ('без подписи', body, None),
+            ('другой секрет', body, wrong),
+            ('изменённое тело', body.replace(b'alice', b'mallory'),
+             signature),
+            ('подпись SHA-1', body, 'sha1=' + signature[len('sha256='):]),
+        ]
+        for name, data, header in cases:
+            with self.subTest(name):
+                status, response = self.post(event, data, header)
+                self.assertEqual(status, 401)
+                self.assertIn('error', response)
+
+        self.assertEqual(self.report(), {
+            'repo': '{}/{}'.format(*REPO), 'commiters': {}, 'pulls': {},
+            'issues': None})
+
+    def test_recorded_signature_accepted(self):
+        status, response = self.post(*self.deliveries['push-main'])
+        self.assertEqual((status, response), (200, {'status': 'ok'}))
+
+    def test_push_counts_commits_once(self):
+        self.deliver('push-main', 'push-tag')
+        expected = {'main': [{'login': 'alice', 'commits': 2},
+                             {'login': 'bob', 'commits': 1}]}
+        self.assertEqual(self.report()['commiters'], expected)
+
+        # Повторная доставка не меняет счётчики
+        self.deliver('push-main')
+        self.assertEqual(self.report()['commiters'], expected)
+
+    def test_pull_request_transitions(self):
+        self.deliver('pull-request-1-opened', 'pull-request-2-opened')
+        self.assertEqual(self.pulls(), (2, 0))
+        self.deliver('pull-request-1-closed')
+        self.assertEqual(self.pulls(), (1, 1))
+        self.deliver('pull-request-2-closed')
+        self.assertEqual(self.pulls(), (0, 2))
+        self.deliver('pull-request-2-reopened')
+        self.assertEqual(self.pulls(), (1, 1))
+
+        # Повторная доставка закрытия уже учтённого PR ничего не меняет
+        self.deliver('pull-request-1-closed')
+        self.assertEqual(self.pulls(), (1, 1))
+
+    def test_pull_request_closed_before_webhooks(self):
+        # PR, открытие которого не было доставлено, считался открытым и
+        # учтён сверкой с GitHub, а не событием
+        self.deliver('pull-request-1-opened', 'pull-request-2-closed')
+        self.assertEqual(self.pulls(), (0, 1))
+
+    def test_issue_transitions(self):
+        self.deliver('issue-10-opened', 'issue-11-opened')
+        self.assertEqual(self.issues(), (2, 0))
+        self.deliver('issue-10-closed')
+        self.assertEqual(self.issues(), (1, 1))
+        self.deliver('issue-11-deleted')
+        self.assertEqual(self.issues(), (0, 1))
+
+    def test_totals(self):
+        with open(os.path.join(FIXTURES, 'deliveries.json'),
+                  encoding='utf-8') as f:
+            names = [delivery['file'][:-len('.json')]
+                     for delivery in json.load(f)]
+        # Все записанные доставки по порядку, затем все ещё раз
+        self.deliver(*names)
+        self.deliver(*names)
+
+        report = self.report()
+        self.assertEqual(report['commiters'], {
+            'main': [{'login': 'alice', 'commits': 2},
+                     {'login': 'bob', 'commits': 1}]})
+        self.assertEqual(
+            {branch: (counts['open'], counts['closed'])
+             for branch, counts in report['pulls'].items()},
+            {'main': (1, 1), 'develop': (1, 0)})
+        self.assertEqual(self.issues(), (0, 1))
+
+    def test_other_events_ignored(self):
+        status, response = self.post(*self.deliveries['star-created'])
+        self.assertEqual((status, response), (200, {'status': 'ignored'}))
+
+    def test_malformed_payload(self):
+        body = b'{"action": "opened"}'
+        signature = 'sha256=' + hmac.new(SECRET.encode('utf-8'), body,
+                                         hashlib.sha256).hexdigest()
+        status, response = self.post('issues', body, signature)
+        self.assertEqual(status, 400)
+        self.assertIn('error', response)
+
+
+if __name__ == '__main__':
+    unittest.main()